@@ -14,6 +14,9 @@ import json
 
 auth_bp = Blueprint('auth', __name__)
 
+# 会话最后活动时间的最小写入间隔
+LAST_ACTIVITY_INTERVAL = timedelta(seconds=60)
+
 def get_current_user():
     """获取当前登录用户"""
     session_token = request.headers.get('X-Session-Token')
@@ -31,9 +34,13 @@ def get_current_user():
     if not session_obj:
         return None
     
-    # 更新最后活动时间
-    session_obj.last_activity = datetime.utcnow()
-    db.session.commit()
+    # 更新最后活动时间（节流写入，避免每个请求都提交一次数据库）
+    # 旧记录可能以本地时间写入，时间差为负时同样立即改写为UTC
+    now = datetime.utcnow()
+    last_activity = session_obj.last_activity
+    if not last_activity or not timedelta(0) <= now - last_activity <= LAST_ACTIVITY_INTERVAL:
+        session_obj.last_activity = now
+        db.session.commit()
     
     return session_obj.user
 
@@ -0,0 +1,260 @@
+"""
+增量上传API接口
+客户端先提交新版本的分段清单（每段密文的SHA-256和大小），服务器答复自己已有哪些分段，
+客户端只上传缺少的分段，最后一次提交生成新版本
+"""
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy.exc import IntegrityError
+from models import DeltaUpload, DeltaUploadPart, db
+from api.auth import require_auth
+from api.files import _get_transport_key, _resolve_target_space
+from crypto.aes import AESEncryption
+from utils.access import get_file_for_user
+from utils.quota import QuotaExceeded
+from storage import BlobStore, VersionStore, DeltaUploadPurger
+from storage.versions import SEGMENT_SIZE
+from storage.manifest import hash_ciphertext
+from datetime import datetime, timedelta
+import json
+import re
+
+delta_bp = Blueprint('delta', __name__)
+
+# 单个清单的最大分段数
+MAX_DELTA_SEGMENTS = 10000
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+def _parse_manifest(segments):
+    """校验分段清单，返回 [{digest, size}]，格式错误时返回None"""
+    if not isinstance(segments, list) or len(segments) > MAX_DELTA_SEGMENTS:
+        return None
+    max_size = current_app.config.get('VERSION_SEGMENT_SIZE', SEGMENT_SIZE)
+    manifest = []
+    for item in segments:
+        if not isinstance(item, dict):
+            return None
+        digest = str(item.get('digest') or '').lower()
+        try:
+            size = int(item.get('size'))
+        except (TypeError, ValueError):
+            return None
+        if not DIGEST_PATTERN.match(digest) or size < 1 or size > max_size:
+            return None
+        manifest.append({'digest': digest, 'size': size})
+    return manifest
+
+def _load_upload(user, upload_id):
+    """
+    加载当前用户仍可继续的上传会话
+    
+    Returns:
+        tuple: (upload, error_response)
+    """
+    upload = db.session.get(DeltaUpload, upload_id)
+    if not upload or upload.user_id != user.id:
+        return None, (jsonify({'error': '上传会话不存在'}), 404)
+    if upload.status != 'open' or upload.expires_at < datetime.now():
+        return None, (jsonify({'error': '上传会话已结束'}), 410)
+    return upload, None
+
+@delta_bp.route('/<int:file_id>/delta', methods=['POST'])
+@require_auth
+def start_delta_upload(user, file_id):
+    """
+    开始增量上传
+    
+    请求体: segments（按顺序的 [{digest, size}]）、encrypted_file_key、可选 key_epoch。
+    返回会话ID和需要上传的分段摘要（服务器已有的分段不需要再传）。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权修改此文件'}), 403
+        
+        manifest = _parse_manifest(data.get('segments'))
+        if manifest is None:
+            return jsonify({'error': '无效的分段清单'}), 400
+        
+        if sum(item['size'] for item in manifest) > current_app.config.get('MAX_CONTENT_LENGTH'):
+            return jsonify({'error': '文件过大'}), 413
+        
+        encrypted_file_key = data.get('encrypted_file_key')
+        if not encrypted_file_key:
+            return jsonify({'error': '缺少加密文件密钥'}), 400
+        
+        _, key_epoch, _, error = _resolve_target_space(user, {
+            'group_id': file_record.group_id,
+            'key_epoch': data.get('key_epoch')
+        })
+        if error:
+            return error
+        
+        # 以当前版本为基准（未版本化的文件先登记为第1版）
+        VersionStore.ensure_initial_version(file_record)
+        reusable = VersionStore.reusable_segments(file_record.id)
+        missing = list(dict.fromkeys(
+            item['digest'] for item in manifest if item['digest'] not in reusable
+        ))
+        
+        upload = DeltaUpload(
+            file_id=file_record.id,
+            user_id=user.id,
+            base_version=file_record.version,
+            manifest=json.dumps(manifest),
+            encrypted_file_key=json.dumps(encrypted_file_key) if isinstance(encrypted_file_key, dict) else encrypted_file_key,
+            key_epoch=key_epoch,
+            expires_at=datetime.now() + timedelta(seconds=current_app.config.get('DELTA_UPLOAD_TTL', 3600))
+        )
+        db.session.add(upload)
+        db.session.commit()
+        
+        return jsonify({
+            'upload': upload.to_dict(),
+            'missing': missing,
+            'reused': len(manifest) - sum(1 for item in manifest if item['digest'] in missing)
+        }), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@delta_bp.route('/delta/<int:upload_id>/segments/<digest>', methods=['PUT'])
+@require_auth
+def upload_delta_segment(user, upload_id, digest):
+    """上传一个缺少的分段（请求体为传输层加密的分段密文），重复上传直接返回"""
+    written_path = None
+    try:
+        upload, error = _load_upload(user, upload_id)
+        if error:
+            return error
+        
+        sizes = {item['digest']: item['size'] for item in upload.segments()}
+        if digest not in sizes:
+            return jsonify({'error': '分段不在清单中'}), 400
+        
+        if upload.parts.filter_by(digest=digest).first():
+            return jsonify({'digest': digest, 'status': 'exists'}), 200
+        
+        session_key = _get_transport_key()
+        if not session_key:
+            return jsonify({'error': '会话密钥丢失'}), 400
+        
+        try:
+            segment = AESEncryption.decrypt_raw(request.get_data(), session_key)
+        except Exception as e:
+            return jsonify({'error': f'传输层解密失败: {str(e)}'}), 400
+        
+        manifest = hash_ciphertext(segment)
+        if len(segment) != sizes[digest] or manifest.hexdigest() != digest:
+            return jsonify({'error': '分段内容与清单不符'}), 400
+        
+        written_path = BlobStore.write_data(segment)
+        # 会话持有新分段的引用，提交时转移给新版本，过期时释放
+        blob = BlobStore.create(written_path, len(segment), manifest=manifest)
+        db.session.flush()
+        db.session.add(DeltaUploadPart(upload_id=upload.id, digest=digest, blob_id=blob.id))
+        db.session.commit()
+        
+        return jsonify({'digest': digest, 'status': 'stored'}), 201
+    
+    except IntegrityError:
+        # 并发上传了同一分段
+        db.session.rollback()
+        BlobStore.remove_data(written_path)
+        return jsonify({'digest': digest, 'status': 'exists'}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        BlobStore.remove_data(written_path)
+        return jsonify({'error': str(e)}), 500
+
+@delta_bp.route('/delta/<int:upload_id>/commit', methods=['POST'])
+@require_auth
+def commit_delta_upload(user, upload_id):
+    """
+    提交增量上传，在一个事务中生成新版本
+    
+    文件在会话开始后已有新版本时返回409，客户端需基于新版本重新开始。
+    """
+    try:
+        upload, error = _load_upload(user, upload_id)
+        if error:
+            return error
+        
+        file_record, allowed, _ = get_file_for_user(user.id, upload.file_id)
+        if not file_record or not allowed:
+            return jsonify({'error': '文件不存在'}), 404
+        
+        if file_record.version != upload.base_version:
+            DeltaUploadPurger.release(upload, 'aborted')
+            db.session.commit()
+            return jsonify({
+                'error': '文件已被修改，请基于最新版本重新上传',
+                'current_version': file_record.version
+            }), 409
+        
+        parts = {part.digest: part.blob_id for part in upload.parts}
+        reusable = VersionStore.reusable_segments(file_record.id)
+        
+        segment_ids = []
+        missing = []
+        for item in upload.segments():
+            blob_id = parts.get(item['digest']) or reusable.get(item['digest'])
+            if blob_id is None:
+                missing.append(item['digest'])
+            segment_ids.append(blob_id)
+        
+        # 会话开始后被保留策略清理的分段需要补传
+        if missing:
+            return jsonify({'error': '仍有分段未上传', 'missing': list(dict.fromkeys(missing))}), 409
+        
+        version = VersionStore.commit_staged(
+            file_record, segment_ids, set(parts.values()),
+            upload.encrypted_file_key, upload.key_epoch, user.id
+        )
+        DeltaUploadPart.query.filter_by(upload_id=upload.id).delete(synchronize_session=False)
+        upload.status = 'committed'
+        db.session.commit()
+        
+        return jsonify({
+            'message': '新版本上传成功',
+            'file': file_record.to_dict(),
+            'version': version.to_dict(),
+            'uploaded_segments': len(parts)
+        }), 201
+    
+    except QuotaExceeded as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 413
+    
+    except IntegrityError:
+        # 并发提交生成了相同的版本号
+        db.session.rollback()
+        return jsonify({'error': '文件已被修改，请基于最新版本重新上传'}), 409
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@delta_bp.route('/delta/<int:upload_id>', methods=['DELETE'])
+@require_auth
+def abort_delta_upload(user, upload_id):
+    """放弃增量上传，释放已上传的分段"""
+    try:
+        upload, error = _load_upload(user, upload_id)
+        if error:
+            return error
+        
+        DeltaUploadPurger.release(upload, 'aborted')
+        db.session.commit()
+        
+        return jsonify({'message': '已取消上传'}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
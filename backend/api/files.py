@@ -1,20 +1,48 @@
 """
 文件管理API接口
 """
-from flask import Blueprint, request, jsonify, send_file
-from models import File, db
+from flask import Blueprint, Response, current_app, request, jsonify, send_file, stream_with_context, url_for
+from models import Blob, File, FileVersion, Folder, UserGroup, GroupKeyRotation, GroupSharedKey, db
 from api.auth import require_auth, get_current_user
+from utils.idempotency import idempotent
+from utils.signed_urls import DownloadSigner, SCOPE_CURRENT, SCOPE_VERSION_PREFIX
+from utils.quota import QuotaManager, QuotaExceeded
 from crypto.aes import AESEncryption
 from crypto.key_manager import KeyManager
 from crypto.hmac import HMACVerifier
+from utils.access import ADMIN_ROLES, membership_cache, is_group_member, is_group_admin, get_file_for_user, get_folder_for_user, accessible_files_query
+from storage import BlobStore, VersionStore, TrashPurger, ShardCorrupted
+from api.folders import load_folder, subtree_filter
+from storage.archive import ArchiveStream, ARCHIVE_FORMAT
+from storage.manifest import hash_ciphertext, blob_manifest, version_manifest, file_manifest
 from datetime import datetime
 import os
 import base64
+import itertools
 import json
 import io
 
 files_bp = Blueprint('files', __name__)
 
+# 批量接口单次请求的最大文件数
+MAX_BATCH_FILES = 500
+# 批量上传单次请求的最大文件数
+MAX_BATCH_UPLOAD = 2000
+# 批量删除单次请求的最大文件数
+MAX_BATCH_DELETE = 2000
+# 归档下载单次请求的最大文件数
+MAX_ARCHIVE_FILES = 10000
+
+def _parse_file_ids(data):
+    """解析请求体中的 file_ids 列表（去重并保持顺序），格式错误时返回None"""
+    file_ids = data.get('file_ids') if isinstance(data, dict) else None
+    if not isinstance(file_ids, list):
+        return None
+    try:
+        return list(dict.fromkeys(int(i) for i in file_ids))
+    except (TypeError, ValueError):
+        return None
+
 def get_session_key(user):
     """获取会话密钥（简化版，实际应从session中获取）"""
     from models import Session as SessionModel
@@ -30,23 +58,228 @@ def get_session_key(user):
             return None  # 需要客户端提供私钥来解密
     return None
 
+def _parse_optional_id(value):
+    """解析可选的正整数ID（空值返回None），格式错误时抛出ValueError"""
+    if value in (None, '', 0, '0'):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(value)
+    parsed = int(value)
+    if parsed < 1:
+        raise ValueError(value)
+    return parsed
+
+def _resolve_target_space(user, data):
+    """
+    解析上传/复制/移动的目标空间和目标文件夹
+
+    Returns:
+        tuple: (group_id, key_epoch, folder_id, error_response)
+    """
+    try:
+        group_id = _parse_optional_id(data.get('group_id'))
+        folder_id = _parse_optional_id(data.get('folder_id'))
+        requested_epoch = _parse_optional_id(data.get('key_epoch'))
+    except (TypeError, ValueError):
+        return None, None, None, (jsonify({'error': '无效的组ID、文件夹ID或密钥版本'}), 400)
+    
+    key_epoch = 1
+    if group_id:
+        if not is_group_member(user.id, group_id):
+            return None, None, None, (jsonify({'error': '不是目标组成员'}), 403)
+        
+        group = UserGroup.query.get(group_id)
+        if not group:
+            return None, None, None, (jsonify({'error': '用户组不存在'}), 404)
+        
+        # 只接受当前版本；轮换进行中时也接受轮换前的版本（文件随即进入该任务的待重新封装列表）
+        key_epoch = requested_epoch or group.key_epoch
+        if key_epoch > group.key_epoch:
+            return None, None, None, (jsonify({'error': '无效的组密钥版本'}), 400)
+        if key_epoch != group.key_epoch:
+            running = GroupKeyRotation.query.filter_by(group_id=group_id, status='running').first()
+            if not running or key_epoch != running.from_epoch:
+                return None, None, None, (jsonify({
+                    'error': '组密钥版本已过期，请使用当前版本',
+                    'key_epoch': group.key_epoch
+                }), 409)
+    
+    if folder_id:
+        _, error = load_folder(user, folder_id, group_id)
+        if error:
+            return None, None, None, error
+    return group_id, key_epoch, folder_id, None
+
+def _get_transport_key():
+    """从会话Token中取出传输层会话密钥，缺失时返回None"""
+    token = request.headers.get('X-Session-Token')
+    if token and '.' in token:
+        try:
+            return bytes.fromhex(token.split('.')[1])
+        except ValueError:
+            pass
+    return None
+
+def _store_ciphertext(user_id, layer1_data):
+    """
+    保存上传的文件层密文并登记（不提交事务）
+    
+    开启 UPLOAD_DEDUPE 时，同一用户已有相同密文（按SHA-256判断，例如超时后重试的上传）
+    直接引用已有数据，不再写入磁盘。
+    SHA-256 与 Merkle 树的叶子哈希在同一次遍历中计算，随记录保存。
+    
+    Returns:
+        tuple: (blob, written_path) - 复用已有密文时written_path为None
+    """
+    manifest = hash_ciphertext(layer1_data)
+    digest = manifest.hexdigest()
+    if current_app.config.get('UPLOAD_DEDUPE'):
+        blob = BlobStore.acquire_duplicate(user_id, digest)
+        if blob:
+            return blob, None
+    
+    # 服务器无法解密这一层，满足"服务器不能解开用户加密数据"的要求
+    encrypted_path = BlobStore.write_data(layer1_data)
+    return BlobStore.create(encrypted_path, len(layer1_data), manifest=manifest), encrypted_path
+
+class _DownloadSource:
+    """要下载的一份文件层密文及其解密所需的响应头信息"""
+    
+    def __init__(self, storage_path, read_chunks, read_all, etag, encrypted_file_key, group_id, key_epoch, version):
+        self.storage_path = storage_path  # 单个密文的位置，版本化文件为None
+        self.read_chunks = read_chunks  # 返回密文数据块迭代器的函数
+        self.read_all = read_all  # 返回完整密文的函数（经过热点缓存）
+        self.etag = etag  # 文件层密文的强ETag，未知时为None
+        self.encrypted_file_key = encrypted_file_key
+        self.group_id = group_id
+        self.key_epoch = key_epoch
+        self.version = version
+
+def _download_source(file_record, version_number=None):
+    """
+    定位文件当前内容或指定版本的密文
+    
+    Returns:
+        _DownloadSource: 版本不存在时返回None
+    """
+    if version_number is None:
+        storage_path = BlobStore.location_of(file_record)
+        return _DownloadSource(
+            storage_path,
+            lambda: VersionStore.iter_content(storage_path, file_record.current_version_id),
+            lambda: VersionStore.read_content(
+                storage_path, file_record.current_version_id, file_record.file_size
+            ),
+            file_record.etag, file_record.encrypted_file_key, file_record.group_id, file_record.key_epoch, file_record.version
+        )
+    
+    version = _load_version(file_record, version_number)
+    if version:
+        return _DownloadSource(
+            None,
+            lambda: VersionStore.iter_version(version),
+            lambda: VersionStore.read_version(version),
+            version.etag, version.encrypted_file_key, file_record.group_id, version.key_epoch, version_number
+        )
+    if not file_record.current_version_id and version_number == file_record.version:
+        return _download_source(file_record)
+    return None
+
+def _not_modified(source, direct=True):
+    """
+    客户端缓存的内容未变化（If-None-Match 命中）时返回304响应，否则返回None
+    
+    只比较数据库中的内容哈希，不读取密文；响应仍带文件密钥等响应头（组密钥轮换后以此更新）。
+    direct 为False时对应传输层加密的下载，响应头与 _encrypted_response 一致。
+    """
+    if not source.etag or not request.if_none_match:
+        return None
+    if not request.if_none_match.contains_weak(source.etag.strip('"')):
+        return None
+    response = current_app.response_class(status=304)
+    return _set_file_headers(response, source, direct)
+
+def _encrypted_response(layer1_data, session_key, source):
+    """
+    对文件层密文做传输层加密并构造下载响应
+    
+    客户端收到后需进行两层解密：
+    1. 解密传输层 (Session Key) -> 得到 Layer 1
+    2. 解密文件层 (File Key) -> 得到 Plaintext
+    """
+    from flask import make_response
+    response = make_response(AESEncryption.encrypt_raw(layer1_data, session_key))
+    response.headers['Content-Type'] = 'application/octet-stream'
+    return _set_file_headers(response, source, direct=False)
+
+def _direct_response(source):
+    """
+    不做传输层加密，直接返回文件层密文（DOWNLOAD_TRANSPORT_ENCRYPTION 关闭、由上游TLS保护传输，或预签名链接）
+    
+    本地单个文件存放的密文交给前端代理（X-Accel-Redirect）或 send_file（WSGI服务器支持时为sendfile）发送，
+    Python 不经手数据；分段、打包或远端存储的密文按块流式返回。
+    """
+    storage_path = source.storage_path
+    local = BlobStore.local_file(storage_path) if storage_path else None
+    accel_prefix = current_app.config.get('DOWNLOAD_ACCEL_REDIRECT')
+    if local and accel_prefix:
+        volume_name, relative_path, _ = local
+        response = current_app.response_class(mimetype='application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{volume_name}/{relative_path}"
+    elif local:
+        if not os.path.isfile(local[2]):
+            raise FileNotFoundError(storage_path)
+        response = send_file(local[2], mimetype='application/octet-stream', conditional=False, etag=False)
+    else:
+        chunks = iter(source.read_chunks())
+        # 先读出第一块，密文缺失或损坏时返回错误而不是中断的响应
+        first = next(chunks, b'')
+        response = Response(stream_with_context(itertools.chain((first,), chunks)),
+                            mimetype='application/octet-stream')
+    response.headers['X-Transport-Encryption'] = 'none'
+    return _set_file_headers(response, source)
+
+def _set_file_headers(response, source, direct=True):
+    """
+    添加版本号和加密的文件密钥到响应头，以便客户端解密 Layer 1（已在app.py中配置CORS）
+    
+    强ETag是文件层密文的哈希，只用于直接返回文件层密文的响应；传输层加密的响应体随会话密钥和随机数变化，
+    只给弱ETag，并禁止浏览器和代理缓存（否则304后可能重放用旧会话密钥加密、已无法解密的响应体）。
+    """
+    response.headers['X-File-Version'] = str(source.version)
+    if direct:
+        if source.etag:
+            response.headers['ETag'] = source.etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+    else:
+        if source.etag:
+            response.headers['ETag'] = 'W/' + source.etag
+        response.headers['Cache-Control'] = 'private, no-store'
+        response.headers['Vary'] = 'X-Session-Token'
+    if source.encrypted_file_key:
+        response.headers['X-Encrypted-File-Key'] = source.encrypted_file_key
+        if source.group_id:
+            response.headers['X-File-Group-Id'] = str(source.group_id)
+            response.headers['X-File-Key-Epoch'] = str(source.key_epoch)
+    return response
+
 @files_bp.route('/list', methods=['GET'])
 @require_auth
 def list_files(user):
-    """获取文件列表"""
+    """
+    获取文件列表
+    
+    指定 folder_id 时只列出该文件夹下的文件和子文件夹（folder_id=0 表示根目录），
+    否则返回整个空间的平铺列表。
+    """
     try:
         group_id = request.args.get('group_id', type=int)
         keyword = request.args.get('keyword', type=str)
+        folder_id = request.args.get('folder_id', type=int)
         
         if group_id:
-            # 检查用户是否在该组内
-            from models import GroupMember
-            membership = GroupMember.query.filter_by(
-                user_id=user.id,
-                group_id=group_id
-            ).first()
-            
-            if not membership:
+            # 检查用户是否在该组内（使用成员关系缓存）
+            if not membership_cache.is_member(user.id, group_id):
                 return jsonify({'error': '不是该组成员'}), 403
             
             # 获取组内所有文件
@@ -55,15 +288,39 @@ def list_files(user):
             # 获取用户自己的文件
             query = File.query.filter_by(owner_id=user.id)
         
+        # 回收站中的文件不出现在正常列表中（走部分索引）
+        query = query.filter(File.deleted_at.is_(None))
+        
+        folders = None
+        if folder_id is not None:
+            if folder_id:
+                folder, error = load_folder(user, folder_id, group_id or None)
+                if error:
+                    return error
+                query = query.filter(File.folder_id == folder.id)
+            else:
+                query = query.filter(File.folder_id.is_(None))
+            if not group_id:
+                query = query.filter(File.group_id.is_(None))
+            
+            folder_query = Folder.query.filter(
+                Folder.parent_id == (folder_id or None),
+                Folder.group_id == (group_id or None)
+            )
+            if not group_id:
+                folder_query = folder_query.filter(Folder.owner_id == user.id)
+            folders = folder_query.order_by(Folder.name).all()
+        
         # 如果有搜索关键字，添加过滤条件
         if keyword:
             query = query.filter(File.original_filename.like(f'%{keyword}%'))
         
         files = query.order_by(File.created_at.desc()).all()
         
-        return jsonify({
-            'files': [f.to_dict() for f in files]
-        }), 200
+        result = {'files': [f.to_dict() for f in files]}
+        if folders is not None:
+            result['folders'] = [f.to_dict() for f in folders]
+        return jsonify(result), 200
     
     except Exception as e:
         import traceback
@@ -71,40 +328,55 @@ def list_files(user):
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+@files_bp.route('/usage', methods=['GET'])
+@require_auth
+def get_usage(user):
+    """获取个人空间或指定用户组的存储用量和配额（读取物化计数，不汇总文件表）"""
+    try:
+        group_id = request.args.get('group_id', type=int)
+        if group_id and not membership_cache.is_member(user.id, group_id):
+            return jsonify({'error': '不是该组成员'}), 403
+        
+        usage = QuotaManager.usage(user.id, group_id)
+        if usage is None:
+            return jsonify({'error': '用户组不存在'}), 404
+        
+        return jsonify(dict(usage, group_id=group_id)), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @files_bp.route('/upload', methods=['POST'])
 @require_auth
+@idempotent
 def upload_file(user):
-    """上传文件"""
+    """上传文件（支持 Idempotency-Key 请求头，重试时返回第一次的结果）"""
+    encrypted_path = None
     try:
         if 'file' not in request.files:
             return jsonify({'error': '没有文件'}), 400
         
         file = request.files['file']
-        group_id = request.form.get('group_id', type=int)
         
         if not file or file.filename == '':
             return jsonify({'error': '文件名为空'}), 400
+        
+        # 组文件：检查成员身份并确定文件密钥所用的组密钥版本（轮换期间可能仍是旧版本）
+        # 目标文件夹必须与文件处于同一空间
+        group_id, key_epoch, folder_id, error = _resolve_target_space(user, request.form)
+        if error:
+            return error
+        
+        # 获取客户端上传的加密文件密钥
+        encrypted_file_key_json = request.form.get('encrypted_file_key')
+        if not encrypted_file_key_json:
+            return jsonify({'error': '缺少加密文件密钥'}), 400
             
         # 获取传输层会话密钥
-        token = request.headers.get('X-Session-Token')
-        session_key = None
-        if token and '.' in token:
-            try:
-                session_key = bytes.fromhex(token.split('.')[1])
-            except:
-                pass
-        
+        session_key = _get_transport_key()
         if not session_key:
             return jsonify({'error': '会话密钥丢失'}), 400
         
-        # 直接在 uploads 目录下生成加密文件名
-        from flask import current_app
-        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads')
-        filename = file.filename
-        filename_on_disk = f'{user.id}_{datetime.now().timestamp()}_{filename}.enc'
-        encrypted_path = os.path.join(upload_folder, filename_on_disk)
-        os.makedirs(upload_folder, exist_ok=True)
-        
         # 读取上传的文件流（这是传输层加密的数据 Layer 2）
         layer2_data = file.read()
         
@@ -113,27 +385,26 @@ def upload_file(user):
             layer1_data = AESEncryption.decrypt_raw(layer2_data, session_key)
         except Exception as e:
             return jsonify({'error': f'传输层解密失败: {str(e)}'}), 400
-            
-        # 将Layer 1数据（仍被File Key加密）写入磁盘
-        # 服务器无法解密这一层，满足"服务器不能解开用户加密数据"的要求
-        with open(encrypted_path, 'wb') as f:
-            f.write(layer1_data)
         
-        # 获取客户端上传的加密文件密钥
-        encrypted_file_key_json = request.form.get('encrypted_file_key')
-        if not encrypted_file_key_json:
-            # 兼容旧逻辑（可选，或者直接报错）
-            return jsonify({'error': '缺少加密文件密钥'}), 400
+        # 先计入空间用量（配额不足时不写磁盘）
+        QuotaManager.charge(user.id, group_id, len(layer1_data))
+            
+        # 将Layer 1数据（仍被File Key加密）写入磁盘并登记，复制/移动文件时共享同一份密文
+        blob, encrypted_path = _store_ciphertext(user.id, layer1_data)
         
         # 创建文件记录
         file_record = File(
-            filename=os.path.basename(encrypted_path),
-            original_filename=filename,
-            file_path=encrypted_path,
-            file_size=os.path.getsize(encrypted_path),
+            filename=os.path.basename(blob.storage_path),
+            original_filename=file.filename,
+            file_path=blob.storage_path,
+            file_size=blob.size,
+            content_hash=blob.digest,
             encrypted_file_key=encrypted_file_key_json,
+            key_epoch=key_epoch,
             owner_id=user.id,
             group_id=group_id,
+            blob=blob,
+            folder_id=folder_id,
             mime_type=file.content_type
         )
         
@@ -142,114 +413,1006 @@ def upload_file(user):
         
         return jsonify({
             'message': '上传成功',
-            'file': file_record.to_dict()
+            'file': file_record.to_dict(),
+            'deduplicated': encrypted_path is None
         }), 201
     
+    except QuotaExceeded as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 413
+    
     except Exception as e:
+        db.session.rollback()
+        BlobStore.remove_data(encrypted_path)
         import traceback
         print(f"上传文件错误: {str(e)}")
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+@files_bp.route('/upload-batch', methods=['POST'])
+@require_auth
+@idempotent
+def upload_files_batch(user):
+    """
+    批量上传文件
+    
+    一个multipart请求携带多个传输层加密的文件（字段名 files），manifest 为按相同顺序
+    排列的JSON数组，每项包含 encrypted_file_key，可选 folder_id。全部文件记录在同一事务中
+    写入，返回逐项结果。
+    """
+    written_paths = []
+    try:
+        files = request.files.getlist('files')
+        try:
+            manifest = json.loads(request.form.get('manifest') or '[]')
+        except ValueError:
+            return jsonify({'error': '无效的manifest'}), 400
+        
+        if not files:
+            return jsonify({'error': '没有文件'}), 400
+        
+        if not isinstance(manifest, list) or len(manifest) != len(files):
+            return jsonify({'error': 'manifest与文件数量不一致'}), 400
+        
+        if len(files) > MAX_BATCH_UPLOAD:
+            return jsonify({'error': f'单次最多上传{MAX_BATCH_UPLOAD}个文件'}), 400
+        
+        # 整批共享同一目标空间，只校验一次
+        group_id, key_epoch, default_folder_id, error = _resolve_target_space(user, request.form)
+        if error:
+            return error
+        
+        session_key = _get_transport_key()
+        if not session_key:
+            return jsonify({'error': '会话密钥丢失'}), 400
+        
+        # 第一遍：逐项校验并解开传输层，不写入任何密文
+        results = []
+        accepted = []
+        checked_folders = {default_folder_id: True}
+        for index, (file, item) in enumerate(zip(files, manifest)):
+            item = item if isinstance(item, dict) else {}
+            encrypted_file_key = item.get('encrypted_file_key')
+            if not file.filename or not encrypted_file_key:
+                results.append({'index': index, 'status': 'error', 'error': '缺少文件名或加密文件密钥'})
+                continue
+            
+            try:
+                folder_id = _parse_optional_id(item.get('folder_id')) or default_folder_id
+            except (TypeError, ValueError):
+                results.append({'index': index, 'status': 'error', 'error': '无效的目标文件夹'})
+                continue
+            if folder_id not in checked_folders:
+                checked_folders[folder_id] = load_folder(user, folder_id, group_id)[1] is None
+            if not checked_folders[folder_id]:
+                results.append({'index': index, 'status': 'error', 'error': '无效的目标文件夹'})
+                continue
+            
+            try:
+                layer1_data = AESEncryption.decrypt_raw(file.read(), session_key)
+            except Exception as e:
+                results.append({'index': index, 'status': 'error', 'error': f'传输层解密失败: {str(e)}'})
+                continue
+            
+            accepted.append((index, file, encrypted_file_key, folder_id, layer1_data))
+            results.append(None)
+        
+        if not accepted:
+            db.session.rollback()
+            return jsonify({'message': '成功上传0个文件', 'results': results}), 400
+        
+        # 先按整批大小计入空间用量，配额不足时整批失败且不写入任何密文
+        QuotaManager.charge(user.id, group_id, sum(len(entry[4]) for entry in accepted))
+        
+        # 第二遍：写入密文并创建文件记录
+        created = []
+        for index, file, encrypted_file_key, folder_id, layer1_data in accepted:
+            blob, encrypted_path = _store_ciphertext(user.id, layer1_data)
+            if encrypted_path:
+                written_paths.append(encrypted_path)
+            
+            file_record = File(
+                filename=os.path.basename(blob.storage_path),
+                original_filename=file.filename,
+                file_path=blob.storage_path,
+                file_size=blob.size,
+                content_hash=blob.digest,
+                encrypted_file_key=json.dumps(encrypted_file_key) if isinstance(encrypted_file_key, dict) else encrypted_file_key,
+                key_epoch=key_epoch,
+                owner_id=user.id,
+                group_id=group_id,
+                blob=blob,
+                folder_id=folder_id,
+                mime_type=file.content_type
+            )
+            db.session.add(file_record)
+            created.append((index, file_record))
+        
+        # 所有元数据一次提交
+        db.session.commit()
+        
+        created_by_index = dict(created)
+        results = [
+            result or {'index': index, 'status': 'created', 'file': created_by_index[index].to_dict()}
+            for index, result in enumerate(results)
+        ]
+        
+        return jsonify({
+            'message': f'成功上传{len(created)}个文件',
+            'results': results
+        }), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        # 事务失败时清理已写入的密文
+        for path in written_paths:
+            BlobStore.remove_data(path)
+        if isinstance(e, QuotaExceeded):
+            return jsonify({'error': str(e)}), 413
+        import traceback
+        print(f"批量上传文件错误: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 @files_bp.route('/download/<int:file_id>', methods=['GET'])
 @require_auth
 def download_file(user, file_id):
     """下载文件"""
     try:
-        file_record = File.query.get_or_404(file_id)
-        
-        # 检查权限
-        if file_record.owner_id != user.id:
-            # 如果不是文件所有者，检查是否是同一个用户组的成员
-            if file_record.group_id:
-                from models import GroupMember
-                membership = GroupMember.query.filter_by(
-                    user_id=user.id,
-                    group_id=file_record.group_id
-                ).first()
-                
-                if not membership:
-                    return jsonify({'error': '无权访问此文件'}), 403
-            else:
-                return jsonify({'error': '无权访问此文件'}), 403
+        # 一次查询同时取回文件和组成员关系
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
         
-        # 获取传输层会话密钥
-        token = request.headers.get('X-Session-Token')
-        session_key = None
-        if token and '.' in token:
-            try:
-                session_key = bytes.fromhex(token.split('.')[1])
-            except:
-                pass
+        # 检查权限：文件所有者或文件所属组的成员
+        if not allowed:
+            return jsonify({'error': '无权访问此文件'}), 403
         
-        if not session_key:
+        # 上游TLS已保护传输时跳过传输层加密，直接发送文件层密文
+        direct = not current_app.config.get('DOWNLOAD_TRANSPORT_ENCRYPTION', True)
+        
+        # 客户端已缓存相同内容时返回304，不读取密文也不做加密
+        source = _download_source(file_record)
+        not_modified = _not_modified(source, direct)
+        if not_modified:
+            return not_modified
+        
+        # 获取传输层会话密钥
+        session_key = None if direct else _get_transport_key()
+        if not direct and not session_key:
             return jsonify({'error': '会话密钥丢失'}), 400
 
         # 读取加密文件内容 (Layer 1: 端到端加密数据)
-        # 服务器直接读取磁盘上的密文，不进行解密
-        if not os.path.exists(file_record.file_path):
+        # 服务器直接读取磁盘上的密文（版本化文件按分段读取），不进行解密
+        try:
+            if direct:
+                return _direct_response(source)
+            layer1_data = source.read_all()
+        except ShardCorrupted:
+            return jsonify({'error': '文件数据已损坏'}), 500
+        except (OSError, KeyError):
             return jsonify({'error': '文件不存在'}), 404
-            
-        with open(file_record.file_path, 'rb') as f:
-            layer1_data = f.read()
 
         # 传输层加密 (Layer 2: 会话密钥加密)
         # 使用会话密钥对Layer 1数据进行再次加密，防止传输过程被窃听
+        return _encrypted_response(layer1_data, session_key, source)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/<int:file_id>', methods=['DELETE'])
+@require_auth
+def delete_file(user, file_id):
+    """删除文件（移入回收站，超过保留期后由后台任务永久删除）"""
+    try:
+        # 一次查询同时取回文件和组成员关系
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        
+        # 检查权限：文件所有者或文件所属组的成员
+        if not allowed:
+            return jsonify({'error': '无权删除此文件'}), 403
+        
+        file_record.deleted_at = datetime.now()
+        file_record.deleted_by = user.id
+        db.session.commit()
+        
+        return jsonify({'message': '已移入回收站'}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/delete-batch', methods=['POST'])
+@require_auth
+def delete_files_batch(user):
+    """批量删除文件：单个事务移入回收站，磁盘数据在永久删除后由后台任务分批清理"""
+    try:
+        file_ids = _parse_file_ids(request.get_json(silent=True))
+        if not file_ids:
+            return jsonify({'error': '缺少文件ID列表'}), 400
+        
+        if len(file_ids) > MAX_BATCH_DELETE:
+            return jsonify({'error': f'单次最多删除{MAX_BATCH_DELETE}个文件'}), 400
+        
+        # 授权与删除范围用同一个集合子查询表达
+        allowed_ids = [file_id for (file_id,) in accessible_files_query(user.id).filter(
+            File.id.in_(file_ids)
+        ).with_entities(File.id).all()]
+        
+        if allowed_ids:
+            File.query.filter(File.id.in_(allowed_ids)).update({
+                File.deleted_at: datetime.now(),
+                File.deleted_by: user.id
+            }, synchronize_session=False)
+            db.session.commit()
+        
+        allowed = set(allowed_ids)
+        return jsonify({
+            'message': f'已将{len(allowed_ids)}个文件移入回收站',
+            'deleted': allowed_ids,
+            'missing': [file_id for file_id in file_ids if file_id not in allowed]
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/trash', methods=['GET'])
+@require_auth
+def list_trash(user):
+    """获取回收站文件列表（个人空间或指定用户组）"""
+    try:
+        group_id = request.args.get('group_id', type=int)
+        
+        if group_id:
+            if not membership_cache.is_member(user.id, group_id):
+                return jsonify({'error': '不是该组成员'}), 403
+            query = File.query.filter(File.group_id == group_id)
+        else:
+            query = File.query.filter(File.owner_id == user.id, File.group_id.is_(None))
+        
+        files = query.filter(File.deleted_at.isnot(None)).order_by(File.deleted_at.desc()).all()
+        
+        return jsonify({
+            'files': [f.to_dict() for f in files],
+            'retention_days': current_app.config.get('TRASH_RETENTION_DAYS')
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/trash/<int:file_id>/restore', methods=['POST'])
+@require_auth
+def restore_file(user, file_id):
+    """从回收站恢复文件（只更新一行记录）"""
+    try:
+        file_record, allowed, _ = get_file_for_user(user.id, file_id, in_trash=True)
+        if not file_record:
+            return jsonify({'error': '回收站中没有此文件'}), 404
+        if not allowed:
+            return jsonify({'error': '无权恢复此文件'}), 403
+        
+        file_record.deleted_at = None
+        file_record.deleted_by = None
+        db.session.commit()
+        
+        return jsonify({
+            'message': '恢复成功',
+            'file': file_record.to_dict()
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/trash/<int:file_id>', methods=['DELETE'])
+@require_auth
+def purge_file(user, file_id):
+    """
+    从回收站永久删除文件
+    
+    组内文件只有组所有者/管理员、文件所有者或将其移入回收站的成员可以永久删除。
+    """
+    try:
+        file_record, allowed, role = get_file_for_user(user.id, file_id, in_trash=True)
+        if not file_record:
+            return jsonify({'error': '回收站中没有此文件'}), 404
+        if not allowed:
+            return jsonify({'error': '无权删除此文件'}), 403
+        if file_record.group_id and role not in ADMIN_ROLES and user.id not in (
+            file_record.owner_id, file_record.deleted_by
+        ):
+            return jsonify({'error': '只有组管理员或文件所有者可以永久删除此文件'}), 403
+        
+        # 释放密文引用（含全部版本），引用归零的密文由后台任务清理
+        TrashPurger.delete_permanently(db.session.query(File.id).filter(File.id == file_record.id))
+        db.session.commit()
+        
+        return jsonify({'message': '已永久删除'}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/trash/empty', methods=['POST'])
+@require_auth
+def empty_trash(user):
+    """清空回收站（个人空间，或指定用户组——仅组所有者/管理员）"""
+    try:
         try:
-            layer2_data = AESEncryption.encrypt_raw(layer1_data, session_key)
+            group_id = _parse_optional_id((request.get_json(silent=True) or {}).get('group_id'))
+        except (TypeError, ValueError):
+            return jsonify({'error': '无效的组ID'}), 400
+        
+        if group_id:
+            if not is_group_admin(user.id, group_id):
+                return jsonify({'error': '只有组管理员可以清空组回收站'}), 403
+            space_filter = File.group_id == group_id
+        else:
+            space_filter = db.and_(File.owner_id == user.id, File.group_id.is_(None))
+        
+        trashed_ids = db.session.query(File.id).filter(space_filter, File.deleted_at.isnot(None))
+        deleted = TrashPurger.delete_permanently(trashed_ids)
+        db.session.commit()
+        
+        return jsonify({'message': f'已永久删除{deleted}个文件'}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/keys', methods=['POST'])
+@require_auth
+def get_file_keys(user):
+    """批量获取文件的加密文件密钥及元数据（不传输文件内容）"""
+    try:
+        file_ids = _parse_file_ids(request.get_json(silent=True))
+        if file_ids is None:
+            return jsonify({'error': '缺少文件ID列表'}), 400
+        
+        if len(file_ids) > MAX_BATCH_FILES:
+            return jsonify({'error': f'单次最多查询{MAX_BATCH_FILES}个文件'}), 400
+        
+        # 一次集合查询同时完成加载和授权
+        rows = accessible_files_query(user.id).filter(File.id.in_(file_ids)).with_entities(
+            File.id, File.encrypted_file_key, File.key_epoch, File.file_size, File.group_id
+        ).all() if file_ids else []
+        
+        found = {row.id for row in rows}
+        
+        return jsonify({
+            'files': [{
+                'id': row.id,
+                'encrypted_file_key': row.encrypted_file_key,
+                'key_epoch': row.key_epoch,
+                'file_size': row.file_size,
+                'group_id': row.group_id
+            } for row in rows],
+            # 不存在和无权访问不作区分，避免泄露文件是否存在
+            'missing': [file_id for file_id in file_ids if file_id not in found]
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/<int:file_id>/copy', methods=['POST'])
+@require_auth
+def copy_file(user, file_id):
+    """
+    服务端复制文件（个人空间与用户组之间）
+    
+    只新建文件记录并引用同一份密文，客户端提供使用目标空间密钥重新封装的文件密钥。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        encrypted_file_key = data.get('encrypted_file_key')
+        if not encrypted_file_key:
+            return jsonify({'error': '缺少重新封装的加密文件密钥'}), 400
+        
+        source, allowed, _ = get_file_for_user(user.id, file_id)
+        if not source:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权访问此文件'}), 403
+        
+        group_id, key_epoch, folder_id, error = _resolve_target_space(user, data)
+        if error:
+            return error
+        
+        QuotaManager.charge(user.id, group_id, source.file_size)
+        
+        # 版本化文件只复制当前版本，新文件引用同样的分段
+        blob = None if source.current_version_id else BlobStore.acquire(source)
+        copied = File(
+            filename=source.filename,
+            original_filename=data.get('filename') or source.original_filename,
+            file_path=blob.storage_path if blob else '',
+            file_size=source.file_size,
+            content_hash=source.content_hash,
+            encrypted_file_key=json.dumps(encrypted_file_key) if isinstance(encrypted_file_key, dict) else encrypted_file_key,
+            key_epoch=key_epoch,
+            owner_id=user.id,
+            group_id=group_id,
+            blob_id=blob.id if blob else None,
+            folder_id=folder_id,
+            mime_type=source.mime_type
+        )
+        db.session.add(copied)
+        if source.current_version_id:
+            VersionStore.copy_current(source, copied, user.id)
+        db.session.commit()
+        
+        return jsonify({
+            'message': '复制成功',
+            'file': copied.to_dict()
+        }), 201
+    
+    except QuotaExceeded as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 413
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/<int:file_id>/move', methods=['POST'])
+@require_auth
+def move_file(user, file_id):
+    """
+    服务端移动文件（个人空间与用户组之间，或同一空间内的文件夹之间）
+    
+    只更新文件记录的所属空间、文件夹和重新封装的文件密钥，不重新传输密文。
+    跨空间移动时各历史版本的文件密钥一并重新封装：与当前封装结果相同的版本自动使用新结果，
+    其余版本须通过 version_keys（[{version, encrypted_file_key}]）提供。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        encrypted_file_key = data.get('encrypted_file_key')
+        
+        file_record, allowed, role = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        
+        # 移动会改变文件的可见范围：仅文件所有者或所属组管理员可操作
+        if not allowed or (file_record.owner_id != user.id and role not in ('owner', 'admin')):
+            return jsonify({'error': '无权移动此文件'}), 403
+        
+        group_id, key_epoch, folder_id, error = _resolve_target_space(user, data)
+        if error:
+            return error
+        
+        # 先校验全部参数，再修改文件记录
+        cross_space = group_id != file_record.group_id
+        version_keys = {}
+        if cross_space:
+            # 跨空间移动需要使用目标空间密钥重新封装文件密钥
+            if not encrypted_file_key:
+                return jsonify({'error': '缺少重新封装的加密文件密钥'}), 400
+            items = data.get('version_keys') or []
+            if not isinstance(items, list):
+                return jsonify({'error': 'version_keys 必须是列表'}), 400
+            for item in items:
+                if not isinstance(item, dict) or not item.get('version') or not item.get('encrypted_file_key'):
+                    return jsonify({'error': '缺少版本号或加密文件密钥'}), 400
+                try:
+                    version_number = int(item['version'])
+                except (TypeError, ValueError):
+                    return jsonify({'error': '无效的版本号'}), 400
+                key = item['encrypted_file_key']
+                version_keys[version_number] = json.dumps(key) if isinstance(key, dict) else key
+        
+        file_record.folder_id = folder_id
+        if cross_space:
+            missing = VersionStore.rewrap_keys(
+                file_record,
+                json.dumps(encrypted_file_key) if isinstance(encrypted_file_key, dict) else encrypted_file_key,
+                key_epoch,
+                version_keys
+            )
+            if missing:
+                db.session.rollback()
+                return jsonify({'error': '缺少历史版本重新封装的文件密钥', 'versions': missing}), 400
+            # 用量从原空间转到目标空间
+            QuotaManager.release(file_record.owner_id, file_record.group_id, file_record.file_size)
+            QuotaManager.charge(user.id, group_id, file_record.file_size)
+            file_record.group_id = group_id
+            if group_id is None:
+                # 移入个人空间后归操作者所有
+                file_record.owner_id = user.id
+        db.session.commit()
+        
+        return jsonify({
+            'message': '移动成功',
+            'file': file_record.to_dict()
+        }), 200
+    
+    except QuotaExceeded as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 413
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def _load_version(file_record, version_number):
+    """按版本号加载文件的某个版本，不存在时返回None"""
+    return FileVersion.query.filter_by(file_id=file_record.id, version=version_number).first()
+
+@files_bp.route('/<int:file_id>/versions', methods=['GET'])
+@require_auth
+def list_versions(user, file_id):
+    """获取文件的版本历史（未版本化的文件只有当前版本）"""
+    try:
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权访问此文件'}), 403
+        
+        versions = FileVersion.query.filter_by(file_id=file_record.id).order_by(
+            FileVersion.version.desc()
+        ).all()
+        if not versions:
+            versions_data = [{
+                'id': None,
+                'file_id': file_record.id,
+                'version': file_record.version,
+                'size': file_record.file_size,
+                'segment_count': 1,
+                'key_epoch': file_record.key_epoch,
+                'created_by': file_record.owner_id,
+                'created_at': file_record.created_at.isoformat() if file_record.created_at else None,
+                'is_current': True
+            }]
+        else:
+            versions_data = [
+                dict(v.to_dict(), is_current=v.id == file_record.current_version_id) for v in versions
+            ]
+        
+        return jsonify({
+            'current_version': file_record.version,
+            'keep_last': file_record.version_keep_last or current_app.config.get('VERSION_KEEP_LAST'),
+            'max_age_days': file_record.version_max_age_days or current_app.config.get('VERSION_MAX_AGE_DAYS'),
+            'versions': versions_data
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/<int:file_id>/versions', methods=['POST'])
+@require_auth
+@idempotent
+def upload_version(user, file_id):
+    """
+    上传文件的新版本
+    
+    密文按固定大小分段存储，与历史版本相同的分段只增加引用，
+    因此修改大文件的一小部分只会写入变化的分段。
+    """
+    written_paths = []
+    try:
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权修改此文件'}), 403
+        
+        file = request.files.get('file')
+        if not file:
+            return jsonify({'error': '没有文件'}), 400
+        
+        encrypted_file_key = request.form.get('encrypted_file_key')
+        if not encrypted_file_key:
+            return jsonify({'error': '缺少加密文件密钥'}), 400
+        
+        _, key_epoch, _, error = _resolve_target_space(user, {
+            'group_id': file_record.group_id,
+            'key_epoch': request.form.get('key_epoch')
+        })
+        if error:
+            return error
+        
+        session_key = _get_transport_key()
+        if not session_key:
+            return jsonify({'error': '会话密钥丢失'}), 400
+        
+        try:
+            layer1_data = AESEncryption.decrypt_raw(file.read(), session_key)
         except Exception as e:
-            return jsonify({'error': f'传输层加密失败: {str(e)}'}), 500
-
-        # 返回双重加密的数据流
-        # 客户端收到后需进行两层解密：
-        # 1. 解密传输层 (Session Key) -> 得到 Layer 1
-        # 2. 解密文件层 (File Key) -> 得到 Plaintext
-        from flask import make_response
-        response = make_response(layer2_data)
-        response.headers['Content-Type'] = 'application/octet-stream'
-        
-        # 添加加密的文件密钥到响应头，以便客户端解密 Layer 1
-        if file_record.encrypted_file_key:
-             response.headers['X-Encrypted-File-Key'] = file_record.encrypted_file_key
-             if file_record.group_id:
-                 response.headers['X-File-Group-Id'] = str(file_record.group_id)
-             # 确保CORS允许此Header (已在app.py中配置)
-             
+            return jsonify({'error': f'传输层解密失败: {str(e)}'}), 400
+        
+        version, written_paths = VersionStore.create_version(
+            file_record, layer1_data, encrypted_file_key, key_epoch, user.id
+        )
+        db.session.commit()
+        
+        return jsonify({
+            'message': '新版本上传成功',
+            'file': file_record.to_dict(),
+            'version': version.to_dict(),
+            'new_segments': len(written_paths)
+        }), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        for path in written_paths:
+            BlobStore.remove_data(path)
+        if isinstance(e, QuotaExceeded):
+            return jsonify({'error': str(e)}), 413
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/<int:file_id>/versions/<int:version_number>/download', methods=['GET'])
+@require_auth
+def download_version(user, file_id, version_number):
+    """下载文件的指定版本"""
+    try:
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权访问此文件'}), 403
+        
+        source = _download_source(file_record, version_number)
+        if not source:
+            return jsonify({'error': '版本不存在'}), 404
+        
+        direct = not current_app.config.get('DOWNLOAD_TRANSPORT_ENCRYPTION', True)
+        not_modified = _not_modified(source, direct)
+        if not_modified:
+            return not_modified
+        session_key = None if direct else _get_transport_key()
+        if not direct and not session_key:
+            return jsonify({'error': '会话密钥丢失'}), 400
+        
+        try:
+            if direct:
+                return _direct_response(source)
+            layer1_data = source.read_all()
+        except ShardCorrupted:
+            return jsonify({'error': '文件数据已损坏'}), 500
+        except (OSError, KeyError):
+            return jsonify({'error': '文件不存在'}), 404
+        
+        return _encrypted_response(layer1_data, session_key, source)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _load_manifest(file_record, version_number=None):
+    """
+    加载文件当前内容或指定版本的完整性清单
+    
+    Returns:
+        tuple: (manifest, error_response)
+    """
+    if version_number is None:
+        manifest = file_manifest(file_record)
+    else:
+        version = _load_version(file_record, version_number)
+        if version:
+            manifest = version_manifest(version)
+        elif not file_record.current_version_id and version_number == file_record.version:
+            manifest = blob_manifest(file_record.blob)
+        else:
+            return None, (jsonify({'error': '版本不存在'}), 404)
+    if not manifest:
+        return None, (jsonify({'error': '该文件没有完整性清单'}), 404)
+    return manifest, None
+
+@files_bp.route('/<int:file_id>/manifest', methods=['GET'])
+@require_auth
+def get_manifest(user, file_id):
+    """
+    获取文件层密文的完整性清单（SHA-256 和 Merkle 树根哈希）
+    
+    查询参数: version（可选，默认当前版本），leaves=1 时返回全部叶子哈希（base64）
+    """
+    try:
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权访问此文件'}), 403
+        
+        version_number = request.args.get('version', type=int)
+        manifest, error = _load_manifest(file_record, version_number)
+        if error:
+            return error
+        
+        return jsonify(dict(
+            manifest.to_dict(include_leaves=request.args.get('leaves') == '1'),
+            file_id=file_record.id,
+            version=version_number or file_record.version
+        )), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/<int:file_id>/manifest/proof', methods=['GET'])
+@require_auth
+def get_manifest_proof(user, file_id):
+    """
+    获取一个叶子的审计路径，用于只校验密文的一个范围
+    
+    查询参数: index（叶子序号），version（可选）
+    """
+    try:
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权访问此文件'}), 403
+        
+        version_number = request.args.get('version', type=int)
+        manifest, error = _load_manifest(file_record, version_number)
+        if error:
+            return error
+        
+        index = request.args.get('index', type=int)
+        if index is None or not 0 <= index < manifest.leaf_count:
+            return jsonify({'error': f'叶子序号必须在0到{manifest.leaf_count - 1}之间'}), 400
+        
+        return jsonify(dict(
+            manifest.proof(index),
+            file_id=file_record.id,
+            version=version_number or file_record.version
+        )), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/<int:file_id>/signed-url', methods=['POST'])
+@require_auth
+def create_signed_url(user, file_id):
+    """
+    签发有时效的预签名下载链接
+    
+    请求体: {"expires_in": 秒数（可选）, "version": 版本号（可选，默认为下载时的当前内容）}
+    持有链接即可下载，不需要会话；返回的是文件层密文，解密仍需要文件密钥。
+    """
+    try:
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权访问此文件'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        max_ttl = current_app.config.get('SIGNED_URL_MAX_TTL', 24 * 3600)
+        try:
+            expires_in = int(data.get('expires_in') or current_app.config.get('SIGNED_URL_TTL', 3600))
+            version_number = int(data['version']) if data.get('version') else None
+        except (TypeError, ValueError):
+            return jsonify({'error': '参数格式错误'}), 400
+        if expires_in <= 0 or expires_in > max_ttl:
+            return jsonify({'error': f'有效期必须在1到{max_ttl}秒之间'}), 400
+        
+        if version_number is not None and not _download_source(file_record, version_number):
+            return jsonify({'error': '版本不存在'}), 404
+        
+        scope = SCOPE_CURRENT if version_number is None else f'{SCOPE_VERSION_PREFIX}{version_number}'
+        params = DownloadSigner.sign(file_record.id, scope, expires_in, user.id)
+        path = url_for('files.download_signed', file_id=file_record.id, **params)
+        
+        return jsonify({
+            'url': url_for('files.download_signed', file_id=file_record.id, _external=True, **params),
+            'path': path,
+            'scope': scope,
+            'expires_at': datetime.fromtimestamp(params['expires']).isoformat()
+        }), 201
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/signed/<int:file_id>', methods=['GET'])
+def download_signed(file_id):
+    """
+    通过预签名链接下载文件层密文
+    
+    只校验链接签名和过期时间，不查询会话和组成员关系；始终不做传输层加密（依赖TLS）。
+    """
+    try:
+        valid, version_number, error = DownloadSigner.verify(file_id, request.args)
+        if not valid:
+            return jsonify({'error': error}), 403
+        
+        file_record = File.query.filter(File.id == file_id, File.deleted_at.is_(None)).first()
+        source = _download_source(file_record, version_number) if file_record else None
+        if not source:
+            return jsonify({'error': '文件不存在'}), 404
+        
+        try:
+            response = _not_modified(source) or _direct_response(source)
+        except ShardCorrupted:
+            return jsonify({'error': '文件数据已损坏'}), 500
+        except (OSError, KeyError):
+            return jsonify({'error': '文件不存在'}), 404
+        
+        # 指定版本的内容不会变化，CDN可以缓存到链接过期；当前内容每次回源
+        if version_number is None:
+            response.headers['Cache-Control'] = 'no-cache'
+        else:
+            remaining = max(0, int(request.args['expires']) - int(datetime.now().timestamp()))
+            response.headers['Cache-Control'] = f'public, max-age={remaining}'
         return response
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@files_bp.route('/<int:file_id>', methods=['DELETE'])
+@files_bp.route('/<int:file_id>/versions/<int:version_number>/restore', methods=['POST'])
 @require_auth
-def delete_file(user, file_id):
-    """删除文件"""
-    try:
-        file_record = File.query.get_or_404(file_id)
-        
-        # 检查权限
-        if file_record.owner_id != user.id:
-            # 如果不是文件所有者，检查是否是同一个用户组的成员
-            if file_record.group_id:
-                from models import GroupMember
-                membership = GroupMember.query.filter_by(
-                    user_id=user.id,
-                    group_id=file_record.group_id
-                ).first()
-                
-                if not membership:
-                    return jsonify({'error': '无权删除此文件'}), 403
-            else:
-                return jsonify({'error': '无权删除此文件'}), 403
+def restore_version(user, file_id, version_number):
+    """把历史版本恢复为新的当前版本（只增加分段引用，不复制数据）"""
+    try:
+        file_record, allowed, _ = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权修改此文件'}), 403
+        
+        version = _load_version(file_record, version_number)
+        if not version:
+            return jsonify({'error': '版本不存在'}), 404
+        if version.id == file_record.current_version_id:
+            return jsonify({'error': '已经是当前版本'}), 400
+        if file_record.group_id and version.key_epoch != file_record.key_epoch and not GroupSharedKey.query.filter_by(
+            group_id=file_record.group_id, epoch=version.key_epoch
+        ).first():
+            # 该版本的文件密钥由已删除的组密钥版本封装，恢复后文件将无法解密
+            return jsonify({'error': '该版本的文件密钥使用已失效的组密钥版本封装，无法恢复'}), 409
+        
+        restored = VersionStore.restore_version(file_record, version, user.id)
+        db.session.commit()
+        
+        return jsonify({
+            'message': f'已恢复到版本{version_number}',
+            'file': file_record.to_dict(),
+            'version': restored.to_dict()
+        }), 200
+    
+    except QuotaExceeded as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 413
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/<int:file_id>/versions/retention', methods=['PUT'])
+@require_auth
+def set_version_retention(user, file_id):
+    """
+    设置文件的版本保留策略（立即生效）
+    
+    keep_last: 保留的版本数（含当前版本），max_age_days: 历史版本保留天数；
+    传 null 表示使用全局配置。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
         
-        # 删除文件
-        if os.path.exists(file_record.file_path):
-            os.remove(file_record.file_path)
+        file_record, allowed, role = get_file_for_user(user.id, file_id)
+        if not file_record:
+            return jsonify({'error': '文件不存在'}), 404
+        # 保留策略会删除历史版本：仅文件所有者或所属组管理员可操作
+        if not allowed or (file_record.owner_id != user.id and role not in ('owner', 'admin')):
+            return jsonify({'error': '无权修改此文件的保留策略'}), 403
+        
+        try:
+            keep_last = int(data['keep_last']) if data.get('keep_last') is not None else None
+            max_age_days = int(data['max_age_days']) if data.get('max_age_days') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'error': '无效的保留策略'}), 400
+        if (keep_last is not None and keep_last < 1) or (max_age_days is not None and max_age_days < 1):
+            return jsonify({'error': '无效的保留策略'}), 400
         
-        db.session.delete(file_record)
+        file_record.version_keep_last = keep_last
+        file_record.version_max_age_days = max_age_days
+        removed = VersionStore.apply_retention(file_record) if file_record.current_version_id else 0
         db.session.commit()
         
-        return jsonify({'message': '删除成功'}), 200
+        return jsonify({
+            'message': '保留策略已更新',
+            'removed_versions': removed
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@files_bp.route('/archive', methods=['POST'])
+@require_auth
+def download_archive(user):
+    """
+    流式下载多个文件（按文件ID列表或整个文件夹子树）
+    
+    响应为分帧加密的归档流（格式见 storage/archive.py），边读边发，
+    客户端可以在收到每个条目后立即解密，不需要为每个文件单独发起请求。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        session_key = _get_transport_key()
+        if not session_key:
+            return jsonify({'error': '会话密钥丢失'}), 400
+        
+        # 密文位置以密文记录为准（旧文件没有密文记录时使用 file_path）
+        columns = (File.id, File.original_filename,
+                   db.func.coalesce(Blob.storage_path, File.file_path).label('file_path'), File.file_size,
+                   File.encrypted_file_key, File.key_epoch, File.group_id, File.folder_id,
+                   File.current_version_id)
+        folder_names = {}
+        missing = []
+        
+        try:
+            folder_id = _parse_optional_id(data.get('folder_id'))
+        except (TypeError, ValueError):
+            return jsonify({'error': '无效的文件夹ID'}), 400
+        
+        if folder_id:
+            folder, allowed = get_folder_for_user(user.id, folder_id)
+            if not folder:
+                return jsonify({'error': '文件夹不存在'}), 404
+            if not allowed:
+                return jsonify({'error': '无权访问此文件夹'}), 403
+            
+            # 一次查询取回子树全部文件夹，用于还原相对路径
+            subtree = db.session.query(Folder.id, Folder.name).filter(subtree_filter(folder.path)).all()
+            folder_names = dict(subtree)
+            root_depth = folder.path.count('/') - 2
+            # 文件按连接的文件夹路径区间筛选，不展开子树ID列表
+            query = accessible_files_query(user.id).join(
+                Folder, File.folder_id == Folder.id
+            ).outerjoin(Blob, File.blob_id == Blob.id).filter(
+                subtree_filter(folder.path)
+            ).order_by(Folder.path, File.original_filename)
+            rows = query.with_entities(*columns, Folder.path).limit(MAX_ARCHIVE_FILES + 1).all()
+        else:
+            file_ids = _parse_file_ids(data)
+            if not file_ids:
+                return jsonify({'error': '缺少文件ID列表'}), 400
+            root_depth = None
+            query = accessible_files_query(user.id).outerjoin(Blob, File.blob_id == Blob.id).filter(
+                File.id.in_(file_ids)
+            )
+            rows = query.with_entities(*columns).limit(MAX_ARCHIVE_FILES + 1).all()
+            found = {row.id for row in rows}
+            missing = [file_id for file_id in file_ids if file_id not in found]
+        
+        if len(rows) > MAX_ARCHIVE_FILES:
+            return jsonify({'error': f'单次最多打包{MAX_ARCHIVE_FILES}个文件'}), 400
+        
+        contents = {row.id: (row.file_path, row.current_version_id) for row in rows}
+        
+        def entries():
+            for row in rows:
+                relative_path = row.original_filename
+                if root_depth is not None:
+                    # 物化路径 /1/5/9/ 中取请求文件夹之下的部分作为目录名
+                    folder_ids = [int(i) for i in row.path.strip('/').split('/')][root_depth + 1:]
+                    relative_path = '/'.join([folder_names[i] for i in folder_ids] + [row.original_filename])
+                yield {
+                    'id': row.id,
+                    'name': row.original_filename,
+                    'path': relative_path,
+                    'size': row.file_size,
+                    'encrypted_file_key': row.encrypted_file_key,
+                    'key_epoch': row.key_epoch,
+                    'group_id': row.group_id
+                }
+        
+        stream = ArchiveStream(session_key)
+        response = Response(
+            stream_with_context(stream.generate(
+                entries(),
+                lambda entry: VersionStore.iter_content(*contents[entry['id']], chunk_size=stream.chunk_size),
+                missing
+            )),
+            mimetype='application/octet-stream'
+        )
+        response.headers['X-Archive-Format'] = ARCHIVE_FORMAT
+        return response
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
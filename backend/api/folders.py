@@ -0,0 +1,217 @@
+"""
+文件夹管理API接口
+使用物化路径，列目录、统计子树、移动/重命名子树都只需固定次数的查询
+"""
+from flask import Blueprint, request, jsonify
+from sqlalchemy import func, literal
+from models import Folder, File, UserGroup, db
+from api.auth import require_auth
+from utils.access import is_group_member, get_folder_for_user
+from datetime import datetime
+
+folders_bp = Blueprint('folders', __name__)
+
+def subtree_filter(path: str):
+    """
+    匹配以 path 为前缀的所有文件夹（含自身）
+    
+    路径以 '/' 结尾，'/' 的下一个字符是 '0'，因此用区间比较代替 LIKE，可直接走索引。
+    """
+    return db.and_(Folder.path >= path, Folder.path < path[:-1] + '0')
+
+def subtree_folder_ids(path: str):
+    """子树内全部文件夹ID的子查询"""
+    return db.session.query(Folder.id).filter(subtree_filter(path))
+
+def load_folder(user, folder_id, group_id=None):
+    """
+    加载文件夹并校验访问权限及所属空间
+
+    Returns:
+        tuple: (folder, error_response)
+    """
+    folder, allowed = get_folder_for_user(user.id, folder_id)
+    if not folder:
+        return None, (jsonify({'error': '文件夹不存在'}), 404)
+    if not allowed:
+        return None, (jsonify({'error': '无权访问此文件夹'}), 403)
+    if folder.group_id != group_id:
+        return None, (jsonify({'error': '文件夹不属于目标空间'}), 400)
+    return folder, None
+
+@folders_bp.route('', methods=['POST'])
+@require_auth
+def create_folder(user):
+    """创建文件夹"""
+    try:
+        data = request.get_json(silent=True) or {}
+        name = (data.get('name') or '').strip()
+        parent_id = data.get('parent_id')
+        group_id = data.get('group_id')
+        
+        if not name or '/' in name:
+            return jsonify({'error': '无效的文件夹名称'}), 400
+        
+        try:
+            group_id = int(group_id) if group_id else None
+            parent_id = int(parent_id) if parent_id else None
+        except (TypeError, ValueError):
+            return jsonify({'error': '无效的组ID或父文件夹ID'}), 400
+        
+        if group_id:
+            if not is_group_member(user.id, group_id):
+                return jsonify({'error': '不是该组成员'}), 403
+            if not UserGroup.query.get(group_id):
+                return jsonify({'error': '用户组不存在'}), 404
+        else:
+            group_id = None
+        
+        parent = None
+        if parent_id:
+            parent, error = load_folder(user, parent_id, group_id)
+            if error:
+                return error
+        
+        folder = Folder(
+            name=name,
+            parent_id=parent.id if parent else None,
+            owner_id=user.id,
+            group_id=group_id
+        )
+        db.session.add(folder)
+        db.session.flush()
+        folder.path = f'{parent.path if parent else "/"}{folder.id}/'
+        db.session.commit()
+        
+        return jsonify({
+            'message': '创建成功',
+            'folder': folder.to_dict()
+        }), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@folders_bp.route('/<int:folder_id>/stats', methods=['GET'])
+@require_auth
+def folder_stats(user, folder_id):
+    """统计文件夹子树的文件夹数、文件数和总大小"""
+    try:
+        folder, allowed = get_folder_for_user(user.id, folder_id)
+        if not folder:
+            return jsonify({'error': '文件夹不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权访问此文件夹'}), 403
+        
+        folder_count = db.session.query(func.count(Folder.id)).filter(
+            subtree_filter(folder.path)
+        ).scalar()
+        file_count, total_size = db.session.query(
+            func.count(File.id), func.coalesce(func.sum(File.file_size), 0)
+        ).join(Folder, File.folder_id == Folder.id).filter(
+            subtree_filter(folder.path),
+            File.deleted_at.is_(None)
+        ).one()
+        
+        return jsonify({
+            'folder': folder.to_dict(),
+            'folder_count': folder_count - 1,
+            'file_count': file_count,
+            'total_size': int(total_size)
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@folders_bp.route('/<int:folder_id>', methods=['PUT'])
+@require_auth
+def update_folder(user, folder_id):
+    """重命名或移动文件夹（移动只改写子树路径，不触及其中的文件）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        folder, allowed = get_folder_for_user(user.id, folder_id)
+        if not folder:
+            return jsonify({'error': '文件夹不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权访问此文件夹'}), 403
+        
+        if 'name' in data:
+            name = (data.get('name') or '').strip()
+            if not name or '/' in name:
+                return jsonify({'error': '无效的文件夹名称'}), 400
+            folder.name = name
+        
+        if 'parent_id' in data:
+            try:
+                parent_id = int(data.get('parent_id') or 0)
+            except (TypeError, ValueError):
+                return jsonify({'error': '无效的父文件夹ID'}), 400
+            parent = None
+            if parent_id:
+                # 只能在同一空间内移动，跨空间需要重新封装全部文件密钥
+                parent, error = load_folder(user, parent_id, folder.group_id)
+                if error:
+                    return error
+                if parent.path.startswith(folder.path):
+                    return jsonify({'error': '不能移动到自身或子文件夹中'}), 400
+            
+            old_path = folder.path
+            new_path = f'{parent.path if parent else "/"}{folder.id}/'
+            if new_path != old_path:
+                # 一条UPDATE改写整个子树的路径前缀
+                Folder.query.filter(subtree_filter(old_path)).update(
+                    {Folder.path: literal(new_path) + func.substr(Folder.path, len(old_path) + 1)},
+                    synchronize_session=False
+                )
+                folder.parent_id = parent.id if parent else None
+                folder.path = new_path
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': '更新成功',
+            'folder': folder.to_dict()
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@folders_bp.route('/<int:folder_id>', methods=['DELETE'])
+@require_auth
+def delete_folder(user, folder_id):
+    """删除文件夹子树，其中的文件移入回收站（恢复时回到根目录）"""
+    try:
+        folder, allowed = get_folder_for_user(user.id, folder_id)
+        if not folder:
+            return jsonify({'error': '文件夹不存在'}), 404
+        if not allowed:
+            return jsonify({'error': '无权删除此文件夹'}), 403
+        
+        path = folder.path
+        now = datetime.now()
+        
+        # 已在回收站中的文件只解除与文件夹的关联，保留原删除时间
+        File.query.filter(
+            File.folder_id.in_(subtree_folder_ids(path)),
+            File.deleted_at.isnot(None)
+        ).update({File.folder_id: None}, synchronize_session=False)
+        file_count = File.query.filter(
+            File.folder_id.in_(subtree_folder_ids(path))
+        ).update({
+            File.folder_id: None,
+            File.deleted_at: now,
+            File.deleted_by: user.id
+        }, synchronize_session=False)
+        Folder.query.filter(subtree_filter(path)).delete(synchronize_session=False)
+        db.session.commit()
+        
+        return jsonify({
+            'message': '删除成功',
+            'deleted_files': file_count
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
@@ -2,21 +2,30 @@
 用户组管理API接口
 """
 from flask import Blueprint, request, jsonify
-from models import UserGroup, GroupMember, GroupSharedKey, GroupJoinRequest, User, db
+from models import UserGroup, GroupMember, GroupSharedKey, GroupJoinRequest, GroupKeyRotation, User, File, FileVersion, db
 from api.auth import require_auth
+from utils.access import membership_cache, get_member_role, is_group_admin, ADMIN_ROLES
 from datetime import datetime
 import json
 
 groups_bp = Blueprint('groups', __name__)
 
+# 单次批量操作的最大条目数
+MAX_BATCH_MEMBERS = 500
+# 密钥轮换时单批重新封装的最大条目数
+MAX_REWRAP_BATCH = 1000
+
+def _serialize_key(encrypted_key):
+    """将客户端上传的加密密钥统一为字符串存储"""
+    return json.dumps(encrypted_key) if isinstance(encrypted_key, dict) else encrypted_key
+
 @groups_bp.route('/list', methods=['GET'])
 @require_auth
 def list_groups(user):
     """获取用户所属的组列表"""
     try:
         # 获取用户所属的所有组
-        memberships = GroupMember.query.filter_by(user_id=user.id).all()
-        group_ids = [m.group_id for m in memberships]
+        group_ids = list(membership_cache.get_group_ids(user.id))
         
         # 如果没有组，返回空列表
         if not group_ids:
@@ -42,8 +51,7 @@ def list_all_groups(user):
     """获取所有可选的用户组列表（排除已加入的）"""
     try:
         # 获取用户已经加入的组ID
-        memberships = GroupMember.query.filter_by(user_id=user.id).all()
-        joined_group_ids = [m.group_id for m in memberships]
+        joined_group_ids = membership_cache.get_group_ids(user.id)
         
         # 获取所有组，并关联创建者信息
         all_groups = UserGroup.query.all()
@@ -83,10 +91,12 @@ def list_all_groups(user):
 def create_group(user):
     """创建用户组"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         name = data.get('name')
         description = data.get('description', '')
         encrypted_group_key = data.get('encrypted_group_key') # 创作者加密后的组密钥
+        # 初始成员列表: [{'user_id': 1, 'encrypted_key': ...}]，密钥使用各成员公钥加密
+        initial_members = data.get('members') or []
         
         if not name:
             return jsonify({'error': '组名不能为空'}), 400
@@ -94,6 +104,30 @@ def create_group(user):
         if not encrypted_group_key:
             return jsonify({'error': '缺少初始组密钥'}), 400
         
+        if len(initial_members) > MAX_BATCH_MEMBERS:
+            return jsonify({'error': f'初始成员不能超过{MAX_BATCH_MEMBERS}个'}), 400
+        
+        if not isinstance(initial_members, list):
+            return jsonify({'error': '无效的初始成员列表'}), 400
+        
+        member_keys = {}
+        for item in initial_members:
+            if not isinstance(item, dict) or not item.get('user_id') or not item.get('encrypted_key'):
+                return jsonify({'error': '初始成员缺少用户ID或加密组密钥'}), 400
+            try:
+                member_id = int(item['user_id'])
+            except (TypeError, ValueError):
+                return jsonify({'error': '无效的用户ID'}), 400
+            if member_id != user.id:
+                member_keys[member_id] = item['encrypted_key']
+        
+        # 一次查询校验所有初始成员
+        if member_keys:
+            found = {uid for (uid,) in db.session.query(User.id).filter(User.id.in_(member_keys)).all()}
+            missing = sorted(set(member_keys) - found)
+            if missing:
+                return jsonify({'error': '部分用户不存在', 'user_ids': missing}), 400
+        
         # 创建用户组
         group = UserGroup(
             name=name,
@@ -116,12 +150,23 @@ def create_group(user):
         shared_key = GroupSharedKey(
             group_id=group.id,
             user_id=user.id,
-            encrypted_key=json.dumps(encrypted_group_key) if isinstance(encrypted_group_key, dict) else encrypted_group_key,
+            encrypted_key=_serialize_key(encrypted_group_key),
             shared_by=user.id
         )
         db.session.add(shared_key)
         
+        # 添加初始成员及其组密钥
+        for member_id, encrypted_key in member_keys.items():
+            db.session.add(GroupMember(user_id=member_id, group_id=group.id, role='member'))
+            db.session.add(GroupSharedKey(
+                group_id=group.id,
+                user_id=member_id,
+                encrypted_key=_serialize_key(encrypted_key),
+                shared_by=user.id
+            ))
+        
         db.session.commit()
+        membership_cache.invalidate(user.id, *member_keys)
         
         return jsonify({
             'message': '创建成功',
@@ -129,6 +174,7 @@ def create_group(user):
         }), 201
     
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @groups_bp.route('/join', methods=['POST'])
@@ -201,12 +247,10 @@ def get_group_requests(user):
     """获取用户组的加入申请（仅组管理员和创建者可查看）"""
     try:
         # 获取用户管理的所有组
-        managed_groups = GroupMember.query.filter(
-            GroupMember.user_id == user.id,
-            GroupMember.role.in_(['owner', 'admin'])
-        ).all()
-        
-        group_ids = [m.group_id for m in managed_groups]
+        group_ids = [
+            group_id for group_id, role in membership_cache.get_roles(user.id).items()
+            if role in ADMIN_ROLES
+        ]
         
         if not group_ids:
             return jsonify({'requests': []}), 200
@@ -243,13 +287,7 @@ def approve_join_request(user, request_id):
         join_request = GroupJoinRequest.query.get_or_404(request_id)
         
         # 检查用户是否有权限审批（组管理员或创建者）
-        membership = GroupMember.query.filter(
-            GroupMember.user_id == user.id,
-            GroupMember.group_id == join_request.group_id,
-            GroupMember.role.in_(['owner', 'admin'])
-        ).first()
-        
-        if not membership:
+        if not is_group_admin(user.id, join_request.group_id):
             return jsonify({'error': '没有权限审批此申请'}), 403
         
         # 检查申请状态
@@ -268,6 +306,7 @@ def approve_join_request(user, request_id):
         
         db.session.add(member)
         db.session.commit()
+        membership_cache.invalidate(join_request.user_id)
         
         return jsonify({'message': '批准成功'}), 200
     
@@ -283,12 +322,7 @@ def reject_join_request(user, request_id):
         join_request = GroupJoinRequest.query.get_or_404(request_id)
         
         # 检查用户是否有权限审批（组管理员或创建者）
-        membership = GroupMember.query.filter_by(
-            user_id=user.id,
-            group_id=join_request.group_id
-        ).first()
-        
-        if not membership or membership.role not in ['owner', 'admin']:
+        if not is_group_admin(user.id, join_request.group_id):
             return jsonify({'error': '没有权限审批此申请'}), 403
         
         # 检查申请状态
@@ -304,6 +338,111 @@ def reject_join_request(user, request_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@groups_bp.route('/<int:group_id>/requests/approve-batch', methods=['POST'])
+@require_auth
+def approve_join_requests_batch(user, group_id):
+    """批量批准加入申请，并在同一事务中分发组密钥"""
+    try:
+        data = request.get_json() or {}
+        # items: [{'request_id': 1, 'encrypted_key': ...}]，encrypted_key 可选
+        items = data.get('items') or []
+        
+        if not items or not isinstance(items, list):
+            return jsonify({'error': '缺少申请列表'}), 400
+        
+        if len(items) > MAX_BATCH_MEMBERS:
+            return jsonify({'error': f'单次最多处理{MAX_BATCH_MEMBERS}个申请'}), 400
+        
+        # 只做一次权限检查
+        if not is_group_admin(user.id, group_id):
+            return jsonify({'error': '没有权限审批此申请'}), 403
+        
+        group = UserGroup.query.get_or_404(group_id)
+        
+        keys_by_request = {}
+        for item in items:
+            if not isinstance(item, dict) or not item.get('request_id'):
+                return jsonify({'error': '缺少申请ID'}), 400
+            try:
+                keys_by_request[int(item['request_id'])] = item.get('encrypted_key')
+            except (TypeError, ValueError):
+                return jsonify({'error': '无效的申请ID'}), 400
+        
+        # 一次查询取回全部申请
+        join_requests = GroupJoinRequest.query.filter(
+            GroupJoinRequest.id.in_(keys_by_request),
+            GroupJoinRequest.group_id == group_id
+        ).all()
+        requests_by_id = {r.id: r for r in join_requests}
+        
+        user_ids = [r.user_id for r in join_requests]
+        existing_members = {uid for (uid,) in db.session.query(GroupMember.user_id).filter(
+            GroupMember.group_id == group_id,
+            GroupMember.user_id.in_(user_ids)
+        ).all()} if user_ids else set()
+        existing_keys = {k.user_id: k for k in GroupSharedKey.query.filter(
+            GroupSharedKey.group_id == group_id,
+            GroupSharedKey.epoch == group.key_epoch,
+            GroupSharedKey.user_id.in_(user_ids)
+        ).all()} if user_ids else {}
+        
+        results = []
+        approved_users = []
+        now = datetime.now()
+        for request_id, encrypted_key in keys_by_request.items():
+            join_request = requests_by_id.get(request_id)
+            if not join_request:
+                results.append({'request_id': request_id, 'status': 'error', 'error': '申请不存在'})
+                continue
+            if join_request.status != 'pending':
+                results.append({'request_id': request_id, 'status': 'error', 'error': '申请已经处理过'})
+                continue
+            
+            join_request.status = 'approved'
+            if join_request.user_id not in existing_members:
+                db.session.add(GroupMember(
+                    user_id=join_request.user_id,
+                    group_id=group_id,
+                    role='member'
+                ))
+                existing_members.add(join_request.user_id)
+            
+            if encrypted_key:
+                existing_key = existing_keys.get(join_request.user_id)
+                if existing_key:
+                    existing_key.encrypted_key = _serialize_key(encrypted_key)
+                    existing_key.shared_by = user.id
+                    existing_key.shared_at = now
+                else:
+                    existing_keys[join_request.user_id] = GroupSharedKey(
+                        group_id=group_id,
+                        user_id=join_request.user_id,
+                        encrypted_key=_serialize_key(encrypted_key),
+                        epoch=group.key_epoch,
+                        shared_by=user.id
+                    )
+                    db.session.add(existing_keys[join_request.user_id])
+            
+            approved_users.append(join_request.user_id)
+            results.append({
+                'request_id': request_id,
+                'user_id': join_request.user_id,
+                'status': 'approved',
+                'key_shared': bool(encrypted_key)
+            })
+        
+        db.session.commit()
+        membership_cache.invalidate(*approved_users)
+        
+        return jsonify({
+            'message': f'已批准{len(approved_users)}个申请',
+            'results': results
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @groups_bp.route('/share-key', methods=['POST'])
 @require_auth
 def share_key(user):
@@ -318,15 +457,10 @@ def share_key(user):
             return jsonify({'error': '缺少必要参数'}), 400
         
         # 检查操作者是否在组内且具有管理员权限
-        operator_membership = GroupMember.query.filter_by(
-            user_id=user.id,
-            group_id=group_id
-        ).first()
-        
-        if not operator_membership or operator_membership.role not in ['owner', 'admin']:
+        if not is_group_admin(user.id, group_id):
             return jsonify({'error': '没有权限共享密钥'}), 403
         
-        # 检查接收者是否在组内
+        # 检查接收者是否在组内（以数据库为准，避免其他进程缓存中的旧数据误判新成员）
         receiver_membership = GroupMember.query.filter_by(
             user_id=user_id,
             group_id=group_id
@@ -335,14 +469,21 @@ def share_key(user):
         if not receiver_membership:
             return jsonify({'error': '接收者不是该组成员'}), 400
         
+        # 默认使用组当前的密钥版本
+        group = UserGroup.query.get_or_404(group_id)
+        epoch = int(data.get('epoch') or group.key_epoch)
+        if epoch < 1 or epoch > group.key_epoch:
+            return jsonify({'error': '无效的组密钥版本'}), 400
+        
         # 检查是否已经存在该用户的密钥
         existing_key = GroupSharedKey.query.filter_by(
             group_id=group_id,
-            user_id=user_id
+            user_id=user_id,
+            epoch=epoch
         ).first()
         
         if existing_key:
-            existing_key.encrypted_key = json.dumps(encrypted_key) if isinstance(encrypted_key, dict) else encrypted_key
+            existing_key.encrypted_key = _serialize_key(encrypted_key)
             existing_key.shared_by = user.id
             existing_key.shared_at = datetime.now()
         else:
@@ -350,7 +491,8 @@ def share_key(user):
             shared_key = GroupSharedKey(
                 group_id=group_id,
                 user_id=user_id,
-                encrypted_key=json.dumps(encrypted_key) if isinstance(encrypted_key, dict) else encrypted_key,
+                encrypted_key=_serialize_key(encrypted_key),
+                epoch=epoch,
                 shared_by=user.id
             )
             db.session.add(shared_key)
@@ -358,7 +500,8 @@ def share_key(user):
         db.session.commit()
         
         return jsonify({
-            'message': '密钥共享成功'
+            'message': '密钥共享成功',
+            'epoch': epoch
         }), 201
     
     except Exception as e:
@@ -367,18 +510,23 @@ def share_key(user):
 @groups_bp.route('/<int:group_id>/key', methods=['GET'])
 @require_auth
 def get_group_key(user, group_id):
-    """获取当前用户在特定组的加密组密钥"""
+    """获取当前用户在特定组的加密组密钥（默认最新版本，可通过 epoch 参数指定版本）"""
     try:
-        shared_key = GroupSharedKey.query.filter_by(
+        epoch = request.args.get('epoch', type=int)
+        query = GroupSharedKey.query.filter_by(
             group_id=group_id,
             user_id=user.id
-        ).first()
+        )
+        if epoch:
+            query = query.filter_by(epoch=epoch)
+        shared_key = query.order_by(GroupSharedKey.epoch.desc()).first()
         
         if not shared_key:
             return jsonify({'error': '尚未为您分配组密钥，请联系管理员'}), 404
         
         return jsonify({
-            'encrypted_key': json.loads(shared_key.encrypted_key) if shared_key.encrypted_key.startswith('{') else shared_key.encrypted_key
+            'encrypted_key': json.loads(shared_key.encrypted_key) if shared_key.encrypted_key.startswith('{') else shared_key.encrypted_key,
+            'epoch': shared_key.epoch
         }), 200
     
     except Exception as e:
@@ -390,12 +538,7 @@ def get_group_members(user, group_id):
     """获取组成员列表"""
     try:
         # 检查用户是否在组内
-        membership = GroupMember.query.filter_by(
-            user_id=user.id,
-            group_id=group_id
-        ).first()
-        
-        if not membership:
+        if not membership_cache.is_member(user.id, group_id):
             return jsonify({'error': '不是该组成员'}), 403
         
         members = GroupMember.query.filter_by(group_id=group_id).all()
@@ -406,3 +549,456 @@ def get_group_members(user, group_id):
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+def _start_key_rotation(group, operator_id, reason, removed_user_id=None):
+    """创建新的组密钥版本和对应的轮换任务（不提交事务）"""
+    from_epoch = group.key_epoch
+    group.key_epoch = from_epoch + 1
+    
+    total_files = File.query.filter(
+        File.group_id == group.id,
+        File.key_epoch < group.key_epoch
+    ).count()
+    
+    job = GroupKeyRotation(
+        group_id=group.id,
+        from_epoch=from_epoch,
+        to_epoch=group.key_epoch,
+        status='running',
+        reason=reason,
+        removed_user_id=removed_user_id,
+        total_files=total_files,
+        created_by=operator_id
+    )
+    db.session.add(job)
+    return job
+
+def _load_rotation_job(user, job_id):
+    """加载轮换任务并检查操作者是否为组管理员"""
+    job = GroupKeyRotation.query.get(job_id)
+    if not job:
+        return None, (jsonify({'error': '轮换任务不存在'}), 404)
+    if not is_group_admin(user.id, job.group_id):
+        return None, (jsonify({'error': '没有权限管理密钥轮换'}), 403)
+    return job, None
+
+def _pending_versions_query(job):
+    """组内文件尚未重新封装的版本（文件密钥仍由旧版本组密钥封装）"""
+    return FileVersion.query.join(File, File.id == FileVersion.file_id).filter(
+        File.group_id == job.group_id,
+        FileVersion.key_epoch < job.to_epoch
+    )
+
+@groups_bp.route('/<int:group_id>/members/<int:member_id>', methods=['DELETE'])
+@require_auth
+def remove_group_member(user, group_id, member_id):
+    """移除组成员，并默认启动组密钥轮换"""
+    try:
+        operator_role = get_member_role(user.id, group_id)
+        if operator_role not in ADMIN_ROLES:
+            return jsonify({'error': '没有权限移除成员'}), 403
+        
+        member = GroupMember.query.filter_by(user_id=member_id, group_id=group_id).first()
+        if not member:
+            return jsonify({'error': '该用户不是组成员'}), 404
+        
+        if member.role == 'owner':
+            return jsonify({'error': '不能移除组创建者'}), 400
+        
+        if member.role == 'admin' and operator_role != 'owner':
+            return jsonify({'error': '只有组创建者可以移除管理员'}), 403
+        
+        group = UserGroup.query.get_or_404(group_id)
+        rotate = request.args.get('rotate', 'true').lower() != 'false'
+        
+        # 移除成员及其所有版本的组密钥
+        db.session.delete(member)
+        GroupSharedKey.query.filter_by(
+            group_id=group_id,
+            user_id=member_id
+        ).delete(synchronize_session=False)
+        
+        job = None
+        if rotate:
+            # 被移除的成员可能已拿到进行中轮换的新版本密钥，因此作废该任务并从新版本重新开始
+            GroupKeyRotation.query.filter_by(
+                group_id=group_id,
+                status='running'
+            ).update({'status': 'superseded'}, synchronize_session=False)
+            job = _start_key_rotation(group, user.id, 'member_removed', member_id)
+        
+        db.session.commit()
+        membership_cache.invalidate(member_id)
+        
+        return jsonify({
+            'message': '成员已移除',
+            'rotation': job.to_dict() if job else None
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@groups_bp.route('/<int:group_id>/key-rotations', methods=['POST'])
+@require_auth
+def start_key_rotation(user, group_id):
+    """手动启动组密钥轮换"""
+    try:
+        if not is_group_admin(user.id, group_id):
+            return jsonify({'error': '没有权限管理密钥轮换'}), 403
+        
+        group = UserGroup.query.get_or_404(group_id)
+        
+        running = GroupKeyRotation.query.filter_by(group_id=group_id, status='running').first()
+        if running:
+            return jsonify({'error': '已有进行中的密钥轮换', 'rotation': running.to_dict()}), 409
+        
+        job = _start_key_rotation(group, user.id, 'manual')
+        db.session.commit()
+        
+        return jsonify({'rotation': job.to_dict()}), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@groups_bp.route('/key-rotations/<int:job_id>', methods=['GET'])
+@require_auth
+def get_key_rotation(user, job_id):
+    """查询密钥轮换任务进度"""
+    try:
+        job, error = _load_rotation_job(user, job_id)
+        if error:
+            return error
+        
+        pending_files = File.query.filter(
+            File.group_id == job.group_id,
+            File.key_epoch < job.to_epoch
+        ).count()
+        
+        member_ids = db.session.query(GroupMember.user_id).filter(GroupMember.group_id == job.group_id)
+        pending_members = member_ids.filter(~GroupMember.user_id.in_(
+            db.session.query(GroupSharedKey.user_id).filter(
+                GroupSharedKey.group_id == job.group_id,
+                GroupSharedKey.epoch == job.to_epoch
+            )
+        )).count()
+        
+        result = job.to_dict()
+        result['pending_files'] = pending_files
+        result['pending_versions'] = _pending_versions_query(job).count()
+        result['pending_members'] = pending_members
+        return jsonify({'rotation': result}), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@groups_bp.route('/key-rotations/<int:job_id>/files', methods=['GET'])
+@require_auth
+def list_rotation_pending_files(user, job_id):
+    """
+    分页获取尚未重新封装的文件密钥
+    
+    使用 after_id 游标分页，客户端中断后从最后处理的ID继续即可。
+    """
+    try:
+        job, error = _load_rotation_job(user, job_id)
+        if error:
+            return error
+        
+        after_id = request.args.get('after_id', 0, type=int)
+        limit = min(request.args.get('limit', MAX_REWRAP_BATCH, type=int), MAX_REWRAP_BATCH)
+        
+        rows = db.session.query(File.id, File.encrypted_file_key, File.key_epoch).filter(
+            File.group_id == job.group_id,
+            File.key_epoch < job.to_epoch,
+            File.id > after_id
+        ).order_by(File.id).limit(limit).all()
+        
+        return jsonify({
+            'files': [
+                {'id': file_id, 'encrypted_file_key': encrypted_file_key, 'key_epoch': key_epoch}
+                for file_id, encrypted_file_key, key_epoch in rows
+            ],
+            'next_after_id': rows[-1][0] if len(rows) == limit else None
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@groups_bp.route('/key-rotations/<int:job_id>/files', methods=['POST'])
+@require_auth
+def upload_rotated_file_keys(user, job_id):
+    """批量提交使用新版本组密钥重新封装的文件密钥"""
+    try:
+        job, error = _load_rotation_job(user, job_id)
+        if error:
+            return error
+        
+        if job.status != 'running':
+            return jsonify({'error': '轮换任务已结束'}), 400
+        
+        items = (request.get_json() or {}).get('files') or []
+        if len(items) > MAX_REWRAP_BATCH:
+            return jsonify({'error': f'单批最多提交{MAX_REWRAP_BATCH}个文件密钥'}), 400
+        
+        params = []
+        for item in items:
+            if not item.get('file_id') or not item.get('encrypted_file_key'):
+                return jsonify({'error': '缺少文件ID或加密文件密钥'}), 400
+            params.append({
+                'b_id': int(item['file_id']),
+                'b_key': _serialize_key(item['encrypted_file_key'])
+            })
+        
+        updated = 0
+        if params:
+            # 与文件当前封装结果相同的版本（含当前版本）使用同一文件密钥，随文件一起更新；
+            # 须在更新文件之前执行，此时文件记录中仍是旧的封装结果
+            files_table = File.__table__
+            versions_table = FileVersion.__table__
+            old_key = db.select(files_table.c.encrypted_file_key).where(
+                files_table.c.id == db.bindparam('b_id'),
+                files_table.c.group_id == job.group_id,
+                files_table.c.key_epoch < job.to_epoch
+            ).scalar_subquery()
+            db.session.execute(versions_table.update().where(
+                versions_table.c.file_id == db.bindparam('b_id'),
+                versions_table.c.key_epoch < job.to_epoch,
+                versions_table.c.encrypted_file_key == old_key
+            ).values(
+                encrypted_file_key=db.bindparam('b_key'),
+                key_epoch=job.to_epoch
+            ), params)
+            
+            # executemany 批量更新，只更新仍处于旧版本的文件，重复提交不会重复计数
+            stmt = files_table.update().where(
+                files_table.c.id == db.bindparam('b_id'),
+                files_table.c.group_id == job.group_id,
+                files_table.c.key_epoch < job.to_epoch
+            ).values(
+                encrypted_file_key=db.bindparam('b_key'),
+                key_epoch=job.to_epoch
+            )
+            updated = db.session.execute(stmt, params).rowcount
+            job.rewrapped_files = (job.rewrapped_files or 0) + updated
+        
+        db.session.commit()
+        
+        return jsonify({
+            'updated': updated,
+            'skipped': len(params) - updated,
+            'rotation': job.to_dict()
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@groups_bp.route('/key-rotations/<int:job_id>/versions', methods=['GET'])
+@require_auth
+def list_rotation_pending_versions(user, job_id):
+    """
+    分页获取尚未重新封装的历史版本文件密钥
+    
+    与文件当前封装结果相同的版本在提交文件密钥时已一并更新，这里只剩使用其他封装结果的版本。
+    """
+    try:
+        job, error = _load_rotation_job(user, job_id)
+        if error:
+            return error
+        
+        after_id = request.args.get('after_id', 0, type=int)
+        limit = min(request.args.get('limit', MAX_REWRAP_BATCH, type=int), MAX_REWRAP_BATCH)
+        
+        rows = _pending_versions_query(job).filter(FileVersion.id > after_id).with_entities(
+            FileVersion.id, FileVersion.file_id, FileVersion.version,
+            FileVersion.encrypted_file_key, FileVersion.key_epoch
+        ).order_by(FileVersion.id).limit(limit).all()
+        
+        return jsonify({
+            'versions': [
+                {
+                    'id': row.id,
+                    'file_id': row.file_id,
+                    'version': row.version,
+                    'encrypted_file_key': row.encrypted_file_key,
+                    'key_epoch': row.key_epoch
+                }
+                for row in rows
+            ],
+            'next_after_id': rows[-1].id if len(rows) == limit else None
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@groups_bp.route('/key-rotations/<int:job_id>/versions', methods=['POST'])
+@require_auth
+def upload_rotated_version_keys(user, job_id):
+    """批量提交使用新版本组密钥重新封装的历史版本文件密钥"""
+    try:
+        job, error = _load_rotation_job(user, job_id)
+        if error:
+            return error
+        
+        if job.status != 'running':
+            return jsonify({'error': '轮换任务已结束'}), 400
+        
+        items = (request.get_json() or {}).get('versions') or []
+        if len(items) > MAX_REWRAP_BATCH:
+            return jsonify({'error': f'单批最多提交{MAX_REWRAP_BATCH}个文件密钥'}), 400
+        
+        params = []
+        for item in items:
+            if not item.get('version_id') or not item.get('encrypted_file_key'):
+                return jsonify({'error': '缺少版本ID或加密文件密钥'}), 400
+            params.append({
+                'b_id': int(item['version_id']),
+                'b_key': _serialize_key(item['encrypted_file_key'])
+            })
+        
+        updated = 0
+        if params:
+            files_table = File.__table__
+            versions_table = FileVersion.__table__
+            stmt = versions_table.update().where(
+                versions_table.c.id == db.bindparam('b_id'),
+                versions_table.c.key_epoch < job.to_epoch,
+                versions_table.c.file_id.in_(
+                    db.select(files_table.c.id).where(files_table.c.group_id == job.group_id)
+                )
+            ).values(
+                encrypted_file_key=db.bindparam('b_key'),
+                key_epoch=job.to_epoch
+            )
+            updated = db.session.execute(stmt, params).rowcount
+        
+        db.session.commit()
+        
+        return jsonify({
+            'updated': updated,
+            'skipped': len(params) - updated,
+            'rotation': job.to_dict()
+        }), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@groups_bp.route('/key-rotations/<int:job_id>/member-keys', methods=['POST'])
+@require_auth
+def upload_rotated_member_keys(user, job_id):
+    """批量提交新版本组密钥（使用各成员公钥加密）"""
+    try:
+        job, error = _load_rotation_job(user, job_id)
+        if error:
+            return error
+        
+        if job.status != 'running':
+            return jsonify({'error': '轮换任务已结束'}), 400
+        
+        items = (request.get_json() or {}).get('keys') or []
+        if len(items) > MAX_REWRAP_BATCH:
+            return jsonify({'error': f'单批最多提交{MAX_REWRAP_BATCH}个成员密钥'}), 400
+        
+        keys_by_user = {}
+        for item in items:
+            if not item.get('user_id') or not item.get('encrypted_key'):
+                return jsonify({'error': '缺少用户ID或加密组密钥'}), 400
+            keys_by_user[int(item['user_id'])] = item['encrypted_key']
+        
+        if not keys_by_user:
+            return jsonify({'updated': 0, 'rotation': job.to_dict()}), 200
+        
+        members = {uid for (uid,) in db.session.query(GroupMember.user_id).filter(
+            GroupMember.group_id == job.group_id,
+            GroupMember.user_id.in_(keys_by_user)
+        ).all()}
+        existing_keys = {k.user_id: k for k in GroupSharedKey.query.filter(
+            GroupSharedKey.group_id == job.group_id,
+            GroupSharedKey.epoch == job.to_epoch,
+            GroupSharedKey.user_id.in_(keys_by_user)
+        ).all()}
+        
+        results = []
+        created = 0
+        now = datetime.now()
+        for member_id, encrypted_key in keys_by_user.items():
+            if member_id not in members:
+                results.append({'user_id': member_id, 'status': 'error', 'error': '该用户不是组成员'})
+                continue
+            existing_key = existing_keys.get(member_id)
+            if existing_key:
+                existing_key.encrypted_key = _serialize_key(encrypted_key)
+                existing_key.shared_by = user.id
+                existing_key.shared_at = now
+            else:
+                db.session.add(GroupSharedKey(
+                    group_id=job.group_id,
+                    user_id=member_id,
+                    encrypted_key=_serialize_key(encrypted_key),
+                    epoch=job.to_epoch,
+                    shared_by=user.id
+                ))
+                created += 1
+            results.append({'user_id': member_id, 'status': 'ok'})
+        
+        job.rewrapped_member_keys = (job.rewrapped_member_keys or 0) + created
+        db.session.commit()
+        
+        return jsonify({'results': results, 'rotation': job.to_dict()}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@groups_bp.route('/key-rotations/<int:job_id>/complete', methods=['POST'])
+@require_auth
+def complete_key_rotation(user, job_id):
+    """完成密钥轮换：确认全部文件和成员已切换到新版本后删除旧版本组密钥"""
+    try:
+        job, error = _load_rotation_job(user, job_id)
+        if error:
+            return error
+        
+        if job.status != 'running':
+            return jsonify({'error': '轮换任务已结束'}), 400
+        
+        pending_files = File.query.filter(
+            File.group_id == job.group_id,
+            File.key_epoch < job.to_epoch
+        ).count()
+        if pending_files:
+            return jsonify({'error': '仍有文件密钥未重新封装', 'pending_files': pending_files}), 409
+        
+        pending_versions = _pending_versions_query(job).count()
+        if pending_versions:
+            return jsonify({'error': '仍有历史版本的文件密钥未重新封装', 'pending_versions': pending_versions}), 409
+        
+        keyed_members = db.session.query(GroupSharedKey.user_id).filter(
+            GroupSharedKey.group_id == job.group_id,
+            GroupSharedKey.epoch == job.to_epoch
+        )
+        pending_members = db.session.query(GroupMember.user_id).filter(
+            GroupMember.group_id == job.group_id,
+            ~GroupMember.user_id.in_(keyed_members)
+        ).count()
+        if pending_members:
+            return jsonify({'error': '仍有成员未分配新版本组密钥', 'pending_members': pending_members}), 409
+        
+        # 新旧版本共存期结束，删除旧版本组密钥
+        GroupSharedKey.query.filter(
+            GroupSharedKey.group_id == job.group_id,
+            GroupSharedKey.epoch < job.to_epoch
+        ).delete(synchronize_session=False)
+        
+        job.status = 'completed'
+        job.completed_at = datetime.now()
+        db.session.commit()
+        
+        return jsonify({'message': '密钥轮换完成', 'rotation': job.to_dict()}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
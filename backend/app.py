@@ -4,6 +4,7 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+import click
 import os
 import json
 from dotenv import load_dotenv
@@ -23,6 +24,61 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlit
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+app.config['MEMBERSHIP_CACHE_TTL'] = 30  # 组成员关系缓存有效期（秒）
+app.config['BACKGROUND_WORKER_ENABLED'] = os.getenv('BACKGROUND_WORKER_ENABLED', 'false').lower() == 'true'  # 由 gunicorn.conf.py 在 gunicorn 工作进程中启动后台维护线程（多进程时只有取得文件锁的一个进程启动）
+app.config['BLOB_PURGE_INTERVAL'] = 30  # 后台清理密文的间隔（秒）
+app.config['BLOB_PURGE_BATCH_SIZE'] = 200  # 每批清理的密文数量
+app.config['TRASH_RETENTION_DAYS'] = 30  # 回收站保留天数
+app.config['TRASH_PURGE_INTERVAL'] = 300  # 清理过期回收站文件的间隔（秒）
+app.config['TRASH_PURGE_BATCH_SIZE'] = 200  # 每批永久删除的文件数
+app.config['PURGE_BATCH_PAUSE'] = 0.5  # 清理批次之间的间隔（秒），用于限速
+app.config['VERSION_SEGMENT_SIZE'] = 1024 * 1024  # 版本分段大小（1MB）
+app.config['MERKLE_LEAF_SIZE'] = 64 * 1024  # 密文Merkle树的叶子大小（版本分段大小须为其整数倍）
+app.config['VERSION_READ_AHEAD'] = 4  # 读取版本时并行预读的分段数（小于2时顺序读取）
+app.config['VERSION_KEEP_LAST'] = 10  # 每个文件默认保留的版本数
+app.config['VERSION_MAX_AGE_DAYS'] = None  # 历史版本默认保留天数，为空表示不按时间清理
+app.config['DELTA_UPLOAD_TTL'] = 3600  # 增量上传会话的有效期（秒）
+app.config['DELTA_UPLOAD_EXPIRE_INTERVAL'] = 300  # 清理过期增量上传会话的间隔（秒）
+app.config['IDEMPOTENCY_TTL'] = 24 * 3600  # Idempotency-Key 结果缓存时间（秒）
+app.config['HOT_CACHE_BYTES'] = 256 * 1024 * 1024  # 热点密文内存缓存容量（字节，0表示关闭）
+app.config['HOT_CACHE_MAX_ITEM_BYTES'] = 32 * 1024 * 1024  # 超过该大小的文件不进入热点缓存
+app.config['UPLOAD_DEDUPE'] = True  # 同一用户上传相同密文时复用已有数据
+app.config['USER_QUOTA_BYTES'] = 10 * 1024 * 1024 * 1024  # 个人空间默认配额（10GB），为空表示不限
+app.config['GROUP_QUOTA_BYTES'] = 50 * 1024 * 1024 * 1024  # 组空间默认配额（50GB），为空表示不限
+app.config['QUOTA_RECONCILE_INTERVAL'] = 6 * 3600  # 重新统计空间用量的间隔（秒）
+app.config['QUOTA_RECONCILE_BATCH_SIZE'] = 200  # 每批重新统计的空间数
+app.config['BLOB_FSYNC'] = True  # 写入密文后fsync，保证rename后的数据已落盘
+app.config['STORAGE_DRIVER'] = os.getenv('STORAGE_DRIVER', 'local')  # 新密文的存储驱动：local / memory / s3 / replica / parity
+app.config['STORAGE_VOLUMES'] = os.getenv('STORAGE_VOLUMES')  # 本地数据卷：名称=路径:权重,…（为空时只使用 UPLOAD_FOLDER）
+app.config['BLOB_REPLICAS'] = 2  # replica 驱动的副本数
+app.config['BLOB_PARITY_SHARDS'] = 4  # parity 驱动的数据分片数（另加1个校验分片）
+app.config['BLOB_STRIPE_UNIT'] = 64 * 1024  # 冗余存储的条带单元大小（每个单元单独校验）
+app.config['PACK_SMALL_BLOBS'] = True  # 小密文追加到打包文件（仅本地驱动）
+app.config['PACK_MAX_BLOB_SIZE'] = 64 * 1024  # 写入打包文件的密文大小上限
+app.config['PACK_FOLDER'] = None  # 打包文件目录，默认为 <UPLOAD_FOLDER>/packs
+app.config['PACK_SIZE'] = 256 * 1024 * 1024  # 单个打包文件写满的大小
+app.config['PACK_COMPACT_THRESHOLD'] = 0.5  # 存活数据比例低于该值的打包文件会被压缩
+app.config['PACK_COMPACT_MIN_AGE'] = 3600  # 只压缩超过该时间（秒）未修改的打包文件
+app.config['PACK_COMPACT_INTERVAL'] = 3600  # 打包文件压缩间隔（秒）
+app.config['SCRUB_INTERVAL'] = 24 * 3600  # 存储巡检间隔（秒），为空表示不在后台运行
+app.config['SCRUB_MAX_RUNTIME'] = 8 * 3600  # 单次巡检的最长时间（秒），未完成的部分下次继续
+app.config['SCRUB_BYTES_PER_SECOND'] = 100 * 1024 * 1024  # 巡检读取速率上限（字节/秒）
+app.config['SCRUB_WORKERS'] = 4  # 巡检并行读取的线程数
+app.config['SCRUB_VERIFY_HASHES'] = True  # 巡检时读取密文核对SHA-256和Merkle叶子哈希（为False时只核对大小）
+app.config['SCRUB_ORPHAN_MIN_AGE'] = 24 * 3600  # 只把修改时间和ctime都超过该秒数的文件视为孤立文件
+app.config['SCRUB_QUARANTINE'] = False  # 把孤立文件移入隔离目录（默认只在巡检结果中报告）
+app.config['SCRUB_QUARANTINE_DAYS'] = 7  # 隔离目录中的孤立文件保留天数
+app.config['DOWNLOAD_TRANSPORT_ENCRYPTION'] = os.getenv('DOWNLOAD_TRANSPORT_ENCRYPTION', 'true').lower() != 'false'  # 下载时是否用会话密钥再加密一层（上游已终止TLS时可关闭）
+app.config['DOWNLOAD_ACCEL_REDIRECT'] = os.getenv('DOWNLOAD_ACCEL_REDIRECT')  # 关闭传输层加密时由nginx发送本地密文的内部路径前缀，如 /_protected
+app.config['SIGNED_URL_TTL'] = 3600  # 预签名下载链接的默认有效期（秒）
+app.config['SIGNED_URL_MAX_TTL'] = 24 * 3600  # 预签名下载链接的最长有效期（秒），签发后无法撤销
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')  # 访问 /api/metrics 的令牌（Authorization: Bearer <令牌>），为空时关闭该接口
+app.config['S3_BUCKET'] = os.getenv('S3_BUCKET')
+app.config['S3_PREFIX'] = os.getenv('S3_PREFIX', '')
+app.config['S3_ENDPOINT_URL'] = os.getenv('S3_ENDPOINT_URL')  # S3兼容服务地址（如MinIO）
+app.config['S3_REGION'] = os.getenv('S3_REGION')
+app.config['S3_ACCESS_KEY'] = os.getenv('S3_ACCESS_KEY')
+app.config['S3_SECRET_KEY'] = os.getenv('S3_SECRET_KEY')
 
 # 验证码内存存储
 # 格式: { '邮箱地址': {'code': '123456', 'time': 1700000000} }
@@ -39,22 +95,30 @@ db.init_app(app)
 CORS(app, 
      supports_credentials=True,
      resources={r"/api/*": {"origins": "*"}},
-     allow_headers=["Content-Type", "Authorization", "X-Session-Token"],
-     expose_headers=["X-Encrypted-File-Key", "X-File-Group-Id"],
+     allow_headers=["Content-Type", "Authorization", "X-Session-Token", "Idempotency-Key", "If-None-Match"],
+     expose_headers=["X-Encrypted-File-Key", "X-File-Group-Id", "X-File-Key-Epoch", "X-File-Version", "X-Archive-Format", "Idempotent-Replayed", "X-Transport-Encryption", "ETag"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 
 # 导入模型（必须在db初始化后）
-from models import User, File, UserGroup, GroupMember, GroupJoinRequest, Session, EmailCode
+from models import User, File, Folder, UserGroup, GroupMember, GroupJoinRequest, GroupKeyRotation, Session, EmailCode
 
 # 导入API路由
 from api.auth import auth_bp
 from api.files import files_bp
 from api.groups import groups_bp
+from api.folders import folders_bp
+from api.delta import delta_bp
 
 # 注册蓝图
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(files_bp, url_prefix='/api/files')
 app.register_blueprint(groups_bp, url_prefix='/api/groups')
+app.register_blueprint(folders_bp, url_prefix='/api/folders')
+app.register_blueprint(delta_bp, url_prefix='/api/files')
+
+# 热点密文缓存容量
+from storage.hotcache import configure_hot_cache
+configure_hot_cache(app.config)
 
 # ==========================================
 #  邮箱验证相关接口
@@ -182,17 +246,260 @@ def index():
 def health():
     return {'status': 'ok'}
 
+@app.route('/api/metrics')
+def metrics():
+    """本进程的缓存统计和最近一次巡检结果（需要 METRICS_TOKEN）"""
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        return jsonify({'error': '监控接口未启用'}), 404
+    scheme, _, provided = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not secrets.compare_digest(provided.strip(), token):
+        return jsonify({'error': '监控令牌无效'}), 401
+    from storage.hotcache import hot_blob_cache
+    from storage import scrubber
+    return {'hot_blob_cache': hot_blob_cache.stats(), 'storage_scrub': scrubber.last_report}
+
+# ==========================================
+#  后台任务
+# ==========================================
+
+# 本进程已启动的后台线程，以及保证只有一个进程运行后台任务的文件锁
+background_worker = None
+_worker_lock = None
+
+def _acquire_worker_lock() -> bool:
+    """
+    获取后台任务的文件锁（实例目录下的 background-worker.lock）
+    
+    同一台机器上的多个进程中只有一个能取得锁，锁在进程退出时自动释放；
+    多台机器共享数据库时锁不能跨机器生效，整个部署只能有一处运行后台任务。
+    不支持 fcntl 的平台（Windows）直接返回True。
+    """
+    global _worker_lock
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    
+    os.makedirs(app.instance_path, exist_ok=True)
+    lock = open(os.path.join(app.instance_path, 'background-worker.lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _worker_lock = lock
+    return True
+
+def start_background_worker():
+    """
+    启动后台维护线程（密文清理、回收站过期、配额统计、打包压缩、存储巡检）
+    
+    同一进程内重复调用直接返回已启动的线程；其他进程已在运行后台任务时返回None。
+    """
+    global background_worker
+    if background_worker is not None:
+        return background_worker
+    if not _acquire_worker_lock():
+        print("后台任务已在其他进程中运行，本进程不启动")
+        return None
+    
+    from utils.worker import PeriodicWorker
+    from storage import BlobPurger, TrashPurger, DeltaUploadPurger
+    from storage.packs import PackCompactor
+    from storage.scrubber import StorageScrubber
+    from utils.quota import QuotaManager
+    
+    worker = PeriodicWorker(app)
+    worker.add_task(
+        'trash-expire',
+        app.config['TRASH_PURGE_INTERVAL'],
+        lambda: TrashPurger.expire_pending(
+            app.config['TRASH_RETENTION_DAYS'],
+            app.config['TRASH_PURGE_BATCH_SIZE'],
+            pause=app.config['PURGE_BATCH_PAUSE']
+        )
+    )
+    worker.add_task(
+        'delta-upload-expire',
+        app.config['DELTA_UPLOAD_EXPIRE_INTERVAL'],
+        DeltaUploadPurger.expire_batch
+    )
+    worker.add_task(
+        'quota-reconcile',
+        app.config['QUOTA_RECONCILE_INTERVAL'],
+        lambda: QuotaManager.reconcile_all(
+            app.config['QUOTA_RECONCILE_BATCH_SIZE'],
+            pause=app.config['PURGE_BATCH_PAUSE']
+        )
+    )
+    worker.add_task(
+        'pack-compact',
+        app.config['PACK_COMPACT_INTERVAL'],
+        lambda: PackCompactor(
+            app.config['PACK_COMPACT_THRESHOLD'],
+            app.config['PACK_COMPACT_MIN_AGE']
+        ).run()
+    )
+    worker.add_task(
+        'blob-purge',
+        app.config['BLOB_PURGE_INTERVAL'],
+        lambda: BlobPurger.purge_pending(
+            app.config['BLOB_PURGE_BATCH_SIZE'],
+            pause=app.config['PURGE_BATCH_PAUSE']
+        )
+    )
+    worker.start()
+    
+    # 巡检单次运行时间较长，使用单独的线程，不阻塞上面的清理任务
+    if app.config['SCRUB_INTERVAL']:
+        scrub_worker = PeriodicWorker(app, name='securedisk-scrub')
+        scrub_worker.add_task(
+            'storage-scrub',
+            app.config['SCRUB_INTERVAL'],
+            lambda: StorageScrubber(
+                app.config['SCRUB_WORKERS'],
+                app.config['SCRUB_BYTES_PER_SECOND'],
+                app.config['SCRUB_MAX_RUNTIME'],
+                app.config['SCRUB_VERIFY_HASHES'],
+                quarantine=app.config['SCRUB_QUARANTINE'],
+                orphan_min_age=app.config['SCRUB_ORPHAN_MIN_AGE'],
+                quarantine_days=app.config['SCRUB_QUARANTINE_DAYS']
+            ).run()
+        )
+        scrub_worker.start()
+    
+    background_worker = worker
+    return worker
+
+# 导入本模块时不启动后台线程：gunicorn --preload 在主进程中导入应用，在此启动的线程不会随 fork 进入工作进程。
+# 后台任务由以下入口之一显式启动：flask run-worker、gunicorn.conf.py 的 post_worker_init 钩子
+# （BACKGROUND_WORKER_ENABLED 开启时）或下面的开发服务器启动代码。
+
+# ==========================================
+#  命令行工具
+# ==========================================
+
+@app.cli.command('upgrade-db')
+@click.option('--no-reconcile', is_flag=True, help='不重新统计各空间的已用字节')
+def upgrade_db(no_reconcile):
+    """升级已有数据库：补建新增的表、列和索引（可重复执行），并重新统计空间用量"""
+    from utils.schema import upgrade_schema
+    from utils.quota import QuotaManager
+    from storage import VersionStore
+    
+    changes = upgrade_schema()
+    for change in changes:
+        print(change)
+    print(f"完成 {len(changes)} 项变更" if changes else "数据库结构已是最新")
+    cleared = VersionStore.clear_stale_paths()
+    db.session.commit()
+    if cleared:
+        print(f"已清空 {cleared} 个版本化文件遗留的存储路径")
+    if not no_reconcile:
+        print(f"已重新统计空间用量（{QuotaManager.reconcile_all()} 批）")
+
+@app.cli.command('run-worker')
+def run_worker():
+    """单独运行后台维护任务（WSGI服务器部署时推荐，服务进程无需开启 BACKGROUND_WORKER_ENABLED）"""
+    worker = start_background_worker()
+    if worker is None:
+        raise SystemExit(1)
+    print("后台任务已启动，按 Ctrl+C 退出")
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
+
+@app.cli.command('migrate-blob-layout')
+@click.option('--batch-size', default=200, help='每批迁移的密文数量')
+@click.option('--pause', default=0.5, help='批与批之间的间隔（秒）')
+@click.option('--grace', default=5.0, help='旧位置保留时间（秒）')
+@click.option('--driver', default=None, help='目标存储驱动（local / s3 / replica / parity），默认为 STORAGE_DRIVER')
+@click.option('--older-than', default=None, type=int, help='只迁移早于该天数写入的密文')
+def migrate_blob_layout(batch_size, pause, grace, driver, older_than):
+    """把旧密文迁移到分目录布局或另一个存储驱动（可在服务运行时执行）"""
+    from storage.layout import LayoutMigrator
+    
+    result = LayoutMigrator(batch_size, pause, grace, driver, older_than).run()
+    print(f"补建密文记录 {result['registered']} 个，迁移密文 {result['migrated']} 个")
+
+@app.cli.command('rebalance-volumes')
+@click.option('--batch-size', default=200, help='每批检查的密文数量')
+@click.option('--pause', default=0.5, help='批与批之间的间隔（秒）')
+@click.option('--grace', default=5.0, help='旧位置保留时间（秒）')
+@click.option('--max-moves', default=None, type=int, help='本次最多移动的密文数量')
+def rebalance_volumes(batch_size, pause, grace, max_moves):
+    """增加数据卷后，把一致性哈希指向其他卷的密文移过去（可在服务运行时执行）"""
+    from storage.layout import VolumeRebalancer
+    
+    result = VolumeRebalancer(batch_size, pause, grace, max_moves).run()
+    print(f"移动密文 {result['migrated']} 个")
+
+@app.cli.command('compact-packs')
+@click.option('--threshold', default=None, type=float, help='存活数据比例低于该值时压缩，默认为 PACK_COMPACT_THRESHOLD')
+@click.option('--grace', default=5.0, help='旧打包文件保留时间（秒）')
+def compact_packs(threshold, grace):
+    """重写存活数据比例过低的打包文件，回收已删除小密文占用的空间"""
+    from storage.packs import PackCompactor
+    
+    if threshold is None:
+        threshold = app.config['PACK_COMPACT_THRESHOLD']
+    result = PackCompactor(threshold, app.config['PACK_COMPACT_MIN_AGE'], grace).run()
+    print(f"压缩打包文件 {result['compacted']} 个，回收 {result['reclaimed_bytes']} 字节")
+
+@app.cli.command('scrub-storage')
+@click.option('--workers', default=None, type=int, help='并行读取的线程数，默认为 SCRUB_WORKERS')
+@click.option('--rate', default=None, type=int, help='读取速率上限（字节/秒），默认为 SCRUB_BYTES_PER_SECOND，0表示不限')
+@click.option('--max-runtime', default=None, type=float, help='最长运行时间（秒），默认为 SCRUB_MAX_RUNTIME')
+@click.option('--size-only', is_flag=True, help='只核对大小，不读取密文')
+@click.option('--quarantine/--report-only', default=None, help='是否把孤立文件移入隔离目录，默认为 SCRUB_QUARANTINE')
+def scrub_storage(workers, rate, max_runtime, size_only, quarantine):
+    """核对密文的大小和哈希，报告（或隔离）数据卷中没有记录引用的文件（可在服务运行时执行）"""
+    from storage.scrubber import StorageScrubber
+    
+    result = StorageScrubber(
+        workers or app.config['SCRUB_WORKERS'],
+        app.config['SCRUB_BYTES_PER_SECOND'] if rate is None else rate,
+        app.config['SCRUB_MAX_RUNTIME'] if max_runtime is None else max_runtime,
+        not size_only,
+        app.config['SCRUB_QUARANTINE'] if quarantine is None else quarantine,
+        app.config['SCRUB_ORPHAN_MIN_AGE'],
+        app.config['SCRUB_QUARANTINE_DAYS']
+    ).run()
+    print(f"核对密文 {result['checked']} 个（{result['bytes']} 字节），"
+          f"{'已完成一轮' if result['completed'] else '达到时间上限，下次继续'}")
+    for key, label in (('missing', '缺失'), ('size', '大小不符'), ('corrupt', '已损坏'),
+                       ('degraded', '冗余分片损坏'), ('unreadable', '无法读取'), ('missing_files', '旧文件缺失')):
+        if result[key]:
+            print(f"{label}: {result[key]}")
+    print(f"遍历文件 {result['walked']} 个，孤立文件 {result['orphans']} 个（已隔离 {result['quarantined']} 个），"
+          f"删除过期隔离目录 {result['quarantine_purged']} 个")
+    for path in result['orphan_paths']:
+        print(f"孤立文件: {path}")
+    for error in result['errors']:
+        print(error)
+
 # ==========================================
 #  启动代码
 # ==========================================
 if __name__ == '__main__':
     with app.app_context():
         try:
-            db.create_all()
+            # 新建数据库时创建全部表，已有数据库补建新增的列和索引
+            from utils.schema import upgrade_schema
+            for change in upgrade_schema():
+                print(change)
             print("数据库初始化完成")
         except Exception as e:
             print(f"数据库初始化警告: {e}")
             
         print("服务器启动在 http://0.0.0.0:5000")
+    
+    # debug模式下重载器会启动两个进程，只在实际提供服务的子进程中启动后台线程
+    # （该进程持有文件锁期间，另外运行的 flask run-worker 不会重复启动）
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_worker()
         
     app.run(host='0.0.0.0', port=5000, debug=True)
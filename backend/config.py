@@ -14,6 +14,61 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB
+    MEMBERSHIP_CACHE_TTL = 30  # 组成员关系缓存有效期（秒）
+    BACKGROUND_WORKER_ENABLED = os.getenv('BACKGROUND_WORKER_ENABLED', 'false').lower() == 'true'  # 由 gunicorn.conf.py 在 gunicorn 工作进程中启动后台维护线程（多进程时只有取得文件锁的一个进程启动）
+    BLOB_PURGE_INTERVAL = 30  # 后台清理密文的间隔（秒）
+    BLOB_PURGE_BATCH_SIZE = 200  # 每批清理的密文数量
+    TRASH_RETENTION_DAYS = 30  # 回收站保留天数
+    TRASH_PURGE_INTERVAL = 300  # 清理过期回收站文件的间隔（秒）
+    TRASH_PURGE_BATCH_SIZE = 200  # 每批永久删除的文件数
+    PURGE_BATCH_PAUSE = 0.5  # 清理批次之间的间隔（秒），用于限速
+    VERSION_SEGMENT_SIZE = 1024 * 1024  # 版本分段大小（1MB）
+    MERKLE_LEAF_SIZE = 64 * 1024  # 密文Merkle树的叶子大小（版本分段大小须为其整数倍）
+    VERSION_READ_AHEAD = 4  # 读取版本时并行预读的分段数（小于2时顺序读取）
+    VERSION_KEEP_LAST = 10  # 每个文件默认保留的版本数
+    VERSION_MAX_AGE_DAYS = None  # 历史版本默认保留天数，为空表示不按时间清理
+    DELTA_UPLOAD_TTL = 3600  # 增量上传会话的有效期（秒）
+    DELTA_UPLOAD_EXPIRE_INTERVAL = 300  # 清理过期增量上传会话的间隔（秒）
+    IDEMPOTENCY_TTL = 24 * 3600  # Idempotency-Key 结果缓存时间（秒）
+    HOT_CACHE_BYTES = 256 * 1024 * 1024  # 热点密文内存缓存容量（字节，0表示关闭）
+    HOT_CACHE_MAX_ITEM_BYTES = 32 * 1024 * 1024  # 超过该大小的文件不进入热点缓存
+    UPLOAD_DEDUPE = True  # 同一用户上传相同密文时复用已有数据
+    USER_QUOTA_BYTES = 10 * 1024 * 1024 * 1024  # 个人空间默认配额（10GB），为空表示不限
+    GROUP_QUOTA_BYTES = 50 * 1024 * 1024 * 1024  # 组空间默认配额（50GB），为空表示不限
+    QUOTA_RECONCILE_INTERVAL = 6 * 3600  # 重新统计空间用量的间隔（秒）
+    QUOTA_RECONCILE_BATCH_SIZE = 200  # 每批重新统计的空间数
+    BLOB_FSYNC = True  # 写入密文后fsync，保证rename后的数据已落盘
+    STORAGE_DRIVER = os.getenv('STORAGE_DRIVER', 'local')  # 新密文的存储驱动：local / memory / s3 / replica / parity
+    STORAGE_VOLUMES = os.getenv('STORAGE_VOLUMES')  # 本地数据卷：名称=路径:权重,…（为空时只使用 UPLOAD_FOLDER）
+    BLOB_REPLICAS = 2  # replica 驱动的副本数
+    BLOB_PARITY_SHARDS = 4  # parity 驱动的数据分片数（另加1个校验分片）
+    BLOB_STRIPE_UNIT = 64 * 1024  # 冗余存储的条带单元大小（每个单元单独校验）
+    PACK_SMALL_BLOBS = True  # 小密文追加到打包文件（仅本地驱动）
+    PACK_MAX_BLOB_SIZE = 64 * 1024  # 写入打包文件的密文大小上限
+    PACK_FOLDER = None  # 打包文件目录，默认为 <UPLOAD_FOLDER>/packs
+    PACK_SIZE = 256 * 1024 * 1024  # 单个打包文件写满的大小
+    PACK_COMPACT_THRESHOLD = 0.5  # 存活数据比例低于该值的打包文件会被压缩
+    PACK_COMPACT_MIN_AGE = 3600  # 只压缩超过该时间（秒）未修改的打包文件
+    PACK_COMPACT_INTERVAL = 3600  # 打包文件压缩间隔（秒）
+    SCRUB_INTERVAL = 24 * 3600  # 存储巡检间隔（秒），为空表示不在后台运行
+    SCRUB_MAX_RUNTIME = 8 * 3600  # 单次巡检的最长时间（秒），未完成的部分下次继续
+    SCRUB_BYTES_PER_SECOND = 100 * 1024 * 1024  # 巡检读取速率上限（字节/秒）
+    SCRUB_WORKERS = 4  # 巡检并行读取的线程数
+    SCRUB_VERIFY_HASHES = True  # 巡检时读取密文核对SHA-256和Merkle叶子哈希（为False时只核对大小）
+    SCRUB_ORPHAN_MIN_AGE = 24 * 3600  # 只把修改时间和ctime都超过该秒数的文件视为孤立文件
+    SCRUB_QUARANTINE = False  # 把孤立文件移入隔离目录（默认只在巡检结果中报告）
+    SCRUB_QUARANTINE_DAYS = 7  # 隔离目录中的孤立文件保留天数
+    DOWNLOAD_TRANSPORT_ENCRYPTION = os.getenv('DOWNLOAD_TRANSPORT_ENCRYPTION', 'true').lower() != 'false'  # 下载时是否用会话密钥再加密一层（上游已终止TLS时可关闭）
+    DOWNLOAD_ACCEL_REDIRECT = os.getenv('DOWNLOAD_ACCEL_REDIRECT')  # 关闭传输层加密时由nginx发送本地密文的内部路径前缀，如 /_protected
+    SIGNED_URL_TTL = 3600  # 预签名下载链接的默认有效期（秒）
+    SIGNED_URL_MAX_TTL = 24 * 3600  # 预签名下载链接的最长有效期（秒），签发后无法撤销
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # 访问 /api/metrics 的令牌（Authorization: Bearer <令牌>），为空时关闭该接口
+    S3_BUCKET = os.getenv('S3_BUCKET')
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # S3兼容服务地址（如MinIO）
+    S3_REGION = os.getenv('S3_REGION')
+    S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY')
+    S3_SECRET_KEY = os.getenv('S3_SECRET_KEY')
     
     # QQ邮箱SMTP配置
     SMTP_SERVER = os.environ.get('SMTP_SERVER', 'smtp.qq.com')
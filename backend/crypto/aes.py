@@ -63,17 +63,19 @@ class AESEncryption:
         }
     
     @staticmethod
-    def encrypt_raw(data: bytes, key: bytes) -> bytes:
+    def encrypt_raw(data: bytes, key: bytes, associated_data: bytes = None) -> bytes:
         """
         加密数据（返回原始字节：IV + Ciphertext）
+
+        associated_data 为可选的附加认证数据（如分帧序号），不加密但参与完整性校验
         """
         aesgcm = AESGCM(key)
         nonce = os.urandom(12)
-        ciphertext = aesgcm.encrypt(nonce, data, None)
+        ciphertext = aesgcm.encrypt(nonce, data, associated_data)
         return nonce + ciphertext
 
     @staticmethod
-    def decrypt_raw(data: bytes, key: bytes) -> bytes:
+    def decrypt_raw(data: bytes, key: bytes, associated_data: bytes = None) -> bytes:
         """
         解密数据（输入原始字节：IV + Ciphertext）
         """
@@ -82,7 +84,7 @@ class AESEncryption:
         nonce = data[:12]
         ciphertext = data[12:]
         aesgcm = AESGCM(key)
-        return aesgcm.decrypt(nonce, ciphertext, None)
+        return aesgcm.decrypt(nonce, ciphertext, associated_data)
 
     @staticmethod
     def decrypt(encrypted_data: dict, key: bytes) -> bytes:
@@ -0,0 +1,20 @@
+"""
+gunicorn 配置
+在 backend 目录下执行 gunicorn 时自动加载
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+
+
+def post_worker_init(worker):
+    """
+    工作进程 fork 完成后启动后台维护线程（需开启 BACKGROUND_WORKER_ENABLED）
+
+    在 fork 之后启动，使用 --preload 时线程也运行在工作进程中；
+    各工作进程通过实例目录下的文件锁选出一个运行，其余进程不启动。
+    """
+    from app import app, start_background_worker
+    if app.config['BACKGROUND_WORKER_ENABLED']:
+        start_background_worker()
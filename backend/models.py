@@ -21,9 +21,12 @@ class User(db.Model):
     recovery_package = db.Column(db.Text, nullable=True)  # 密钥恢复包
     created_at = db.Column(db.DateTime, default=datetime.now)
     last_login = db.Column(db.DateTime, nullable=True)
+    quota_bytes = db.Column(db.BigInteger, nullable=True)  # 个人空间配额，为空时使用全局配置
+    used_bytes = db.Column(db.BigInteger, nullable=False, default=0)  # 个人空间已用字节（物化计数，含回收站）
     
     # 关系
-    files = db.relationship('File', backref='owner', lazy=True, cascade='all, delete-orphan')
+    files = db.relationship('File', backref='owner', lazy=True, cascade='all, delete-orphan',
+                            foreign_keys='File.owner_id')
     groups = db.relationship('GroupMember', backref='user', lazy=True, cascade='all, delete-orphan')
     sessions = db.relationship('Session', backref='user', lazy=True, cascade='all, delete-orphan')
     
@@ -46,6 +49,9 @@ class UserGroup(db.Model):
     description = db.Column(db.Text, nullable=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    key_epoch = db.Column(db.Integer, nullable=False, default=1)  # 当前组密钥版本（轮换后递增）
+    quota_bytes = db.Column(db.BigInteger, nullable=True)  # 组空间配额，为空时使用全局配置
+    used_bytes = db.Column(db.BigInteger, nullable=False, default=0)  # 组空间已用字节（物化计数，含回收站）
     
     # 关系
     members = db.relationship('GroupMember', backref='group', lazy=True, cascade='all, delete-orphan')
@@ -57,7 +63,8 @@ class UserGroup(db.Model):
             'name': self.name,
             'description': self.description,
             'created_by': self.created_by,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'key_epoch': self.key_epoch
         }
 
 class GroupMember(db.Model):
@@ -112,18 +119,113 @@ class GroupSharedKey(db.Model):
     group_id = db.Column(db.Integer, db.ForeignKey('user_groups.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)  # 密钥对应的用户
     encrypted_key = db.Column(db.Text, nullable=False)  # 使用接收用户的公钥加密的密钥
+    epoch = db.Column(db.Integer, nullable=False, default=1)  # 组密钥版本
     shared_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     shared_at = db.Column(db.DateTime, default=datetime.now)
     
+    __table_args__ = (db.Index('ix_group_shared_keys_group_user_epoch', 'group_id', 'user_id', 'epoch'),)
+    
     def to_dict(self):
         return {
             'id': self.id,
             'group_id': self.group_id,
             'user_id': self.user_id,
+            'epoch': self.epoch,
             'shared_by': self.shared_by,
             'shared_at': self.shared_at.isoformat() if self.shared_at else None
         }
 
+class GroupKeyRotation(db.Model):
+    """组密钥轮换任务（可断点续传的批量重新封装）"""
+    __tablename__ = 'group_key_rotations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('user_groups.id'), nullable=False, index=True)
+    from_epoch = db.Column(db.Integer, nullable=False)
+    to_epoch = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='running')  # running, completed, superseded
+    reason = db.Column(db.String(50), nullable=True)  # member_removed, manual
+    removed_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    total_files = db.Column(db.Integer, default=0)  # 任务开始时需要重新封装的文件数
+    rewrapped_files = db.Column(db.Integer, default=0)
+    rewrapped_member_keys = db.Column(db.Integer, default=0)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'from_epoch': self.from_epoch,
+            'to_epoch': self.to_epoch,
+            'status': self.status,
+            'reason': self.reason,
+            'removed_user_id': self.removed_user_id,
+            'total_files': self.total_files,
+            'rewrapped_files': self.rewrapped_files,
+            'rewrapped_member_keys': self.rewrapped_member_keys,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class Folder(db.Model):
+    """文件夹模型（物化路径）"""
+    __tablename__ = 'folders'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    parent_id = db.Column(db.Integer, db.ForeignKey('folders.id'), nullable=True, index=True)
+    # 祖先及自身ID组成的路径，如 /1/5/9/，子树查询使用前缀范围扫描
+    path = db.Column(db.String(1000), nullable=False, default='/', index=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    group_id = db.Column(db.Integer, db.ForeignKey('user_groups.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (db.Index('ix_folders_space_parent', 'group_id', 'owner_id', 'parent_id'),)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'parent_id': self.parent_id,
+            'path': self.path,
+            'owner_id': self.owner_id,
+            'group_id': self.group_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class Blob(db.Model):
+    """存储的密文数据（同一份密文可被多个文件记录引用）"""
+    __tablename__ = 'blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    storage_path = db.Column(db.String(500), unique=True, nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)  # 引用该数据的文件记录数
+    orphaned_at = db.Column(db.DateTime, nullable=True, index=True)  # 引用归零时间，非空表示等待后台清理（迁移留下的旧位置为宽限期结束时间，到期前不清理）
+    digest = db.Column(db.String(64), nullable=True, index=True)  # 密文SHA-256（版本分段按此去重）
+    volume = db.Column(db.String(64), nullable=True, index=True)  # 所在数据卷（本地驱动），文件的放置情况即其各分段的卷
+    merkle_root = db.Column(db.String(64), nullable=True)  # 密文Merkle树的根哈希（上传时计算）
+    merkle_leaf_size = db.Column(db.Integer, nullable=True)  # Merkle树的叶子大小
+    merkle_leaves = db.deferred(db.Column(db.LargeBinary, nullable=True))  # 各叶子哈希（32字节 × 叶子数），按需加载
+    verified_at = db.Column(db.DateTime, nullable=True, index=True)  # 最近一次巡检时间
+    scrub_error = db.Column(db.String(32), nullable=True)  # 最近一次巡检发现的问题（missing / size / corrupt / degraded / unreadable）
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'size': self.size,
+            'ref_count': self.ref_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class File(db.Model):
     """文件模型"""
     __tablename__ = 'files'
@@ -133,12 +235,48 @@ class File(db.Model):
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True)  # 当前内容的密文哈希（强ETag），为空表示未知
     encrypted_file_key = db.Column(db.Text, nullable=False)  # 加密的文件密钥
+    key_epoch = db.Column(db.Integer, nullable=False, default=1)  # 封装文件密钥所用的组密钥版本
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     group_id = db.Column(db.Integer, db.ForeignKey('user_groups.id'), nullable=True)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blobs.id'), nullable=True, index=True)  # 共享的密文数据
+    folder_id = db.Column(db.Integer, db.ForeignKey('folders.id'), nullable=True, index=True)  # 所在文件夹，为空表示根目录
     mime_type = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # 移入回收站的时间，为空表示正常文件
+    deleted_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    # 版本化文件的内容由当前版本的分段组成，此时 blob_id 为空
+    current_version_id = db.Column(
+        db.Integer,
+        db.ForeignKey('file_versions.id', use_alter=True, name='fk_files_current_version'),
+        nullable=True
+    )
+    version = db.Column(db.Integer, nullable=False, default=1)  # 当前版本号
+    version_keep_last = db.Column(db.Integer, nullable=True)  # 保留的版本数，为空时使用全局配置
+    version_max_age_days = db.Column(db.Integer, nullable=True)  # 历史版本保留天数，为空时使用全局配置
+    
+    blob = db.relationship('Blob', lazy=True)
+    
+    __table_args__ = (
+        db.Index('ix_files_group_epoch', 'group_id', 'key_epoch', 'id'),
+        # 部分索引：正常列表只扫描未删除的文件，回收站清理只扫描已删除的文件
+        db.Index('ix_files_live_owner', 'owner_id', 'created_at',
+                 sqlite_where=db.text('deleted_at IS NULL'),
+                 postgresql_where=db.text('deleted_at IS NULL')),
+        db.Index('ix_files_live_group', 'group_id', 'created_at',
+                 sqlite_where=db.text('deleted_at IS NULL'),
+                 postgresql_where=db.text('deleted_at IS NULL')),
+        db.Index('ix_files_trash', 'deleted_at',
+                 sqlite_where=db.text('deleted_at IS NOT NULL'),
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+    
+    @property
+    def etag(self):
+        """下载响应的强ETag（带引号），内容哈希未知时为None"""
+        return f'"{self.content_hash}"' if self.content_hash else None
     
     def to_dict(self):
         return {
@@ -148,11 +286,100 @@ class File(db.Model):
             'file_size': self.file_size,
             'owner_id': self.owner_id,
             'group_id': self.group_id,
+            'key_epoch': self.key_epoch,
+            'folder_id': self.folder_id,
+            'version': self.version,
+            'etag': self.etag,
             'mime_type': self.mime_type,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'deleted_at': self.deleted_at.isoformat() if self.deleted_at else None
+        }
+
+class FileVersion(db.Model):
+    """文件版本（内容为按顺序引用的密文分段，未改动的分段在版本之间共享）"""
+    __tablename__ = 'file_versions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True)  # 该版本内容的密文哈希（强ETag）
+    segments = db.Column(db.Text, nullable=False)  # 按顺序排列的分段密文ID（JSON数组）
+    encrypted_file_key = db.Column(db.Text, nullable=False)  # 该版本的加密文件密钥
+    key_epoch = db.Column(db.Integer, nullable=False, default=1)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        db.UniqueConstraint('file_id', 'version', name='uq_file_versions_file_version'),
+    )
+    
+    def segment_ids(self):
+        return json.loads(self.segments or '[]')
+    
+    @property
+    def etag(self):
+        """下载响应的强ETag（带引号），内容哈希未知时为None"""
+        return f'"{self.content_hash}"' if self.content_hash else None
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'file_id': self.file_id,
+            'version': self.version,
+            'size': self.size,
+            'segment_count': len(self.segment_ids()),
+            'etag': self.etag,
+            'key_epoch': self.key_epoch,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class DeltaUpload(db.Model):
+    """增量上传会话（客户端只上传服务器缺少的分段，提交时生成新版本）"""
+    __tablename__ = 'delta_uploads'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    base_version = db.Column(db.Integer, nullable=False)  # 会话开始时文件的当前版本号
+    manifest = db.Column(db.Text, nullable=False)  # 按顺序排列的分段 [{digest, size}]（JSON）
+    encrypted_file_key = db.Column(db.Text, nullable=False)
+    key_epoch = db.Column(db.Integer, nullable=False, default=1)
+    status = db.Column(db.String(20), default='open')  # open, committed, aborted, expired
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    parts = db.relationship('DeltaUploadPart', backref='upload', lazy='dynamic')
+    
+    def segments(self):
+        return json.loads(self.manifest or '[]')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'file_id': self.file_id,
+            'base_version': self.base_version,
+            'segment_count': len(self.segments()),
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class DeltaUploadPart(db.Model):
+    """增量上传会话中已上传的分段（会话持有分段密文的一个引用，直到提交或过期）"""
+    __tablename__ = 'delta_upload_parts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.Integer, db.ForeignKey('delta_uploads.id'), nullable=False)
+    digest = db.Column(db.String(64), nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blobs.id'), nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('upload_id', 'digest', name='uq_delta_upload_parts_digest'),
+    )
+
 class Session(db.Model):
     """会话模型"""
     __tablename__ = 'sessions'
@@ -162,8 +389,8 @@ class Session(db.Model):
     session_token = db.Column(db.String(255), unique=True, nullable=False, index=True)
     encrypted_session_key = db.Column(db.Text, nullable=False)  # RSA加密的会话密钥
     created_at = db.Column(db.DateTime, default=datetime.now)
-    expires_at = db.Column(db.DateTime, nullable=False)
-    last_activity = db.Column(db.DateTime, default=datetime.now)
+    expires_at = db.Column(db.DateTime, nullable=False)  # UTC
+    last_activity = db.Column(db.DateTime, default=datetime.utcnow)  # UTC，与 expires_at 一致
     
     def to_dict(self):
         return {
@@ -0,0 +1,9 @@
+"""
+存储模块
+"""
+from .blobs import BlobStore
+from .versions import VersionStore
+from .purger import BlobPurger, TrashPurger, DeltaUploadPurger
+from .redundancy import ShardCorrupted
+
+__all__ = ['BlobStore', 'VersionStore', 'BlobPurger', 'TrashPurger', 'DeltaUploadPurger', 'ShardCorrupted']
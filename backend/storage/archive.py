@@ -0,0 +1,81 @@
+"""
+多文件归档流
+把多个文件的密文及其加密文件密钥按帧输出，每帧使用会话密钥单独加密
+
+帧格式: 4字节大端长度 + AES-GCM(IV + 密文)，附加认证数据为8字节帧序号，
+防止帧被重排、重放或截断。解密后的帧首字节为类型：
+    H  条目头，JSON: id / name / path / size / encrypted_file_key / key_epoch / group_id
+    D  当前条目的一段密文数据
+    E  当前条目结束
+    X  条目读取失败，JSON: id / error
+    Z  归档结束，JSON: count / failed / missing
+"""
+from crypto.aes import AESEncryption
+import json
+import struct
+
+ARCHIVE_FORMAT = 'securedisk-archive-v1'
+ARCHIVE_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+FRAME_HEADER = b'H'
+FRAME_DATA = b'D'
+FRAME_END = b'E'
+FRAME_ERROR = b'X'
+FRAME_FINISH = b'Z'
+
+
+class ArchiveStream:
+    """按帧生成加密归档流，内存占用与单个数据块大小相当"""
+
+    def __init__(self, session_key: bytes, chunk_size: int = ARCHIVE_CHUNK_SIZE):
+        self.session_key = session_key
+        self.chunk_size = chunk_size
+        self._seq = 0
+
+    def _frame(self, frame_type: bytes, payload: bytes) -> bytes:
+        sealed = AESEncryption.encrypt_raw(
+            frame_type + payload,
+            self.session_key,
+            struct.pack('>Q', self._seq)
+        )
+        self._seq += 1
+        return struct.pack('>I', len(sealed)) + sealed
+
+    def _json_frame(self, frame_type: bytes, data: dict) -> bytes:
+        return self._frame(frame_type, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    def generate(self, entries, open_entry, missing=None):
+        """
+        生成归档帧
+
+        Args:
+            entries: 条目头字典的可迭代对象，每项至少包含 id
+            open_entry: open_entry(entry) 返回该条目密文数据块的迭代器
+            missing: 请求了但不存在或无权访问的文件ID，写入结束帧
+        """
+        count = 0
+        failed = []
+        for entry in entries:
+            try:
+                chunks = open_entry(entry)
+                first = next(chunks, b'')
+            except (OSError, KeyError):
+                # 不把存储路径等内部信息暴露给客户端
+                failed.append(entry['id'])
+                yield self._json_frame(FRAME_ERROR, {'id': entry['id'], 'error': '文件数据不存在或无法读取'})
+                continue
+
+            yield self._json_frame(FRAME_HEADER, entry)
+            if first:
+                yield self._frame(FRAME_DATA, first)
+            for chunk in chunks:
+                yield self._frame(FRAME_DATA, chunk)
+            yield self._frame(FRAME_END, b'')
+            count += 1
+
+        yield self._json_frame(FRAME_FINISH, {
+            'count': count,
+            'failed': failed,
+            'missing': missing or []
+        })
+
@@ -0,0 +1,264 @@
+"""
+密文数据引用计数管理
+复制、移动文件时只增加引用，不复制磁盘上的密文；
+引用归零的密文只做标记，由后台清理任务（storage/purger.py）分批删除
+
+密文的读写通过存储驱动完成（storage/drivers.py），Blob.storage_path 为驱动的位置。
+本地布局: <UPLOAD_FOLDER>/ab/cd/abcd….blob，文件名为随机ID，与用户、文件名和内容无关；
+两级目录把条目分散到65536个目录中，避免单个目录条目过多
+"""
+from models import Blob, File, db
+from storage.drivers import BLOB_SUFFIX, LocalDriver, get_driver, driver_for
+from storage.packs import should_pack
+from storage.hotcache import hot_blob_cache, content_key
+from storage.manifest import MerkleBuilder
+from sqlalchemy import func
+from datetime import datetime, timedelta
+import os
+
+# 按块读取密文时的默认块大小
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """密文数据引用计数"""
+
+    @staticmethod
+    def create(storage_path: str, size: int, digest: str = None, manifest: MerkleBuilder = None) -> Blob:
+        """
+        为新写入的密文创建记录（引用计数为1，不提交事务）
+
+        Args:
+            manifest: 写入时计算的SHA-256和Merkle树，提供时同时作为 digest
+        """
+        blob = Blob(storage_path=storage_path, size=size, ref_count=1, digest=digest,
+                    volume=BlobStore.volume_of(storage_path))
+        if manifest:
+            blob.digest = manifest.hexdigest()
+            blob.merkle_root = manifest.root()
+            blob.merkle_leaf_size = manifest.leaf_size
+            blob.merkle_leaves = manifest.leaves
+        db.session.add(blob)
+        return blob
+
+    @staticmethod
+    def ensure(file_record: File) -> Blob:
+        """
+        获取文件对应的密文记录
+
+        旧版本上传的文件没有 blob_id，首次需要时按 file_path 补建记录。
+        """
+        if file_record.blob_id:
+            return file_record.blob
+
+        blob = Blob.query.filter_by(storage_path=file_record.file_path).first()
+        if not blob:
+            blob = Blob(storage_path=file_record.file_path, size=file_record.file_size, ref_count=0,
+                        volume=BlobStore.volume_of(file_record.file_path))
+            db.session.add(blob)
+            db.session.flush()
+        # 补建时登记本文件这一引用
+        Blob.query.filter_by(id=blob.id).update(
+            {Blob.ref_count: Blob.ref_count + 1, Blob.orphaned_at: None}, synchronize_session=False
+        )
+        file_record.blob_id = blob.id
+        return blob
+
+    @staticmethod
+    def acquire_duplicate(owner_id: int, digest: str):
+        """
+        查找同一用户已有的相同密文并增加引用（不提交事务）
+
+        只在同一所有者的文件之间去重，不同用户的文件互不关联。
+
+        Returns:
+            Blob: 可复用的密文，没有时返回None
+        """
+        row = db.session.query(Blob.id).join(File, File.blob_id == Blob.id).filter(
+            File.owner_id == owner_id,
+            Blob.digest == digest,
+            Blob.orphaned_at.is_(None)
+        ).first()
+        if not row:
+            return None
+
+        # 条件更新：查询之后密文引用已归零（等待清理）时不再复用
+        acquired = Blob.query.filter(
+            Blob.id == row.id,
+            Blob.orphaned_at.is_(None),
+            Blob.ref_count > 0
+        ).update({Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False)
+        return db.session.get(Blob, row.id) if acquired else None
+
+    @staticmethod
+    def acquire(file_record: File) -> Blob:
+        """为新文件记录增加对源文件密文的引用（不提交事务）"""
+        blob = BlobStore.ensure(file_record)
+        Blob.query.filter_by(id=blob.id).update(
+            {Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False
+        )
+        return blob
+
+    @staticmethod
+    def release(file_record: File) -> bool:
+        """
+        释放文件记录对密文的引用（不提交事务）
+
+        Returns:
+            bool: 引用是否归零（归零的密文已标记，等待后台清理）
+        """
+        blob = BlobStore.ensure(file_record)
+        Blob.query.filter_by(id=blob.id).update(
+            {Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False
+        )
+        orphaned = Blob.query.filter(Blob.id == blob.id, Blob.ref_count <= 0).update(
+            {Blob.orphaned_at: datetime.now()}, synchronize_session=False
+        )
+        return orphaned > 0
+
+    @staticmethod
+    def release_files(file_ids) -> int:
+        """
+        批量释放一组文件记录对密文的引用（集合操作，不提交事务）
+
+        Args:
+            file_ids: File.id 的子查询（select），调用方随后自行删除这些文件记录
+
+        Returns:
+            int: 引用归零、等待后台清理的密文数量
+        """
+        now = datetime.now()
+
+        # 没有 blob_id 的旧文件独占自己的密文，直接登记为待清理
+        # （版本化文件的分段由 VersionStore.release_files 释放）
+        legacy = db.session.query(File.file_path, File.file_size).filter(
+            File.id.in_(file_ids),
+            File.blob_id.is_(None),
+            File.current_version_id.is_(None),
+            ~File.file_path.in_(db.session.query(Blob.storage_path))
+        ).all()
+        db.session.add_all([
+            Blob(storage_path=path, size=size, ref_count=0, orphaned_at=now)
+            for path, size in legacy
+        ])
+
+        released = db.session.query(func.count(File.id)).filter(
+            File.blob_id == Blob.id,
+            File.id.in_(file_ids)
+        ).scalar_subquery()
+        affected = db.session.query(File.blob_id).filter(File.id.in_(file_ids))
+
+        Blob.query.filter(Blob.id.in_(affected)).update(
+            {Blob.ref_count: Blob.ref_count - released}, synchronize_session=False
+        )
+        orphaned = Blob.query.filter(Blob.id.in_(affected), Blob.ref_count <= 0).update(
+            {Blob.orphaned_at: now}, synchronize_session=False
+        )
+        return orphaned + len(legacy)
+
+    @staticmethod
+    def location_of(file_record: File):
+        """
+        文件当前单个密文的位置，版本化文件返回None
+
+        以密文记录为准：布局迁移、卷再平衡和打包压缩改写的是 Blob.storage_path，
+        迁移期间创建的文件记录中的 file_path 可能仍是旧位置。
+        """
+        if file_record.current_version_id:
+            return None
+        return file_record.blob.storage_path if file_record.blob_id else file_record.file_path
+
+    @staticmethod
+    def retire_location(storage_path: str, size: int, delay: float = 0):
+        """
+        登记不再使用的旧位置，由后台清理任务在 delay 秒后删除（不提交事务）
+
+        以引用归零的密文记录登记，与改写记录在同一事务中提交，进程中途退出也不会遗留数据。
+        """
+        db.session.add(Blob(
+            storage_path=storage_path, size=size, ref_count=0,
+            orphaned_at=datetime.now() + timedelta(seconds=delay),
+            volume=BlobStore.volume_of(storage_path)
+        ))
+
+    @staticmethod
+    def allocate_path() -> str:
+        """在当前存储驱动上为新密文分配位置"""
+        return get_driver().new_location()
+
+    @staticmethod
+    def volume_of(storage_path: str):
+        """密文所在的数据卷名称（非本地驱动为None）"""
+        return driver_for(storage_path).volume_of(storage_path)
+
+    @staticmethod
+    def local_file(storage_path: str):
+        """
+        本地驱动上单个文件存放的密文返回 (卷名, 卷内相对路径, 绝对路径)，其他位置返回None
+
+        供 sendfile / X-Accel-Redirect 直接发送。
+        """
+        driver = driver_for(storage_path)
+        volume = driver.find_volume(storage_path) if isinstance(driver, LocalDriver) else None
+        if volume is None:
+            return None
+        relative = os.path.relpath(storage_path, volume.path).replace(os.sep, '/')
+        return volume.name, relative, os.path.abspath(storage_path)
+
+    @staticmethod
+    def is_sharded(storage_path: str) -> bool:
+        """存储位置是否已是分目录布局"""
+        name = os.path.basename(storage_path)
+        parent = os.path.dirname(storage_path)
+        return (name.endswith(BLOB_SUFFIX)
+                and os.path.basename(parent) == name[2:4]
+                and os.path.basename(os.path.dirname(parent)) == name[:2])
+
+    @staticmethod
+    def write_chunks(chunks, size: int = None, storage_path: str = None) -> str:
+        """
+        写入密文，返回存储位置
+
+        写入是原子的：读取方不会看到写了一半的数据（本地驱动先写临时文件并fsync，再rename）。
+
+        Args:
+            chunks: 密文数据块的可迭代对象
+            size: 已知的总大小，用于预分配空间
+            storage_path: 目标位置，默认在当前驱动上新分配
+        """
+        storage_path = storage_path or BlobStore.allocate_path()
+        driver_for(storage_path).write(storage_path, chunks, size)
+        return storage_path
+
+    @staticmethod
+    def write_data(data: bytes) -> str:
+        """将文件层密文（Layer 1）写入新位置，返回存储位置（小密文追加到打包文件）"""
+        if should_pack(len(data)):
+            return get_driver('pack').append(data)
+        return BlobStore.write_chunks((data,), len(data))
+
+    @staticmethod
+    def iter_data(storage_path: str, chunk_size: int = READ_CHUNK_SIZE):
+        """按块读取密文，密文不存在时抛出 FileNotFoundError"""
+        return driver_for(storage_path).open(storage_path, chunk_size)
+
+    @staticmethod
+    def stat_data(storage_path: str):
+        """返回密文大小，不存在时返回None"""
+        return driver_for(storage_path).stat(storage_path)
+
+    @staticmethod
+    def copy_data(source: str, target: str):
+        """复制密文，同一驱动内由驱动完成（本地驱动使用硬链接），跨驱动时流式复制"""
+        source_driver, target_driver = driver_for(source), driver_for(target)
+        if source_driver is target_driver:
+            source_driver.copy(source, target)
+        else:
+            target_driver.write(target, source_driver.open(source, READ_CHUNK_SIZE), source_driver.stat(source))
+
+    @staticmethod
+    def remove_data(storage_path: str):
+        """删除密文，不存在时忽略"""
+        if storage_path:
+            hot_blob_cache.invalidate(content_key(storage_path))
+            driver_for(storage_path).delete(storage_path)
@@ -0,0 +1,357 @@
+"""
+密文存储驱动
+BlobStore 通过驱动读写密文，API层不直接接触文件系统。
+
+Blob.storage_path 保存的是"位置"：本地驱动为文件路径（与旧数据兼容），
+其他驱动带 scheme 前缀（memory://、s3://、replica://、parity://、pack://），因此不同驱动上的密文可以共存，
+切换 STORAGE_DRIVER 只影响新写入的数据。
+
+所有驱动约定：读取不存在的对象时抛出 FileNotFoundError。
+"""
+from flask import current_app
+from storage.volumes import HashRing, parse_volumes
+import io
+import os
+import secrets
+import threading
+
+# 密文文件扩展名
+BLOB_SUFFIX = '.blob'
+# 写入中的临时文件扩展名
+TEMP_SUFFIX = '.tmp'
+
+
+def new_blob_key() -> str:
+    """生成新的对象键（随机ID，按ID前两级分目录: ab/cd/abcd….blob）"""
+    blob_key = secrets.token_hex(16)
+    return f'{blob_key[:2]}/{blob_key[2:4]}/{blob_key}{BLOB_SUFFIX}'
+
+
+class StorageDriver:
+    """存储驱动接口（流式读写）"""
+
+    scheme = None
+    # 密文能否由迁移工具搬到其他位置
+    relocatable = True
+
+    def new_location(self) -> str:
+        """为新对象分配位置"""
+        raise NotImplementedError
+
+    def write(self, location: str, chunks, size: int = None):
+        """写入对象（整体可见，不会出现写了一半的对象）"""
+        raise NotImplementedError
+
+    def open(self, location: str, chunk_size: int):
+        """按块读取对象，返回数据块迭代器"""
+        raise NotImplementedError
+
+    def delete(self, location: str):
+        """删除对象，对象不存在时忽略"""
+        raise NotImplementedError
+
+    def stat(self, location: str):
+        """返回对象大小，对象不存在时返回None"""
+        raise NotImplementedError
+
+    def copy(self, source: str, target: str):
+        """复制对象（驱动可以提供不复制数据的实现）"""
+        self.write(target, self.open(source, 1024 * 1024), self.stat(source))
+
+    def volume_of(self, location: str):
+        """对象所在的数据卷名称，驱动不区分卷时返回None"""
+        return None
+
+    def _key(self, location: str) -> str:
+        prefix = f'{self.scheme}://'
+        return location[len(prefix):] if location.startswith(prefix) else location
+
+
+def _preallocate(fd: int, size: int):
+    """为已知大小的写入预分配磁盘空间（平台不支持时跳过）"""
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+
+
+def _fsync_directory(directory: str):
+    """同步目录项，保证rename在崩溃后仍然可见（平台不支持时跳过）"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class LocalDriver(StorageDriver):
+    """本地文件系统驱动，位置即文件路径；配置多个卷时按一致性哈希选择卷"""
+
+    scheme = 'file'
+
+    def __init__(self, volumes, fsync: bool = True):
+        self.volumes = volumes
+        self.ring = HashRing(volumes)
+        self.fsync = fsync
+
+    def new_location(self) -> str:
+        key = new_blob_key()
+        return self.location_on(self.ring.lookup(key), key)
+
+    @staticmethod
+    def location_on(volume, key: str) -> str:
+        """对象键在某个卷上的路径"""
+        return os.path.join(volume.path, *key.split('/'))
+
+    def find_volume(self, location: str):
+        """位置所在的卷，不在任何已配置卷下时返回None"""
+        for volume in self.volumes:
+            if volume.contains(self._key(location)):
+                return volume
+        return None
+
+    def volume_of(self, location: str):
+        volume = self.find_volume(location)
+        return volume.name if volume else None
+
+    def write(self, location: str, chunks, size: int = None):
+        """先写入同目录下的临时文件并fsync，再rename到最终路径"""
+        path = self._key(location)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        temp_path = path + TEMP_SUFFIX
+        try:
+            with open(temp_path, 'xb') as f:
+                _preallocate(f.fileno(), size)
+                for chunk in chunks:
+                    f.write(chunk)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        if self.fsync:
+            _fsync_directory(directory)
+
+    def open(self, location: str, chunk_size: int):
+        # 在返回迭代器之前打开文件，不存在时立即抛出 FileNotFoundError
+        f = open(self._key(location), 'rb')
+        return self._iter_file(f, chunk_size)
+
+    @staticmethod
+    def _iter_file(f, chunk_size):
+        with f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def delete(self, location: str):
+        path = self._key(location)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def stat(self, location: str):
+        try:
+            return os.path.getsize(self._key(location))
+        except OSError:
+            return None
+
+    def copy(self, source: str, target: str):
+        """同一文件系统上用硬链接，只增加目录项不复制数据"""
+        target_path = self._key(target)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        try:
+            os.link(self._key(source), target_path)
+        except OSError:
+            super().copy(source, target)
+
+
+class MemoryDriver(StorageDriver):
+    """内存驱动，用于测试（进程退出后数据丢失）"""
+
+    scheme = 'memory'
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def new_location(self) -> str:
+        return f'{self.scheme}://{new_blob_key()}'
+
+    def write(self, location: str, chunks, size: int = None):
+        data = b''.join(chunks)
+        with self._lock:
+            self._objects[self._key(location)] = data
+
+    def open(self, location: str, chunk_size: int):
+        with self._lock:
+            data = self._objects.get(self._key(location))
+        if data is None:
+            raise FileNotFoundError(location)
+        return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+    def delete(self, location: str):
+        with self._lock:
+            self._objects.pop(self._key(location), None)
+
+    def stat(self, location: str):
+        with self._lock:
+            data = self._objects.get(self._key(location))
+        return None if data is None else len(data)
+
+
+class _ChunkReader(io.RawIOBase):
+    """把数据块迭代器包装成只读文件对象（供分段上传使用）"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b''
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class S3Driver(StorageDriver):
+    """
+    S3兼容对象存储驱动（需要安装 boto3）
+
+    S3_ENDPOINT_URL 可以指向 MinIO 等本地兼容服务，用于测试。
+    """
+
+    scheme = 's3'
+
+    def __init__(self, bucket: str, prefix: str = '', **client_options):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError('使用S3存储驱动需要安装 boto3')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self._client = boto3.client('s3', **{k: v for k, v in client_options.items() if v})
+        self._client_error = ClientError
+
+    def _object_key(self, location: str) -> str:
+        key = self._key(location)
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def _is_missing(self, error) -> bool:
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def new_location(self) -> str:
+        return f'{self.scheme}://{new_blob_key()}'
+
+    def write(self, location: str, chunks, size: int = None):
+        # 大对象由 boto3 自动分段上传，完成前对象不可见
+        self._client.upload_fileobj(
+            io.BufferedReader(_ChunkReader(chunks)), self.bucket, self._object_key(location)
+        )
+
+    def open(self, location: str, chunk_size: int):
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self._object_key(location))
+        except self._client_error as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(location)
+            raise
+        return response['Body'].iter_chunks(chunk_size)
+
+    def delete(self, location: str):
+        self._client.delete_object(Bucket=self.bucket, Key=self._object_key(location))
+
+    def stat(self, location: str):
+        try:
+            response = self._client.head_object(Bucket=self.bucket, Key=self._object_key(location))
+        except self._client_error as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return response['ContentLength']
+
+    def copy(self, source: str, target: str):
+        self._client.copy_object(
+            Bucket=self.bucket,
+            Key=self._object_key(target),
+            CopySource={'Bucket': self.bucket, 'Key': self._object_key(source)}
+        )
+
+
+# 位置中带 scheme 前缀的驱动
+LOCATION_SCHEMES = ('memory', 's3', 'replica', 'parity', 'pack')
+
+_drivers_lock = threading.Lock()
+
+
+def _create_driver(name: str, config) -> StorageDriver:
+    if name == 'local':
+        volumes = parse_volumes(config.get('STORAGE_VOLUMES'), config.get('UPLOAD_FOLDER', 'uploads'))
+        return LocalDriver(volumes, config.get('BLOB_FSYNC', True))
+    if name == 'memory':
+        return MemoryDriver()
+    if name == 's3':
+        return S3Driver(
+            config.get('S3_BUCKET'),
+            config.get('S3_PREFIX', ''),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region_name=config.get('S3_REGION'),
+            aws_access_key_id=config.get('S3_ACCESS_KEY'),
+            aws_secret_access_key=config.get('S3_SECRET_KEY')
+        )
+    if name in ('replica', 'parity'):
+        from storage.redundancy import ReplicatedDriver, ParityDriver
+        volumes = parse_volumes(config.get('STORAGE_VOLUMES'), config.get('UPLOAD_FOLDER', 'uploads'))
+        unit_size = config.get('BLOB_STRIPE_UNIT', 64 * 1024)
+        if name == 'replica':
+            return ReplicatedDriver(volumes, config.get('BLOB_REPLICAS', 2), unit_size, config.get('BLOB_FSYNC', True))
+        return ParityDriver(volumes, config.get('BLOB_PARITY_SHARDS', 4), unit_size, config.get('BLOB_FSYNC', True))
+    if name == 'pack':
+        from storage.packs import PackDriver
+        return PackDriver(
+            config.get('PACK_FOLDER') or os.path.join(config.get('UPLOAD_FOLDER', 'uploads'), 'packs'),
+            config.get('PACK_SIZE', 256 * 1024 * 1024),
+            config.get('PACK_COMPACT_MIN_AGE', 3600) / 2,
+            config.get('BLOB_FSYNC', True)
+        )
+    raise ValueError(f'未知的存储驱动: {name}')
+
+
+def get_driver(name: str = None) -> StorageDriver:
+    """获取驱动实例（每个应用每种驱动一个实例），默认为 STORAGE_DRIVER 配置的驱动"""
+    name = name or current_app.config.get('STORAGE_DRIVER', 'local')
+    drivers = current_app.extensions.setdefault('blob_storage_drivers', {})
+    driver = drivers.get(name)
+    if driver is None:
+        with _drivers_lock:
+            driver = drivers.get(name)
+            if driver is None:
+                driver = drivers[name] = _create_driver(name, current_app.config)
+    return driver
+
+
+def driver_for(location: str) -> StorageDriver:
+    """按位置的 scheme 选择驱动（驱动名称即 scheme），不带 scheme 的位置为本地文件路径"""
+    scheme, separator, _ = location.partition('://')
+    if separator and scheme in LOCATION_SCHEMES:
+        return get_driver(scheme)
+    return get_driver('local')
@@ -0,0 +1,22 @@
+"""
+热点密文缓存
+同一文件在短时间内被大量下载时（例如组内共享的文件），文件层密文只从磁盘读取一次：
+按字节数限制容量的LRU缓存，同一文件的并发未命中合并为一次读取。
+
+缓存的键是不可变的内容标识——版本化文件为版本ID，其他文件为密文位置——
+新版本、恢复版本或迁移密文都会产生新的键，缓存不会返回过期内容；
+内容被永久删除时立即从缓存中移除。缓存在进程内，容量由 HOT_CACHE_BYTES 配置。
+"""
+from utils.cache import ByteLRUCache
+
+hot_blob_cache = ByteLRUCache()
+
+
+def content_key(storage_path: str, version_id: int = None):
+    """缓存键：版本化内容为版本ID，否则为密文位置"""
+    return ('version', version_id) if version_id else ('blob', storage_path)
+
+
+def configure_hot_cache(config):
+    """按应用配置设置缓存容量"""
+    hot_blob_cache.resize(config.get('HOT_CACHE_BYTES', 0), config.get('HOT_CACHE_MAX_ITEM_BYTES'))
@@ -0,0 +1,165 @@
+"""
+存储布局迁移
+把旧版平铺在上传目录中的密文（{user_id}_{timestamp}_{文件名}.enc）迁移到分目录布局，
+也可以把（较早写入的）密文迁移到另一个存储驱动，例如把冷数据移到对象存储。
+迁移按密文ID分批进行，每批一个事务，可以在服务运行期间执行：
+新位置先就绪再改写记录，旧位置在同一事务中登记为待清理的密文记录，由后台清理任务在宽限期后删除，
+正在读取旧位置的请求不受影响，迁移进程中途退出也不会遗留旧数据。
+读取一律以 Blob.storage_path 为准（见 BlobStore.location_of），迁移期间创建、仍带旧 file_path 的文件记录不受影响。
+
+增加数据卷后，VolumeRebalancer 用同样的方式把一致性哈希指向新卷的密文移过去。
+"""
+from models import Blob, File, db
+from storage.blobs import BlobStore
+from storage.drivers import get_driver, driver_for
+from storage.purger import BlobPurger
+from datetime import datetime, timedelta
+import os
+import time
+
+
+class LayoutMigrator:
+    """旧版平铺布局到分目录布局的在线迁移"""
+
+    def __init__(self, batch_size: int = 200, pause: float = 0, grace: float = 5.0,
+                 driver: str = None, older_than_days: int = None):
+        """
+        Args:
+            batch_size: 每批迁移的密文数量
+            pause: 批与批之间的间隔（秒），用于限速
+            grace: 改写记录后保留旧位置的时间（秒）
+            driver: 目标存储驱动，默认为 STORAGE_DRIVER
+            older_than_days: 只迁移早于该天数写入的密文
+        """
+        self.batch_size = batch_size
+        self.pause = pause
+        self.grace = grace
+        self.target = get_driver(driver)
+        self.older_than_days = older_than_days
+
+    def register_legacy_files(self) -> int:
+        """为没有 blob_id 的旧文件补建密文记录，使其随密文记录一起迁移"""
+        total = 0
+        while True:
+            files = File.query.filter(
+                File.blob_id.is_(None),
+                File.current_version_id.is_(None)
+            ).limit(self.batch_size).all()
+            if not files:
+                return total
+            for file_record in files:
+                BlobStore.ensure(file_record)
+            db.session.commit()
+            total += len(files)
+
+    def relocate(self, storage_path: str):
+        """返回密文的新位置，不需要迁移时返回None"""
+        if not driver_for(storage_path).relocatable:
+            return None
+        if BlobStore.is_sharded(storage_path) and driver_for(storage_path) is self.target:
+            return None
+        return self.target.new_location()
+
+    def migrate_batch(self, after_id: int = 0):
+        """
+        迁移一批密文
+
+        本地驱动在同一文件系统上用硬链接生成新路径（不复制数据），否则原子复制。
+
+        Returns:
+            tuple: (本批最后一个密文ID, 迁移数量) - 没有更多密文时ID为None
+        """
+        query = db.session.query(Blob.id, Blob.storage_path, Blob.size).filter(
+            Blob.id > after_id,
+            Blob.orphaned_at.is_(None)
+        )
+        if self.older_than_days:
+            query = query.filter(Blob.created_at < datetime.now() - timedelta(days=self.older_than_days))
+        blobs = query.order_by(Blob.id).limit(self.batch_size).all()
+        if not blobs:
+            return None, 0
+
+        moved = []
+        for blob_id, old_path, size in blobs:
+            new_path = self.relocate(old_path)
+            if new_path is None:
+                continue
+            if BlobStore.stat_data(old_path) is None:
+                print(f"迁移跳过 {blob_id}: 密文不存在")
+                continue
+            BlobStore.copy_data(old_path, new_path)
+            moved.append((blob_id, old_path, new_path, size))
+
+        migrated = 0
+        for blob_id, old_path, new_path, size in moved:
+            # 只在记录仍指向旧路径时改写，期间被清理或改写的记录保持不变
+            updated = Blob.query.filter(Blob.id == blob_id, Blob.storage_path == old_path).update(
+                {Blob.storage_path: new_path, Blob.volume: BlobStore.volume_of(new_path)},
+                synchronize_session=False
+            )
+            if updated:
+                File.query.filter(File.blob_id == blob_id).update({
+                    File.file_path: new_path,
+                    File.filename: os.path.basename(new_path)
+                }, synchronize_session=False)
+                BlobStore.retire_location(old_path, size, self.grace)
+                migrated += 1
+            else:
+                BlobStore.retire_location(new_path, size)
+        db.session.commit()
+        return blobs[-1].id, migrated
+
+    def run(self) -> dict:
+        """迁移全部密文，返回统计结果"""
+        registered = self.register_legacy_files()
+        migrated = 0
+        last_id = 0
+        while True:
+            last_id, count = self.migrate_batch(last_id)
+            migrated += count
+            if last_id is None:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+
+        # 宽限期结束后顺带清理本次留下的旧位置（未清理完的由后台任务继续）
+        if migrated:
+            time.sleep(self.grace)
+            BlobPurger.purge_pending(self.batch_size, pause=self.pause)
+        return {'registered': registered, 'migrated': migrated}
+
+
+class VolumeRebalancer(LayoutMigrator):
+    """
+    数据卷再平衡
+
+    把本地驱动上所在卷与一致性哈希结果不一致的密文移到目标卷（对象键不变），
+    每次运行最多移动 max_moves 个密文。
+    """
+
+    def __init__(self, batch_size: int = 200, pause: float = 0, grace: float = 5.0, max_moves: int = None):
+        super().__init__(batch_size, pause, grace, driver='local')
+        self.max_moves = max_moves
+        self.scheduled = 0  # 已完成复制并提交记录改写的密文数
+        self._planned = 0  # 当前批次中已选定、尚未提交的密文数
+
+    def migrate_batch(self, after_id: int = 0):
+        """迁移一批密文，复制和记录改写都成功提交后才计入 scheduled"""
+        self._planned = 0
+        last_id, migrated = super().migrate_batch(after_id)
+        self.scheduled += migrated
+        return last_id, migrated
+
+    def relocate(self, storage_path: str):
+        if self.max_moves is not None and self.scheduled + self._planned >= self.max_moves:
+            return None
+        if driver_for(storage_path) is not self.target or not BlobStore.is_sharded(storage_path):
+            return None
+
+        parts = os.path.normpath(storage_path).split(os.sep)
+        key = '/'.join(parts[-3:])
+        volume = self.target.ring.lookup(key)
+        if volume.contains(storage_path):
+            return None
+        self._planned += 1
+        return self.target.location_on(volume, key)
@@ -0,0 +1,222 @@
+"""
+密文完整性清单
+上传时对文件层密文计算SHA-256，并按固定大小的叶子计算Merkle树（RFC 6962 结构）：
+  叶子哈希 = SHA-256(0x00 || 叶子数据)，内部节点 = SHA-256(0x01 || 左 || 右)
+客户端和审计方不需要文件密钥即可校验整个文件（根哈希），
+或只下载一个叶子并用审计路径校验该范围。
+
+每个密文记录保存叶子哈希的紧凑形式（32字节 × 叶子数）和根哈希；
+版本化文件的清单由其各分段的叶子哈希拼接而成（分段大小是叶子大小的整数倍）。
+"""
+from flask import current_app, has_app_context
+from models import Blob, File, FileVersion, db
+import base64
+import hashlib
+
+# 叶子大小
+LEAF_SIZE = 64 * 1024
+HASH_SIZE = 32
+
+
+def leaf_hash(data: bytes) -> bytes:
+    return hashlib.sha256(b'\x00' + data).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def merkle_root(hashes) -> bytes:
+    """由叶子哈希计算根哈希（奇数个节点时最后一个直接上移，与 RFC 6962 的树相同）"""
+    level = list(hashes)
+    if not level:
+        return hashlib.sha256(b'').digest()
+    while len(level) > 1:
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return level[0]
+
+
+def audit_path(hashes, index: int):
+    """叶子 index 的审计路径（自底向上的兄弟节点哈希）"""
+    level = list(hashes)
+    path = []
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            path.append(level[sibling])
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+        index //= 2
+    return path
+
+
+def verify_path(leaf: bytes, index: int, count: int, path, root: bytes) -> bool:
+    """用审计路径校验叶子哈希（RFC 9162 2.1.3.2）"""
+    if index >= count:
+        return False
+    fn, sn, node = index, count - 1, leaf
+    for sibling in path:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            node = node_hash(sibling, node)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            node = node_hash(node, sibling)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and node == root
+
+
+def configured_leaf_size() -> int:
+    if has_app_context():
+        return current_app.config.get('MERKLE_LEAF_SIZE', LEAF_SIZE)
+    return LEAF_SIZE
+
+
+class MerkleBuilder:
+    """在一次遍历中计算密文的SHA-256和各叶子哈希"""
+
+    def __init__(self, leaf_size: int = None):
+        self.leaf_size = leaf_size or configured_leaf_size()
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._leaves = bytearray()
+        self._pending = bytearray()
+
+    def update(self, data: bytes):
+        self.size += len(data)
+        self._sha256.update(data)
+        view = memoryview(data)
+        if self._pending:
+            take = min(self.leaf_size - len(self._pending), len(view))
+            self._pending += view[:take]
+            view = view[take:]
+            if len(self._pending) == self.leaf_size:
+                self._leaves += leaf_hash(bytes(self._pending))
+                self._pending.clear()
+        while len(view) >= self.leaf_size:
+            self._leaves += leaf_hash(bytes(view[:self.leaf_size]))
+            view = view[self.leaf_size:]
+        self._pending += view
+        return self
+
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+    @property
+    def leaves(self) -> bytes:
+        """叶子哈希的紧凑形式（含未满一个叶子的尾部）"""
+        if self._pending or not self._leaves:
+            return bytes(self._leaves) + leaf_hash(bytes(self._pending))
+        return bytes(self._leaves)
+
+    def root(self) -> str:
+        return merkle_root(_split_hashes(self.leaves)).hex()
+
+
+def hash_ciphertext(data: bytes, leaf_size: int = None) -> MerkleBuilder:
+    """计算一段完整密文的SHA-256和Merkle树"""
+    return MerkleBuilder(leaf_size).update(data)
+
+
+def _split_hashes(leaves: bytes):
+    return [leaves[i:i + HASH_SIZE] for i in range(0, len(leaves), HASH_SIZE)]
+
+
+class Manifest:
+    """一个文件（或版本）的完整性清单"""
+
+    def __init__(self, size: int, leaf_size: int, leaves: bytes, sha256: str = None):
+        self.size = size
+        self.leaf_size = leaf_size
+        self.hashes = _split_hashes(leaves)
+        self.sha256 = sha256  # 整个密文的SHA-256，由多个分段组成时为None
+        self._root = None
+
+    @property
+    def leaf_count(self) -> int:
+        return len(self.hashes)
+
+    @property
+    def root(self) -> bytes:
+        if self._root is None:
+            self._root = merkle_root(self.hashes)
+        return self._root
+
+    def leaf_range(self, index: int):
+        """叶子覆盖的密文范围 (偏移, 长度)"""
+        offset = index * self.leaf_size
+        return offset, max(0, min(self.leaf_size, self.size - offset))
+
+    def proof(self, index: int) -> dict:
+        offset, length = self.leaf_range(index)
+        return {
+            'index': index,
+            'offset': offset,
+            'length': length,
+            'leaf': self.hashes[index].hex(),
+            'path': [node.hex() for node in audit_path(self.hashes, index)],
+            'leaf_count': self.leaf_count,
+            'root': self.root.hex()
+        }
+
+    def to_dict(self, include_leaves: bool = False) -> dict:
+        data = {
+            'algorithm': 'sha256',
+            'tree': 'rfc6962',
+            'size': self.size,
+            'sha256': self.sha256,
+            'leaf_size': self.leaf_size,
+            'leaf_count': self.leaf_count,
+            'root': self.root.hex()
+        }
+        if include_leaves:
+            data['leaves'] = base64.b64encode(b''.join(self.hashes)).decode('ascii')
+        return data
+
+
+def blob_manifest(blob: Blob):
+    """单个密文的清单，上传时未计算清单的旧记录返回None"""
+    if not blob or blob.merkle_leaves is None:
+        return None
+    return Manifest(blob.size, blob.merkle_leaf_size, blob.merkle_leaves, blob.digest)
+
+
+def version_manifest(version: FileVersion):
+    """
+    由各分段的叶子哈希拼接版本的清单
+
+    分段的叶子大小不同、除最后一个外的分段大小不是叶子大小的整数倍，
+    或有分段缺少清单时返回None。
+    """
+    segment_ids = version.segment_ids()
+    rows = {row.id: row for row in db.session.query(
+        Blob.id, Blob.size, Blob.digest, Blob.merkle_leaf_size, Blob.merkle_leaves
+    ).filter(Blob.id.in_(set(segment_ids)))}
+    segments = [rows.get(blob_id) for blob_id in segment_ids]
+    if not segments or any(s is None or s.merkle_leaves is None for s in segments):
+        return None
+    leaf_size = segments[0].merkle_leaf_size
+    if any(s.merkle_leaf_size != leaf_size for s in segments):
+        return None
+    if any(s.size % leaf_size for s in segments[:-1]):
+        return None
+    return Manifest(
+        version.size, leaf_size, b''.join(s.merkle_leaves for s in segments),
+        segments[0].digest if len(segments) == 1 else None
+    )
+
+
+def file_manifest(file_record: File):
+    """文件当前内容的清单"""
+    if file_record.current_version_id:
+        return version_manifest(db.session.get(FileVersion, file_record.current_version_id))
+    return blob_manifest(file_record.blob)
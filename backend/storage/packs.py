@@ -0,0 +1,276 @@
+"""
+小密文打包存储
+几KB的小密文不再各占一个文件，而是追加写入大的只追加打包文件，
+每个密文的位置即 (打包文件, 偏移, 长度)：pack://<pack_id>/<offset>/<length>。
+读取时对缓存的文件描述符做一次 pread，不需要 open()。
+
+打包文件只追加、不原地修改：删除密文只删除记录，空间由 PackCompactor 回收——
+把存活数据比例过低的打包文件中仍被引用的密文追加到新的打包文件，改写记录的同一事务中
+把旧文件登记为待清理（与布局迁移的旧位置相同），宽限期后由清理任务删除。
+
+每个进程写自己的活动打包文件；打包文件写满或打开时间超过 max_age 后不再追加，
+压缩任务只处理超过 PACK_COMPACT_MIN_AGE 未修改的打包文件（不小于 2 × max_age），
+因此不会与写入或尚未提交的上传冲突。
+"""
+from flask import current_app
+from models import Blob, File, db
+from storage.drivers import StorageDriver, get_driver, _fsync_directory
+from collections import OrderedDict
+import os
+import secrets
+import threading
+import time
+
+# 打包文件扩展名
+PACK_SUFFIX = '.pack'
+
+
+class _PackHandle:
+    """缓存的打包文件描述符（读取期间持有引用，淘汰后等引用归零再关闭）"""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.refs = 0
+        self.evicted = False
+
+
+class PackDriver(StorageDriver):
+    """小密文打包驱动（位置在追加时确定，不支持 new_location / write）"""
+
+    scheme = 'pack'
+    relocatable = False
+
+    def __init__(self, folder: str, pack_size: int = 256 * 1024 * 1024, max_age: float = 1800,
+                 fsync: bool = True, max_open: int = 128):
+        self.folder = folder
+        self.pack_size = pack_size
+        self.max_age = max_age
+        self.fsync = fsync
+        self.max_open = max_open
+        self._write_lock = threading.Lock()
+        self._active = None  # (pack_id, 文件对象, 打开时间)
+        self._handles_lock = threading.Lock()
+        self._handles = OrderedDict()  # pack_id -> _PackHandle
+
+    def pack_path(self, pack_id: str) -> str:
+        return os.path.join(self.folder, f'{pack_id}{PACK_SUFFIX}')
+
+    @property
+    def active_pack(self):
+        """本进程正在追加的打包文件ID"""
+        active = self._active
+        return active[0] if active else None
+
+    @staticmethod
+    def parse(location: str):
+        """解析位置，返回 (pack_id, 偏移, 长度)"""
+        pack_id, offset, length = location[len('pack://'):].split('/')
+        return pack_id, int(offset), int(length)
+
+    def _roll(self):
+        """关闭当前打包文件，开始一个新的"""
+        if self._active:
+            self._active[1].close()
+        os.makedirs(self.folder, exist_ok=True)
+        pack_id = secrets.token_hex(8)
+        f = open(self.pack_path(pack_id), 'xb')
+        if self.fsync:
+            _fsync_directory(self.folder)
+        self._active = (pack_id, f, time.monotonic())
+
+    def append(self, data: bytes) -> str:
+        """追加一个密文并落盘，返回其位置"""
+        with self._write_lock:
+            if (self._active is None
+                    or self._active[1].tell() + len(data) > self.pack_size
+                    or time.monotonic() - self._active[2] > self.max_age):
+                self._roll()
+            pack_id, f, _ = self._active
+            offset = f.tell()
+            try:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            except BaseException:
+                # 写了一半的数据没有记录引用，由压缩任务回收；之后的数据写入新的打包文件
+                self._active = None
+                f.close()
+                raise
+        return f'{self.scheme}://{pack_id}/{offset}/{len(data)}'
+
+    def _acquire(self, pack_id: str) -> _PackHandle:
+        with self._handles_lock:
+            handle = self._handles.get(pack_id)
+            if handle is not None:
+                self._handles.move_to_end(pack_id)
+                handle.refs += 1
+                return handle
+
+        fd = os.open(self.pack_path(pack_id), os.O_RDONLY)
+        with self._handles_lock:
+            handle = self._handles.get(pack_id)
+            if handle is None:
+                handle = self._handles[pack_id] = _PackHandle(fd)
+                fd = None
+                while len(self._handles) > self.max_open:
+                    _, oldest = self._handles.popitem(last=False)
+                    self._evict(oldest)
+            handle.refs += 1
+        if fd is not None:
+            os.close(fd)
+        return handle
+
+    def _release(self, handle: _PackHandle):
+        with self._handles_lock:
+            handle.refs -= 1
+            if handle.evicted and handle.refs == 0:
+                os.close(handle.fd)
+
+    def _evict(self, handle: _PackHandle):
+        """从缓存中移除（调用方持有锁）"""
+        handle.evicted = True
+        if handle.refs == 0:
+            os.close(handle.fd)
+
+    def _forget(self, pack_id: str, handle: _PackHandle):
+        with self._handles_lock:
+            if self._handles.get(pack_id) is handle:
+                del self._handles[pack_id]
+                self._evict(handle)
+
+    def read(self, location: str) -> bytes:
+        """读取一个密文（一次 pread）"""
+        pack_id, offset, length = self.parse(location)
+        handle = self._acquire(pack_id)
+        try:
+            # 打包文件被压缩任务删除后，缓存的描述符不能让已删除的文件一直占用空间
+            if os.fstat(handle.fd).st_nlink == 0:
+                self._forget(pack_id, handle)
+                raise FileNotFoundError(location)
+            data = os.pread(handle.fd, length, offset)
+        finally:
+            self._release(handle)
+        if len(data) != length:
+            raise FileNotFoundError(location)
+        return data
+
+    def open(self, location: str, chunk_size: int):
+        data = self.read(location)
+        return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+    def write(self, location: str, chunks, size: int = None):
+        raise NotImplementedError('打包存储的位置在追加时确定')
+
+    def delete(self, location: str):
+        """打包文件只追加，删除的密文由压缩任务回收空间"""
+
+    def stat(self, location: str):
+        pack_id, offset, length = self.parse(location)
+        try:
+            pack_size = os.path.getsize(self.pack_path(pack_id))
+        except OSError:
+            return None
+        return length if offset + length <= pack_size else None
+
+
+class PackCompactor:
+    """打包文件压缩：回收已删除密文占用的空间"""
+
+    def __init__(self, threshold: float = 0.5, min_age: float = 3600, grace: float = 5.0):
+        """
+        Args:
+            threshold: 存活数据比例低于该值的打包文件会被重写
+            min_age: 只处理超过该时间（秒）未修改的打包文件
+            grace: 改写记录后保留旧打包文件的时间（秒）
+        """
+        self.threshold = threshold
+        self.min_age = min_age
+        self.grace = grace
+
+    @staticmethod
+    def _driver() -> PackDriver:
+        return get_driver('pack')
+
+    def candidates(self):
+        """返回可以压缩的打包文件 [(pack_id, 文件大小)]"""
+        driver = self._driver()
+        if not os.path.isdir(driver.folder):
+            return []
+        now = time.time()
+        packs = []
+        for name in os.listdir(driver.folder):
+            if not name.endswith(PACK_SUFFIX):
+                continue
+            pack_id = name[:-len(PACK_SUFFIX)]
+            try:
+                stat = os.stat(os.path.join(driver.folder, name))
+            except OSError:
+                continue
+            if pack_id != driver.active_pack and now - stat.st_mtime >= self.min_age:
+                packs.append((pack_id, stat.st_size))
+        return packs
+
+    def compact_pack(self, pack_id: str, pack_size: int):
+        """
+        压缩一个打包文件（存活比例不低于阈值或已等待清理时跳过）
+
+        Returns:
+            tuple: (是否已处理, 回收的字节数)
+        """
+        from storage.blobs import BlobStore
+
+        driver = self._driver()
+        pack_path = driver.pack_path(pack_id)
+        if db.session.query(Blob.id).filter(Blob.storage_path == pack_path).first():
+            return False, 0
+
+        # 引用归零、等待清理的密文也保留，避免与重新引用竞争
+        rows = db.session.query(Blob.id, Blob.storage_path).filter(
+            Blob.storage_path.like(f'{PackDriver.scheme}://{pack_id}/%')
+        ).all()
+        live = [(blob_id, path, driver.parse(path)[2]) for blob_id, path in rows]
+        live_bytes = sum(length for _, _, length in live)
+        if pack_size and live_bytes / pack_size >= self.threshold:
+            return False, 0
+
+        for blob_id, old_path, _ in live:
+            new_path = driver.append(driver.read(old_path))
+            # 只在记录仍指向旧位置时改写（读取以 Blob.storage_path 为准，File.file_path 只是副本）
+            updated = Blob.query.filter(Blob.id == blob_id, Blob.storage_path == old_path).update(
+                {Blob.storage_path: new_path}, synchronize_session=False
+            )
+            if updated:
+                File.query.filter(File.blob_id == blob_id).update(
+                    {File.file_path: new_path}, synchronize_session=False
+                )
+        # 整个旧打包文件按本地路径登记为待清理，进程中途退出也不会遗留
+        BlobStore.retire_location(pack_path, pack_size, self.grace)
+        db.session.commit()
+        return True, pack_size - live_bytes
+
+    def run(self) -> dict:
+        """压缩全部符合条件的打包文件，返回统计结果"""
+        from storage.purger import BlobPurger
+
+        compacted = 0
+        reclaimed = 0
+        for pack_id, pack_size in self.candidates():
+            done, freed = self.compact_pack(pack_id, pack_size)
+            if done:
+                compacted += 1
+                reclaimed += freed
+
+        # 正在读取旧位置的请求在宽限期内不受影响，之后顺带清理（未清理完的由后台任务继续）
+        if compacted:
+            time.sleep(self.grace)
+            BlobPurger.purge_pending()
+        return {'compacted': compacted, 'reclaimed_bytes': reclaimed}
+
+
+def should_pack(size: int) -> bool:
+    """新密文是否写入打包文件（仅在默认本地驱动上启用，冗余存储和对象存储不打包）"""
+    config = current_app.config
+    return (config.get('PACK_SMALL_BLOBS', False)
+            and config.get('STORAGE_DRIVER', 'local') == 'local'
+            and size <= config.get('PACK_MAX_BLOB_SIZE', 64 * 1024))
@@ -0,0 +1,163 @@
+"""
+后台清理
+分批删除引用已归零的密文、超过保留期的回收站文件，以及过期的增量上传会话；
+删除接口只需标记，不在请求线程中做磁盘I/O
+"""
+from models import Blob, DeltaUpload, DeltaUploadPart, File, db
+from storage.blobs import BlobStore
+from storage.versions import VersionStore
+from storage.hotcache import hot_blob_cache, content_key
+from utils.quota import QuotaManager
+from sqlalchemy import func
+from collections import Counter
+from datetime import datetime, timedelta
+import time
+
+
+class BlobPurger:
+    """引用归零密文的分批清理"""
+
+    @staticmethod
+    def purge_batch(batch_size: int = 200) -> int:
+        """
+        清理一批引用归零的密文
+
+        先删除磁盘数据再删除记录：中途失败时记录仍在，下次会重试。
+
+        Returns:
+            int: 本批清理的数量
+        """
+        # 迁移留下的旧位置登记为宽限期结束时才到期的记录
+        orphans = db.session.query(Blob.id, Blob.storage_path).filter(
+            Blob.orphaned_at <= datetime.now(),
+            Blob.ref_count <= 0
+        ).order_by(Blob.orphaned_at, Blob.id).limit(batch_size).all()
+
+        if not orphans:
+            return 0
+
+        purged = []
+        for blob_id, storage_path in orphans:
+            try:
+                BlobStore.remove_data(storage_path)
+                purged.append(blob_id)
+            except OSError as e:
+                print(f"清理密文失败 {blob_id}: {e}")
+
+        # 再次检查引用计数，避免删除期间被重新引用的记录
+        Blob.query.filter(
+            Blob.id.in_(purged),
+            Blob.ref_count <= 0
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return len(purged)
+
+    @staticmethod
+    def purge_pending(batch_size: int = 200, max_batches: int = 10, pause: float = 0) -> int:
+        """
+        连续清理多批，控制每轮的I/O量
+
+        Args:
+            max_batches: 单次调用最多处理的批数
+            pause: 批与批之间的间隔（秒），用于限速
+        """
+        total = 0
+        for i in range(max_batches):
+            if i and pause:
+                time.sleep(pause)
+            purged = BlobPurger.purge_batch(batch_size)
+            total += purged
+            if purged < batch_size:
+                break
+        return total
+
+
+class TrashPurger:
+    """回收站文件的永久删除"""
+
+    @staticmethod
+    def delete_permanently(file_ids) -> int:
+        """
+        永久删除一组文件记录并释放密文引用（不提交事务）
+
+        Args:
+            file_ids: File.id 的子查询（select）
+
+        Returns:
+            int: 删除的文件记录数
+        """
+        # 立即从热点缓存中移除（版本内容由 VersionStore.release_versions 移除）
+        for (file_path,) in db.session.query(func.coalesce(Blob.storage_path, File.file_path)).select_from(
+            File
+        ).outerjoin(Blob, File.blob_id == Blob.id).filter(
+            File.id.in_(file_ids), File.current_version_id.is_(None)
+        ):
+            hot_blob_cache.invalidate(content_key(file_path))
+
+        # 先释放单一密文（依据 current_version_id 区分），再释放版本分段和未提交的增量上传
+        QuotaManager.release_files(file_ids)
+        BlobStore.release_files(file_ids)
+        VersionStore.release_files(file_ids)
+        for upload in DeltaUpload.query.filter(DeltaUpload.file_id.in_(file_ids), DeltaUpload.status == 'open'):
+            DeltaUploadPurger.release(upload, 'aborted')
+        DeltaUpload.query.filter(DeltaUpload.file_id.in_(file_ids)).delete(synchronize_session=False)
+        return File.query.filter(File.id.in_(file_ids)).delete(synchronize_session=False)
+
+    @staticmethod
+    def expire_batch(retention_days: int, batch_size: int = 200) -> int:
+        """永久删除一批超过保留期的回收站文件"""
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        expired_ids = [file_id for (file_id,) in db.session.query(File.id).filter(
+            File.deleted_at.isnot(None),
+            File.deleted_at < cutoff
+        ).order_by(File.deleted_at).limit(batch_size).all()]
+
+        if not expired_ids:
+            return 0
+
+        deleted = TrashPurger.delete_permanently(
+            db.session.query(File.id).filter(File.id.in_(expired_ids))
+        )
+        db.session.commit()
+        return deleted
+
+    @staticmethod
+    def expire_pending(retention_days: int, batch_size: int = 200,
+                       max_batches: int = 10, pause: float = 0) -> int:
+        """连续清理多批过期的回收站文件，批与批之间间隔 pause 秒"""
+        total = 0
+        for i in range(max_batches):
+            if i and pause:
+                time.sleep(pause)
+            deleted = TrashPurger.expire_batch(retention_days, batch_size)
+            total += deleted
+            if deleted < batch_size:
+                break
+        return total
+
+
+class DeltaUploadPurger:
+    """增量上传会话的释放"""
+
+    @staticmethod
+    def release(upload: DeltaUpload, status: str):
+        """释放会话持有的分段引用并结束会话（不提交事务）"""
+        blob_ids = [blob_id for (blob_id,) in db.session.query(DeltaUploadPart.blob_id).filter(
+            DeltaUploadPart.upload_id == upload.id
+        )]
+        VersionStore.adjust_refs(Counter(blob_ids), -1)
+        DeltaUploadPart.query.filter_by(upload_id=upload.id).delete(synchronize_session=False)
+        upload.status = status
+
+    @staticmethod
+    def expire_batch(batch_size: int = 200) -> int:
+        """结束一批已过期但未提交的上传会话"""
+        expired = DeltaUpload.query.filter(
+            DeltaUpload.status == 'open',
+            DeltaUpload.expires_at < datetime.now()
+        ).order_by(DeltaUpload.expires_at).limit(batch_size).all()
+
+        for upload in expired:
+            DeltaUploadPurger.release(upload, 'expired')
+        db.session.commit()
+        return len(expired)
@@ -0,0 +1,267 @@
+"""
+密文冗余存储
+可选的持久性层：每个密文以多个分片文件存放在不同数据卷上，单个坏扇区或单块盘损坏不会丢失数据。
+端到端加密的文件无法从明文修复，只能依靠存储层的冗余。
+
+- replica：N 个完整副本，最多可以损坏 N-1 个
+- parity：k 个数据分片 + 1 个异或校验分片，每个条带中任意一个分片损坏时可以重建
+
+分片文件由定长记录组成，每条记录为一个条带单元及其SHA-256，读取时逐条校验；
+按条带流式读写，内存占用与文件大小无关（约 分片数 × 条带单元）。
+
+位置格式: parity://卷1,卷2,…/ab/cd/abcd….blob，分片所在的卷记录在位置中，
+之后增减数据卷不影响已有密文的读取（不再配置的卷按分片缺失处理）。
+"""
+from storage.drivers import StorageDriver, TEMP_SUFFIX, new_blob_key, _preallocate, _fsync_directory
+from storage.volumes import HashRing
+import hashlib
+import os
+import struct
+import zlib
+
+SHARD_MAGIC = b'SDSH'
+# 分片头: 魔数、密文大小、条带单元大小、数据分片数、分片序号，之后为以上字段的CRC32
+SHARD_HEADER = struct.Struct('>4sQIBB')
+HEADER_SIZE = SHARD_HEADER.size + 4
+DIGEST_SIZE = 32
+# 分片文件扩展名: <key>.s0、<key>.s1 …
+SHARD_SUFFIX = '.s'
+
+
+class ShardCorrupted(OSError):
+    """损坏或缺失的分片超过可以重建的数量"""
+
+
+def _pack_header(size: int, unit_size: int, data_shards: int, index: int) -> bytes:
+    body = SHARD_HEADER.pack(SHARD_MAGIC, size, unit_size, data_shards, index)
+    return body + struct.pack('>I', zlib.crc32(body))
+
+
+def _read_header(f):
+    """读取并校验分片头，返回 (密文大小, 条带单元大小, 数据分片数, 分片序号)，损坏时返回None"""
+    data = f.read(HEADER_SIZE)
+    if len(data) != HEADER_SIZE:
+        return None
+    body, (crc,) = data[:SHARD_HEADER.size], struct.unpack('>I', data[SHARD_HEADER.size:])
+    if zlib.crc32(body) != crc:
+        return None
+    magic, size, unit_size, data_shards, index = SHARD_HEADER.unpack(body)
+    if magic != SHARD_MAGIC:
+        return None
+    return size, unit_size, data_shards, index
+
+
+def _xor(units, size: int) -> bytes:
+    value = 0
+    for unit in units:
+        value ^= int.from_bytes(unit, 'big')
+    return value.to_bytes(size, 'big')
+
+
+class _RedundantDriver(StorageDriver):
+    """把一个对象写成多个分片文件的本地驱动（分片分布在不同数据卷上）"""
+
+    def __init__(self, volumes, shard_count: int, data_shards: int, unit_size: int, fsync: bool = True):
+        if len(volumes) < shard_count:
+            raise ValueError(f'{self.scheme} 存储需要至少 {shard_count} 个数据卷，只配置了 {len(volumes)} 个')
+        self.volumes = {volume.name: volume for volume in volumes}
+        self.ring = HashRing(volumes)
+        self.shard_count = shard_count
+        self.data_shards = data_shards
+        self.unit_size = unit_size
+        self.fsync = fsync
+
+    def new_location(self) -> str:
+        key = new_blob_key()
+        volumes = self.ring.lookup_distinct(key, self.shard_count)
+        return f"{self.scheme}://{','.join(volume.name for volume in volumes)}/{key}"
+
+    def shard_paths(self, location: str):
+        """各分片的文件路径，所在卷不再配置时为None"""
+        names, _, key = self._key(location).partition('/')
+        paths = []
+        for index, name in enumerate(names.split(',')):
+            volume = self.volumes.get(name)
+            paths.append(
+                os.path.join(volume.path, *key.split('/')) + f'{SHARD_SUFFIX}{index}' if volume else None
+            )
+        return paths
+
+    def encode(self, stripe: bytes):
+        """把一个条带编码为各分片的单元"""
+        raise NotImplementedError
+
+    def decode(self, units, data_shards: int):
+        """由各分片的单元（损坏的为None）还原条带，无法还原时抛出 ShardCorrupted"""
+        raise NotImplementedError
+
+    def write(self, location: str, chunks, size: int = None):
+        """各分片先写入临时文件并fsync，全部写完后再rename"""
+        paths = self.shard_paths(location)
+        stripe_size = self.data_shards * self.unit_size
+        record_size = DIGEST_SIZE + self.unit_size
+
+        files = []
+        try:
+            for index, path in enumerate(paths):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                f = open(path + TEMP_SUFFIX, 'xb')
+                files.append(f)
+                if size is not None:
+                    _preallocate(f.fileno(), HEADER_SIZE + -(-size // stripe_size) * record_size)
+                f.write(_pack_header(0, self.unit_size, self.data_shards, index))
+
+            total = 0
+            buffer = bytearray()
+            for chunk in chunks:
+                total += len(chunk)
+                buffer += chunk
+                while len(buffer) >= stripe_size:
+                    self._write_stripe(files, bytes(buffer[:stripe_size]))
+                    del buffer[:stripe_size]
+            if buffer:
+                self._write_stripe(files, bytes(buffer) + bytes(stripe_size - len(buffer)))
+
+            for index, f in enumerate(files):
+                f.seek(0)
+                f.write(_pack_header(total, self.unit_size, self.data_shards, index))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                f.close()
+            for path in paths:
+                os.replace(path + TEMP_SUFFIX, path)
+        except BaseException:
+            for f in files:
+                f.close()
+                if os.path.exists(f.name):
+                    os.remove(f.name)
+            raise
+
+        if self.fsync:
+            for directory in {os.path.dirname(path) for path in paths}:
+                _fsync_directory(directory)
+
+    def _write_stripe(self, files, stripe: bytes):
+        for f, unit in zip(files, self.encode(stripe)):
+            f.write(hashlib.sha256(unit).digest() + unit)
+
+    def _open_shards(self, location: str):
+        """打开全部可用分片，返回 (文件列表, 分片头)；分片全部不存在时抛出 FileNotFoundError"""
+        handles = []
+        header = None
+        for index, path in enumerate(self.shard_paths(location)):
+            try:
+                f = open(path, 'rb') if path else None
+            except OSError:
+                f = None
+            if f is not None:
+                fields = _read_header(f)
+                if fields is None or fields[3] != index or (header and fields[:3] != header):
+                    f.close()
+                    f = None
+                elif header is None:
+                    header = fields[:3]
+            handles.append(f)
+        if header is None:
+            for f in handles:
+                if f:
+                    f.close()
+            raise FileNotFoundError(location)
+        return handles, header
+
+    def open(self, location: str, chunk_size: int):
+        # 在返回迭代器之前打开分片，不存在时立即抛出 FileNotFoundError
+        handles, header = self._open_shards(location)
+        return self._iter_stripes(location, handles, header, chunk_size)
+
+    def open_checked(self, location: str, chunk_size: int, damaged: set):
+        """与 open 相同，同时把缺失或校验失败的分片序号记入 damaged（供巡检发现已被重建掩盖的损坏）"""
+        handles, header = self._open_shards(location)
+        damaged.update(index for index, f in enumerate(handles) if f is None)
+        return self._iter_stripes(location, handles, header, chunk_size, damaged)
+
+    def _iter_stripes(self, location, handles, header, chunk_size, damaged=None):
+        size, unit_size, data_shards = header
+        stripe_size = data_shards * unit_size
+        try:
+            remaining = size
+            while remaining > 0:
+                units = []
+                for f in handles:
+                    record = f.read(DIGEST_SIZE + unit_size) if f else b''
+                    unit = record[DIGEST_SIZE:]
+                    if len(unit) != unit_size or hashlib.sha256(unit).digest() != record[:DIGEST_SIZE]:
+                        unit = None
+                        if damaged is not None:
+                            damaged.add(len(units))
+                    units.append(unit)
+                try:
+                    stripe = self.decode(units, data_shards)
+                except ShardCorrupted:
+                    raise ShardCorrupted(f'密文已损坏，无法重建: {location}')
+                stripe = stripe[:min(remaining, stripe_size)]
+                remaining -= len(stripe)
+                for i in range(0, len(stripe), chunk_size):
+                    yield stripe[i:i + chunk_size]
+        finally:
+            for f in handles:
+                if f:
+                    f.close()
+
+    def delete(self, location: str):
+        for path in self.shard_paths(location):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def stat(self, location: str):
+        try:
+            handles, header = self._open_shards(location)
+        except FileNotFoundError:
+            return None
+        for f in handles:
+            if f:
+                f.close()
+        return header[0]
+
+
+class ReplicatedDriver(_RedundantDriver):
+    """多副本存储：每个副本是一个完整的分片"""
+
+    scheme = 'replica'
+
+    def __init__(self, volumes, replicas: int = 2, unit_size: int = 64 * 1024, fsync: bool = True):
+        super().__init__(volumes, replicas, 1, unit_size, fsync)
+
+    def encode(self, stripe: bytes):
+        return [stripe] * self.shard_count
+
+    def decode(self, units, data_shards: int):
+        for unit in units:
+            if unit is not None:
+                return unit
+        raise ShardCorrupted()
+
+
+class ParityDriver(_RedundantDriver):
+    """k 个数据分片 + 1 个异或校验分片"""
+
+    scheme = 'parity'
+
+    def __init__(self, volumes, data_shards: int = 4, unit_size: int = 64 * 1024, fsync: bool = True):
+        super().__init__(volumes, data_shards + 1, data_shards, unit_size, fsync)
+
+    def encode(self, stripe: bytes):
+        size = self.unit_size
+        units = [stripe[i * size:(i + 1) * size] for i in range(self.data_shards)]
+        return units + [_xor(units, size)]
+
+    def decode(self, units, data_shards: int):
+        missing = [index for index, unit in enumerate(units) if unit is None]
+        if len(missing) > 1:
+            raise ShardCorrupted()
+        if missing and missing[0] < data_shards:
+            # 缺失的数据单元等于其余单元（含校验单元）的异或
+            units = list(units)
+            units[missing[0]] = _xor([unit for unit in units if unit is not None], len(units[-1]))
+        return b''.join(units[:data_shards])
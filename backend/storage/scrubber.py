@@ -0,0 +1,394 @@
+"""
+存储巡检
+后台逐个读取密文，核对大小、SHA-256 和 Merkle 叶子哈希（冗余存储同时报告已被重建掩盖的损坏分片），
+结果记录在 Blob.verified_at / Blob.scrub_error；同时遍历各数据卷，
+找出没有任何记录引用的文件；默认只报告，开启隔离后移入隔离目录（<卷>/.quarantine/<日期>/），超过保留期后再删除。
+
+- 核对记录与遍历数据卷在两个线程中同时进行，读取密文由 workers 个线程并行完成
+- 所有读取共用一个 I/O 预算（字节/秒），本地文件读取后通知内核丢弃页缓存，不挤占前台请求的缓存
+- 每次运行最长 max_runtime 秒，优先核对最久未核对的密文，大容量数据卷可以分多个夜晚完成一轮
+
+路径按 realpath 比较，与 STORAGE_VOLUMES 写成相对路径、绝对路径或经过符号链接无关。
+只处理修改时间和 inode 变更时间（ctime）都超过 orphan_min_age 的文件：上传刚写入的文件，
+以及迁移、均衡工具刚用硬链接生成、记录尚未提交的新路径（硬链接保留原 mtime，但会更新 ctime）都会跳过。
+移动前重新检查文件状态和引用记录，误判的文件可以从隔离目录移回原处。
+"""
+from flask import current_app
+from sqlalchemy import or_
+from models import Blob, File, db
+from storage.drivers import LocalDriver, TEMP_SUFFIX, get_driver, driver_for
+from storage.manifest import HASH_SIZE, MerkleBuilder, configured_leaf_size
+from storage.redundancy import SHARD_SUFFIX, ShardCorrupted
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import re
+import shutil
+import threading
+import time
+
+# 隔离目录（位于每个数据卷下）
+QUARANTINE_DIR = '.quarantine'
+# 巡检读取的块大小
+READ_SIZE = 1024 * 1024
+# 遍历数据卷时每个目录条目计入的 I/O 预算（字节）
+WALK_ENTRY_COST = 4096
+# 报告中最多列出的孤立文件路径数
+MAX_REPORTED_ORPHANS = 100
+# 冗余存储的分片文件: <key>.s<序号>
+_SHARD_NAME = re.compile(re.escape(SHARD_SUFFIX) + r'\d+$')
+
+# 本进程最近一次巡检的结果
+last_report = None
+
+
+class IOBudget:
+    """限制每秒读取字节数的令牌桶（各线程共享）"""
+
+    def __init__(self, bytes_per_second: int = None):
+        self.rate = bytes_per_second
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, size: int):
+        """登记一次读取，超出预算时等待"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + size / self.rate
+            wait = self._next - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _read_local(path: str, budget: IOBudget):
+    """读取本地文件，读过的范围通知内核丢弃页缓存"""
+    fadvise = getattr(os, 'posix_fadvise', None)
+    with open(path, 'rb') as f:
+        if fadvise:
+            fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        offset = 0
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            budget.consume(len(chunk))
+            if fadvise:
+                fadvise(f.fileno(), offset, len(chunk), os.POSIX_FADV_DONTNEED)
+            offset += len(chunk)
+            yield chunk
+
+
+def _read_driver(chunks, budget: IOBudget):
+    for chunk in chunks:
+        budget.consume(len(chunk))
+        yield chunk
+
+
+class StorageScrubber:
+    """密文巡检与孤立文件隔离"""
+
+    def __init__(self, workers: int = 4, bytes_per_second: int = None, max_runtime: float = None,
+                 verify_hashes: bool = True, quarantine: bool = False,
+                 orphan_min_age: float = 24 * 3600, quarantine_days: int = 7, batch_size: int = 64):
+        """
+        Args:
+            workers: 并行读取密文的线程数
+            bytes_per_second: 读取速率上限，为空表示不限
+            max_runtime: 单次运行的最长时间（秒），为空表示核对全部密文
+            verify_hashes: 为False时只核对大小，不读取密文
+            quarantine: 是否把孤立文件移入隔离目录（默认只报告）
+            orphan_min_age: 只隔离修改时间早于该秒数的文件
+            quarantine_days: 隔离目录的保留天数
+        """
+        self.workers = max(1, workers)
+        self.budget = IOBudget(bytes_per_second)
+        self.max_runtime = max_runtime
+        self.verify_hashes = verify_hashes
+        self.quarantine = quarantine
+        self.orphan_min_age = orphan_min_age
+        self.quarantine_days = quarantine_days
+        self.batch_size = batch_size
+        self._deadline = None
+        self.leaf_size = None
+
+    def _expired(self) -> bool:
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    # ---------- 核对密文 ----------
+
+    def check(self, driver, storage_path: str, size: int, digest: str, leaf_size: int, leaves: bytes):
+        """
+        核对一个密文（在线程池中执行，不访问数据库和应用上下文）
+
+        Returns:
+            tuple: (问题类型, 说明) - 没有问题时问题类型为None
+        """
+        if not self.verify_hashes:
+            actual = driver.stat(storage_path)
+            if actual is None:
+                return 'missing', None
+            return (None, None) if actual == size else ('size', f'{actual} != {size}')
+
+        damaged = set()
+        builder = MerkleBuilder(leaf_size or self.leaf_size)
+        try:
+            if isinstance(driver, LocalDriver):
+                chunks = _read_local(driver._key(storage_path), self.budget)
+            elif hasattr(driver, 'open_checked'):
+                chunks = _read_driver(driver.open_checked(storage_path, READ_SIZE, damaged), self.budget)
+            else:
+                chunks = _read_driver(driver.open(storage_path, READ_SIZE), self.budget)
+            for chunk in chunks:
+                builder.update(chunk)
+        except FileNotFoundError:
+            return 'missing', None
+        except ShardCorrupted as e:
+            return 'corrupt', str(e)
+        except OSError as e:
+            return 'unreadable', str(e)
+
+        if builder.size != size:
+            return 'size', f'{builder.size} != {size}'
+        if leaves is not None and builder.leaves != leaves:
+            stored, actual = leaves, builder.leaves
+            bad = [i // HASH_SIZE for i in range(0, min(len(stored), len(actual)), HASH_SIZE)
+                   if stored[i:i + HASH_SIZE] != actual[i:i + HASH_SIZE]]
+            return 'corrupt', f'叶子 {bad[:16]}'
+        if digest and builder.hexdigest() != digest:
+            return 'corrupt', 'SHA-256 不符'
+        if damaged:
+            return 'degraded', f'分片 {sorted(damaged)}'
+        return None, None
+
+    def verify_batch(self, executor, started: datetime, report: dict) -> int:
+        """核对一批最久未核对的密文，返回本批数量"""
+        rows = db.session.query(
+            Blob.id, Blob.storage_path, Blob.size, Blob.digest, Blob.merkle_leaf_size, Blob.merkle_leaves
+        ).filter(
+            Blob.orphaned_at.is_(None),
+            or_(Blob.verified_at.is_(None), Blob.verified_at < started)
+        ).order_by(Blob.verified_at.nulls_first(), Blob.id).limit(self.batch_size).all()
+        if not rows:
+            return 0
+
+        drivers = [driver_for(row.storage_path) for row in rows]
+        results = executor.map(
+            lambda row, driver: self.check(
+                driver, row.storage_path, row.size, row.digest, row.merkle_leaf_size, row.merkle_leaves
+            ),
+            rows, drivers
+        )
+        now = datetime.now()
+        for row, (error, detail) in zip(rows, results):
+            if error:
+                # 核对期间被清理或迁移的密文不算问题，下一轮按新位置核对
+                current = db.session.query(Blob.storage_path, Blob.orphaned_at).filter(Blob.id == row.id).first()
+                if not current or current.orphaned_at or current.storage_path != row.storage_path:
+                    error = None
+                else:
+                    report[error].append(row.id)
+                    print(f"巡检发现问题 密文{row.id} {row.storage_path}: {error} {detail or ''}")
+            Blob.query.filter(Blob.id == row.id).update(
+                {Blob.verified_at: now, Blob.scrub_error: error}, synchronize_session=False
+            )
+            report['checked'] += 1
+            report['bytes'] += row.size if self.verify_hashes else 0
+        db.session.commit()
+        return len(rows)
+
+    def check_legacy_files(self, report: dict):
+        """没有密文记录的旧文件只核对文件是否存在"""
+        rows = db.session.query(File.id, File.file_path).filter(
+            File.blob_id.is_(None),
+            File.current_version_id.is_(None)
+        ).all()
+        for file_id, file_path in rows:
+            self.budget.consume(WALK_ENTRY_COST)
+            if driver_for(file_path).stat(file_path) is None:
+                report['missing_files'].append(file_id)
+                print(f"巡检发现问题 文件{file_id} {file_path}: missing")
+
+    # ---------- 孤立文件 ----------
+
+    def _skip_dirs(self):
+        pack_folder = current_app.config.get('PACK_FOLDER') or os.path.join(
+            current_app.config['UPLOAD_FOLDER'], 'packs'
+        )
+        return {os.path.realpath(pack_folder)}
+
+    def _walk(self, directory: str, skip: set):
+        """按目录遍历数据卷，返回 (路径, os.stat_result)"""
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            if self._expired():
+                return
+            self.budget.consume(WALK_ENTRY_COST)
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name != QUARANTINE_DIR and os.path.realpath(entry.path) not in skip:
+                    yield from self._walk(entry.path, skip)
+            elif entry.is_file(follow_symlinks=False):
+                try:
+                    yield entry.path, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+    @staticmethod
+    def _redundant_keys() -> set:
+        """冗余存储中被引用的对象键（分片文件名去掉 .s<序号> 后即为对象键）"""
+        keys = set()
+        rows = db.session.query(Blob.storage_path).filter(
+            or_(Blob.storage_path.like('replica://%'), Blob.storage_path.like('parity://%'))
+        ).yield_per(1000)
+        for (location,) in rows:
+            keys.add(location.partition('://')[2].partition('/')[2])
+        return keys
+
+    @staticmethod
+    def _local_realpath(location: str):
+        """本地驱动位置对应的 realpath，其他驱动的位置返回None"""
+        if not location:
+            return None
+        scheme, separator, rest = location.partition('://')
+        if separator:
+            if scheme != LocalDriver.scheme:
+                return None
+            location = rest
+        return os.path.realpath(location)
+
+    @staticmethod
+    def _referenced_paths() -> set:
+        """
+        全部密文记录和文件记录引用的本地路径（realpath）
+
+        遍历开始时读取一次；遍历期间新写入或新链接的文件 mtime/ctime 较新，不会被当作孤立文件。
+        """
+        referenced = set()
+        for column in (Blob.storage_path, File.file_path):
+            for (location,) in db.session.query(column).yield_per(1000):
+                path = StorageScrubber._local_realpath(location)
+                if path:
+                    referenced.add(path)
+        return referenced
+
+    @staticmethod
+    def _still_referenced(path: str) -> bool:
+        """移动前按文件名重新查询引用记录（密文文件名随机且唯一），按 realpath 比较"""
+        name = os.path.basename(path)
+        pattern = '%' + name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        real = os.path.realpath(path)
+        for column in (Blob.storage_path, File.file_path):
+            rows = db.session.query(column).filter(column.like(pattern, escape='\\')).all()
+            if any(StorageScrubber._local_realpath(location) == real for (location,) in rows):
+                return True
+        return False
+
+    def _old_enough(self, stat, cutoff: float) -> bool:
+        return stat.st_mtime <= cutoff and stat.st_ctime <= cutoff
+
+    def _quarantine(self, volume, path: str, report: dict, cutoff: float):
+        try:
+            stat = os.stat(path, follow_symlinks=False)
+        except OSError:
+            return
+        # 遍历之后文件被改写、链接，或已有记录引用它（例如迁移刚提交）时保留
+        if not self._old_enough(stat, cutoff) or self._still_referenced(path):
+            return
+        report['orphans'] += 1
+        if len(report['orphan_paths']) < MAX_REPORTED_ORPHANS:
+            report['orphan_paths'].append(path)
+        if not self.quarantine:
+            return
+        relative = os.path.relpath(path, volume.path)
+        target = os.path.join(volume.path, QUARANTINE_DIR, datetime.now().strftime('%Y%m%d'), relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        report['quarantined'] += 1
+        print(f"巡检隔离孤立文件 {path}")
+
+    def reconcile_volume(self, volume, report: dict, redundant_keys: set, referenced: set):
+        """找出数据卷中没有记录引用的文件（开启隔离时移入隔离目录）"""
+        cutoff = time.time() - self.orphan_min_age
+        skip = self._skip_dirs()
+        for path, stat in self._walk(volume.path, skip):
+            if not self._old_enough(stat, cutoff):
+                continue
+            report['walked'] += 1
+            relative = os.path.relpath(path, volume.path).replace(os.sep, '/')
+            if path.endswith(TEMP_SUFFIX):
+                # 写入中途崩溃留下的临时文件
+                self._quarantine(volume, path, report, cutoff)
+            elif _SHARD_NAME.search(relative):
+                if _SHARD_NAME.sub('', relative) not in redundant_keys:
+                    self._quarantine(volume, path, report, cutoff)
+            elif os.path.realpath(path) not in referenced:
+                self._quarantine(volume, path, report, cutoff)
+
+    def purge_quarantine(self, volume) -> int:
+        """删除超过保留期的隔离目录"""
+        root = os.path.join(volume.path, QUARANTINE_DIR)
+        if not os.path.isdir(root):
+            return 0
+        cutoff = (datetime.now() - timedelta(days=self.quarantine_days)).strftime('%Y%m%d')
+        purged = 0
+        for name in os.listdir(root):
+            if name < cutoff:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+                purged += 1
+        return purged
+
+    def reconcile(self, app, report: dict):
+        """遍历全部本地数据卷（在单独的线程和应用上下文中执行）"""
+        with app.app_context():
+            try:
+                redundant_keys = self._redundant_keys()
+                referenced = self._referenced_paths()
+                for volume in get_driver('local').volumes:
+                    if self._expired():
+                        break
+                    if not os.path.isdir(volume.path):
+                        continue
+                    report['quarantine_purged'] += self.purge_quarantine(volume)
+                    self.reconcile_volume(volume, report, redundant_keys, referenced)
+            except Exception as e:
+                report['errors'].append(f'遍历数据卷失败: {e}')
+            finally:
+                db.session.remove()
+
+    # ---------- 运行 ----------
+
+    def run(self) -> dict:
+        """执行一次巡检，返回统计结果"""
+        global last_report
+        started = datetime.now()
+        self._deadline = time.monotonic() + self.max_runtime if self.max_runtime else None
+        self.leaf_size = configured_leaf_size()
+        report = {
+            'started_at': started.isoformat(), 'checked': 0, 'bytes': 0,
+            'missing': [], 'size': [], 'corrupt': [], 'degraded': [], 'unreadable': [],
+            'missing_files': [], 'walked': 0, 'orphans': 0, 'orphan_paths': [], 'quarantined': 0,
+            'quarantine_purged': 0,
+            'errors': [], 'completed': False
+        }
+
+        walker = threading.Thread(
+            target=self.reconcile, args=(current_app._get_current_object(), report),
+            name='securedisk-scrub-walk', daemon=True
+        )
+        walker.start()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='securedisk-scrub') as executor:
+            while not self._expired():
+                if not self.verify_batch(executor, started, report):
+                    report['completed'] = True
+                    break
+        if report['completed']:
+            self.check_legacy_files(report)
+        walker.join()
+
+        report['finished_at'] = datetime.now().isoformat()
+        last_report = report
+        return report
@@ -0,0 +1,398 @@
+"""
+文件版本与分段存储
+版本化文件的每个版本由按顺序排列的密文分段组成，分段即带 digest 的 Blob 记录；
+新版本中与历史版本相同的分段只增加引用，不重复写入磁盘。
+引用归零的分段与普通密文一样由后台清理任务删除。
+
+分段去重要求客户端对未改动的明文区域产生相同的分段密文
+（例如按分段序号派生IV），服务器只比较密文的SHA-256。
+"""
+from flask import current_app
+from models import Blob, File, FileVersion, db
+from storage.blobs import BlobStore, READ_CHUNK_SIZE
+from storage.drivers import driver_for
+from storage.hotcache import hot_blob_cache, content_key
+from storage.manifest import hash_ciphertext
+from utils.quota import QuotaManager
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import hashlib
+import json
+
+# 版本分段大小
+SEGMENT_SIZE = 1024 * 1024  # 1MB
+
+
+def _read_segment(driver, path: str, chunk_size: int) -> bytes:
+    """读取整个分段（在线程池中执行）"""
+    return b''.join(driver.open(path, chunk_size))
+
+
+def _split(data: bytes, chunk_size: int):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+class VersionStore:
+    """文件版本的创建、读取与保留策略"""
+
+    @staticmethod
+    def adjust_refs(counts: Counter, sign: int):
+        """按引用次数批量调整分段的引用计数（executemany，不提交事务）"""
+        if not counts:
+            return
+        blobs = Blob.__table__
+        stmt = blobs.update().where(blobs.c.id == db.bindparam('b_id')).values(
+            ref_count=blobs.c.ref_count + db.bindparam('b_delta')
+        )
+        db.session.execute(stmt, [
+            {'b_id': blob_id, 'b_delta': sign * n} for blob_id, n in counts.items()
+        ])
+        if sign < 0:
+            Blob.query.filter(Blob.id.in_(list(counts)), Blob.ref_count <= 0).update(
+                {Blob.orphaned_at: datetime.now()}, synchronize_session=False
+            )
+        else:
+            # 重新被引用的分段不能再被后台任务清理
+            Blob.query.filter(
+                Blob.id.in_(list(counts)), Blob.ref_count > 0, Blob.orphaned_at.isnot(None)
+            ).update({Blob.orphaned_at: None}, synchronize_session=False)
+
+    @staticmethod
+    def ensure_initial_version(file_record: File) -> FileVersion:
+        """
+        获取文件的当前版本，未版本化的文件先把现有密文登记为第1版
+
+        现有密文整体作为第1版的唯一分段，文件对它的引用转移给该版本，不复制数据。
+        版本化文件的内容只由版本分段决定，file_path 随之清空，避免留下过时的位置。
+        """
+        if file_record.current_version_id:
+            return db.session.get(FileVersion, file_record.current_version_id)
+
+        blob = BlobStore.ensure(file_record)
+        version = FileVersion(
+            file_id=file_record.id,
+            version=file_record.version or 1,
+            size=file_record.file_size,
+            content_hash=file_record.content_hash,
+            segments=json.dumps([blob.id]),
+            encrypted_file_key=file_record.encrypted_file_key,
+            key_epoch=file_record.key_epoch,
+            created_by=file_record.owner_id,
+            created_at=file_record.created_at
+        )
+        db.session.add(version)
+        db.session.flush()
+
+        file_record.blob_id = None
+        file_record.file_path = ''
+        file_record.current_version_id = version.id
+        file_record.version = version.version
+        return version
+
+    @staticmethod
+    def clear_stale_paths() -> int:
+        """清空旧版本遗留在版本化文件上的 file_path（升级数据库时执行，不提交事务）"""
+        return File.query.filter(
+            File.current_version_id.isnot(None), File.file_path != ''
+        ).update({File.file_path: ''}, synchronize_session=False)
+
+    @staticmethod
+    def segments_hash(digests):
+        """由各分段的SHA-256得到的内容哈希（增量上传时服务器没有完整密文），有分段缺少哈希时返回None"""
+        digests = list(digests)
+        if None in digests:
+            return None
+        return hashlib.sha256(('segments:' + ','.join(digests)).encode('ascii')).hexdigest()
+
+    @staticmethod
+    def reusable_segments(file_id: int) -> dict:
+        """该文件所有历史版本中可复用的分段 {digest: blob_id}（不含等待清理的分段）"""
+        blob_ids = set()
+        for (segments,) in db.session.query(FileVersion.segments).filter(FileVersion.file_id == file_id):
+            blob_ids.update(json.loads(segments))
+        if not blob_ids:
+            return {}
+        rows = db.session.query(Blob.digest, Blob.id).filter(
+            Blob.id.in_(blob_ids),
+            Blob.digest.isnot(None),
+            Blob.orphaned_at.is_(None)
+        ).all()
+        return dict(rows)
+
+    @staticmethod
+    def store_segments(data: bytes, reusable: dict, segment_size: int = None):
+        """
+        切分密文并写入缺少的分段（不提交事务）
+
+        Args:
+            reusable: 可复用的分段 {digest: blob_id}，本次新写入的分段也会加入其中
+
+        Returns:
+            tuple: (按顺序排列的分段ID, 新写入的存储路径)
+        """
+        segment_size = segment_size or current_app.config.get('VERSION_SEGMENT_SIZE', SEGMENT_SIZE)
+        segment_ids = []
+        written = []
+        reused = Counter()
+        try:
+            for offset in range(0, len(data), segment_size):
+                segment = data[offset:offset + segment_size]
+                manifest = hash_ciphertext(segment)
+                digest = manifest.hexdigest()
+                blob_id = reusable.get(digest)
+                if blob_id:
+                    reused[blob_id] += 1
+                else:
+                    path = BlobStore.write_data(segment)
+                    written.append(path)
+                    blob = BlobStore.create(path, len(segment), manifest=manifest)
+                    db.session.flush()
+                    blob_id = reusable[digest] = blob.id
+                segment_ids.append(blob_id)
+        except Exception:
+            for path in written:
+                BlobStore.remove_data(path)
+            raise
+
+        VersionStore.adjust_refs(reused, 1)
+        return segment_ids, written
+
+    @staticmethod
+    def add_version(file_record: File, segment_ids: list, size: int, content_hash: str,
+                    encrypted_file_key: str, key_epoch: int, user_id: int) -> FileVersion:
+        """
+        登记新版本并设为当前版本（不提交事务）
+
+        Raises:
+            QuotaExceeded: 新版本变大后超出所在空间的配额
+        """
+        QuotaManager.charge(file_record.owner_id, file_record.group_id, size - (file_record.file_size or 0))
+        next_version = (db.session.query(db.func.max(FileVersion.version)).filter(
+            FileVersion.file_id == file_record.id
+        ).scalar() or 0) + 1
+        version = FileVersion(
+            file_id=file_record.id,
+            version=next_version,
+            size=size,
+            content_hash=content_hash,
+            segments=json.dumps(segment_ids),
+            encrypted_file_key=encrypted_file_key,
+            key_epoch=key_epoch,
+            created_by=user_id
+        )
+        db.session.add(version)
+        db.session.flush()
+
+        file_record.current_version_id = version.id
+        file_record.file_path = ''
+        file_record.version = next_version
+        file_record.file_size = size
+        file_record.content_hash = content_hash
+        file_record.encrypted_file_key = encrypted_file_key
+        file_record.key_epoch = key_epoch
+        file_record.updated_at = datetime.now()
+        VersionStore.apply_retention(file_record)
+        return version
+
+    @staticmethod
+    def create_version(file_record: File, layer1_data: bytes, encrypted_file_key: str,
+                       key_epoch: int, user_id: int):
+        """
+        为文件创建新版本（不提交事务）
+
+        Returns:
+            tuple: (新版本, 新写入的存储路径) - 事务失败时调用方负责删除这些路径
+        """
+        VersionStore.ensure_initial_version(file_record)
+        reusable = VersionStore.reusable_segments(file_record.id)
+        segment_ids, written = VersionStore.store_segments(layer1_data, reusable)
+        try:
+            version = VersionStore.add_version(
+                file_record, segment_ids, len(layer1_data), hashlib.sha256(layer1_data).hexdigest(),
+                encrypted_file_key, key_epoch, user_id
+            )
+        except Exception:
+            for path in written:
+                BlobStore.remove_data(path)
+            raise
+        return version, written
+
+    @staticmethod
+    def commit_staged(file_record: File, segment_ids: list, staged_ids: set,
+                      encrypted_file_key: str, key_epoch: int, user_id: int) -> FileVersion:
+        """
+        用已在服务器上的分段生成新版本（增量上传提交，不提交事务）
+
+        Args:
+            segment_ids: 按顺序排列的分段ID
+            staged_ids: 上传会话持有引用的分段ID，会话的引用直接转移给新版本
+        """
+        counts = Counter(segment_ids)
+        counts.subtract(staged_ids)
+        VersionStore.adjust_refs(+counts, 1)
+
+        rows = db.session.query(Blob.id, Blob.size, Blob.digest).filter(Blob.id.in_(set(segment_ids))).all()
+        sizes = {blob_id: size for blob_id, size, _ in rows}
+        digests = {blob_id: digest for blob_id, _, digest in rows}
+        return VersionStore.add_version(
+            file_record, segment_ids, sum(sizes[i] for i in segment_ids),
+            VersionStore.segments_hash(digests[i] for i in segment_ids),
+            encrypted_file_key, key_epoch, user_id
+        )
+
+    @staticmethod
+    def restore_version(file_record: File, version: FileVersion, user_id: int) -> FileVersion:
+        """以历史版本的内容创建新的当前版本，只增加分段引用（不提交事务）"""
+        segment_ids = version.segment_ids()
+        VersionStore.adjust_refs(Counter(segment_ids), 1)
+        return VersionStore.add_version(
+            file_record, segment_ids, version.size, version.content_hash,
+            version.encrypted_file_key, version.key_epoch, user_id
+        )
+
+    @staticmethod
+    def rewrap_keys(file_record: File, encrypted_file_key: str, key_epoch: int, version_keys: dict = None) -> list:
+        """
+        文件换用新的空间密钥时同时更新各版本的加密文件密钥（跨空间移动，不提交事务）
+
+        与文件当前封装结果相同的版本（同一文件密钥）直接使用新的封装结果，
+        其余版本须在 version_keys {版本号: 加密文件密钥} 中提供。
+
+        Returns:
+            list: 缺少新封装结果的版本号（非空时不做任何修改）
+        """
+        version_keys = version_keys or {}
+        versions = FileVersion.query.filter(FileVersion.file_id == file_record.id).all()
+        missing = sorted(
+            v.version for v in versions
+            if v.id != file_record.current_version_id
+            and v.encrypted_file_key != file_record.encrypted_file_key and v.version not in version_keys
+        )
+        if missing:
+            return missing
+
+        for version in versions:
+            if version.id == file_record.current_version_id:
+                version.encrypted_file_key = encrypted_file_key
+            else:
+                version.encrypted_file_key = version_keys.get(version.version, encrypted_file_key)
+            version.key_epoch = key_epoch
+        file_record.encrypted_file_key = encrypted_file_key
+        file_record.key_epoch = key_epoch
+        return []
+
+    @staticmethod
+    def copy_current(source: File, target: File, user_id: int) -> FileVersion:
+        """让新文件记录以源文件当前版本的分段作为第1版（不提交事务）"""
+        current = db.session.get(FileVersion, source.current_version_id)
+        segment_ids = current.segment_ids()
+        VersionStore.adjust_refs(Counter(segment_ids), 1)
+        db.session.flush()
+        return VersionStore.add_version(
+            target, segment_ids, current.size, current.content_hash,
+            target.encrypted_file_key, target.key_epoch, user_id
+        )
+
+    @staticmethod
+    def release_versions(versions) -> int:
+        """删除一组版本并释放其分段引用（不提交事务）"""
+        if not versions:
+            return 0
+        counts = Counter()
+        for version in versions:
+            counts.update(version.segment_ids())
+            hot_blob_cache.invalidate(content_key(None, version.id))
+        VersionStore.adjust_refs(counts, -1)
+        return FileVersion.query.filter(
+            FileVersion.id.in_([v.id for v in versions])
+        ).delete(synchronize_session=False)
+
+    @staticmethod
+    def release_files(file_ids) -> int:
+        """
+        释放一组文件的全部版本（不提交事务）
+
+        Args:
+            file_ids: File.id 的子查询（select），调用方随后自行删除这些文件记录
+        """
+        versions = FileVersion.query.filter(FileVersion.file_id.in_(file_ids)).all()
+        if not versions:
+            return 0
+        File.query.filter(File.id.in_(file_ids)).update(
+            {File.current_version_id: None}, synchronize_session=False
+        )
+        return VersionStore.release_versions(versions)
+
+    @staticmethod
+    def apply_retention(file_record: File) -> int:
+        """
+        按保留策略删除历史版本（当前版本始终保留，不提交事务）
+
+        保留最近 keep_last 个版本（含当前版本），并删除早于 max_age_days 的历史版本。
+        """
+        keep_last = file_record.version_keep_last or current_app.config.get('VERSION_KEEP_LAST', 10)
+        max_age_days = file_record.version_max_age_days or current_app.config.get('VERSION_MAX_AGE_DAYS')
+
+        history = FileVersion.query.filter(
+            FileVersion.file_id == file_record.id,
+            FileVersion.id != file_record.current_version_id
+        ).order_by(FileVersion.version.desc()).all()
+
+        expired = history[max(keep_last - 1, 0):]
+        if max_age_days:
+            cutoff = datetime.now() - timedelta(days=max_age_days)
+            expired += [v for v in history[:max(keep_last - 1, 0)] if v.created_at < cutoff]
+        return VersionStore.release_versions(expired)
+
+    @staticmethod
+    def iter_version(version: FileVersion, chunk_size: int = READ_CHUNK_SIZE):
+        """
+        按顺序读取某个版本的全部分段
+
+        配置了 VERSION_READ_AHEAD 时后续分段由线程池提前读取，
+        分布在不同数据卷上的分段可以并行读取（最多同时缓存 read_ahead 个分段）。
+        """
+        segment_ids = version.segment_ids()
+        paths = dict(db.session.query(Blob.id, Blob.storage_path).filter(Blob.id.in_(segment_ids)).all())
+        read_ahead = current_app.config.get('VERSION_READ_AHEAD', 0)
+        if read_ahead < 2 or len(segment_ids) < 2:
+            for blob_id in segment_ids:
+                yield from BlobStore.iter_data(paths[blob_id], chunk_size)
+            return
+
+        # 驱动在当前线程中解析（需要应用上下文），工作线程只做读取
+        readers = [(driver_for(paths[blob_id]), paths[blob_id]) for blob_id in segment_ids]
+        with ThreadPoolExecutor(max_workers=read_ahead) as pool:
+            pending = deque()
+            for driver, path in readers:
+                pending.append(pool.submit(_read_segment, driver, path, chunk_size))
+                if len(pending) >= read_ahead:
+                    yield from _split(pending.popleft().result(), chunk_size)
+            while pending:
+                yield from _split(pending.popleft().result(), chunk_size)
+
+    @staticmethod
+    def read_version(version: FileVersion) -> bytes:
+        """读取某个版本的完整密文（热点内容从内存缓存返回）"""
+        return hot_blob_cache.get_or_load(
+            content_key(None, version.id), lambda: b''.join(VersionStore.iter_version(version)), version.size
+        )
+
+    @staticmethod
+    def read_content(file_path: str, current_version_id: int = None, size: int = None) -> bytes:
+        """读取文件当前内容的完整密文（热点内容从内存缓存返回）"""
+        return hot_blob_cache.get_or_load(
+            content_key(file_path, current_version_id),
+            lambda: b''.join(VersionStore.iter_content(file_path, current_version_id)),
+            size
+        )
+
+    @staticmethod
+    def iter_content(file_path: str, current_version_id: int = None, chunk_size: int = READ_CHUNK_SIZE):
+        """读取文件当前内容：版本化文件按分段读取，否则直接读取密文"""
+        if current_version_id:
+            version = db.session.get(FileVersion, current_version_id)
+            return VersionStore.iter_version(version, chunk_size)
+        return BlobStore.iter_data(file_path, chunk_size)
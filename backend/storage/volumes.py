@@ -0,0 +1,90 @@
+"""
+多数据盘（卷）放置
+本地驱动可以配置多个卷，新密文按随机ID在加权一致性哈希环上选择卷，
+各卷的数据量与权重成正比；增加一个卷时只有约 新卷权重/总权重 的密文需要移动。
+
+STORAGE_VOLUMES 格式: "名称=路径:权重,名称=路径:权重"（权重可省略，默认为1），
+也可以直接配置为 [{'name':…, 'path':…, 'weight':…}] 列表；未配置时只有 UPLOAD_FOLDER 一个卷。
+"""
+from bisect import bisect
+import hashlib
+import os
+
+# 每单位权重在哈希环上的虚拟节点数
+VNODES_PER_WEIGHT = 64
+
+
+class Volume:
+    """一个数据卷"""
+
+    def __init__(self, name: str, path: str, weight: float = 1):
+        self.name = name
+        self.path = path
+        self.weight = weight
+
+    def contains(self, path: str) -> bool:
+        """路径是否位于该卷下"""
+        root = os.path.normpath(self.path)
+        return os.path.normpath(path).startswith(root + os.sep)
+
+    def __repr__(self):
+        return f'<Volume {self.name}={self.path}:{self.weight}>'
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """加权一致性哈希环"""
+
+    def __init__(self, volumes, vnodes_per_weight: int = VNODES_PER_WEIGHT):
+        points = []
+        for volume in volumes:
+            for i in range(max(1, int(volume.weight * vnodes_per_weight))):
+                points.append((_hash(f'{volume.name}#{i}'), volume))
+        points.sort(key=lambda point: point[0])
+        self._hashes = [h for h, _ in points]
+        self._volumes = [volume for _, volume in points]
+
+    def lookup(self, key: str) -> Volume:
+        """返回对象键所属的卷（环上顺时针方向的第一个虚拟节点）"""
+        index = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._volumes[index]
+
+    def lookup_distinct(self, key: str, count: int):
+        """返回对象键顺时针方向上的 count 个不同卷（用于分片或副本放置）"""
+        start = bisect(self._hashes, _hash(key))
+        volumes = []
+        for offset in range(len(self._volumes)):
+            volume = self._volumes[(start + offset) % len(self._volumes)]
+            if volume not in volumes:
+                volumes.append(volume)
+                if len(volumes) == count:
+                    return volumes
+        raise ValueError(f'需要 {count} 个数据卷，只配置了 {len(volumes)} 个')
+
+
+def parse_volumes(spec, default_path: str):
+    """解析 STORAGE_VOLUMES 配置，返回 Volume 列表"""
+    if not spec:
+        return [Volume('default', default_path)]
+    if isinstance(spec, str):
+        items = []
+        for entry in filter(None, (part.strip() for part in spec.split(','))):
+            name, _, rest = entry.partition('=')
+            path, _, weight = rest.rpartition(':') if ':' in rest else (rest, '', '')
+            items.append({'name': name, 'path': path, 'weight': weight or 1})
+        spec = items
+
+    volumes = []
+    for item in spec:
+        if not item.get('name') or not item.get('path'):
+            raise ValueError(f'无效的卷配置: {item}')
+        weight = float(item.get('weight', 1))
+        if weight <= 0:
+            raise ValueError(f'卷权重必须大于0: {item}')
+        volumes.append(Volume(item['name'], item['path'], weight))
+    if len({volume.name for volume in volumes}) != len(volumes):
+        raise ValueError('卷名称重复')
+    return volumes
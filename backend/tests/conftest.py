@@ -0,0 +1,132 @@
+"""
+测试公共配置
+使用临时SQLite数据库和内存存储驱动，不需要启动服务或配置数据卷
+"""
+import io
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 在导入应用之前设置，app.py 在导入时读取这些配置
+_database_dir = tempfile.mkdtemp(prefix='securedisk-test-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_database_dir, 'test.db')}"
+os.environ['STORAGE_DRIVER'] = 'memory'
+os.environ['BACKGROUND_WORKER_ENABLED'] = 'false'
+
+from app import app as flask_app
+from models import Session, User, db
+from crypto.aes import AESEncryption
+from storage.hotcache import hot_blob_cache
+from utils.access import membership_cache
+from utils.idempotency import idempotency_cache
+
+# 测试会话的传输层密钥（会话Token中 "." 之后的部分）
+TRANSPORT_KEY = bytes(range(32))
+
+
+@pytest.fixture
+def app(tmp_path):
+    """每个测试使用全新的数据库、驱动实例和进程内缓存，测试中修改的配置在结束后还原"""
+    saved_config = dict(flask_app.config)
+    flask_app.config.update(
+        TESTING=True,
+        SECRET_KEY='test-secret-key',
+        STORAGE_DRIVER='memory',
+        STORAGE_VOLUMES=None,
+        UPLOAD_FOLDER=str(tmp_path / 'uploads'),
+        PACK_FOLDER=None,
+        DOWNLOAD_TRANSPORT_ENCRYPTION=True,
+        DOWNLOAD_ACCEL_REDIRECT=None,
+        UPLOAD_DEDUPE=True,
+    )
+    flask_app.extensions.pop('blob_storage_drivers', None)
+    for cache in (membership_cache, hot_blob_cache, idempotency_cache):
+        cache.clear()
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+    flask_app.config.clear()
+    flask_app.config.update(saved_config)
+    flask_app.extensions.pop('blob_storage_drivers', None)
+
+
+@pytest.fixture
+def local_storage(app, tmp_path):
+    """改用本地驱动（数据写入临时目录）"""
+    app.config['STORAGE_DRIVER'] = 'local'
+    app.extensions.pop('blob_storage_drivers', None)
+    return tmp_path / 'uploads'
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    """创建用户及有效会话，返回 (用户, 请求头)"""
+    def make(username):
+        user = User(username=username, email=f'{username}@example.com', password_hash='x',
+                    encrypted_master_key='{}', public_key='pk')
+        db.session.add(user)
+        db.session.flush()
+        token = f'{username}-token.{TRANSPORT_KEY.hex()}'
+        db.session.add(Session(user_id=user.id, session_token=token, encrypted_session_key='x',
+                               expires_at=datetime.utcnow() + timedelta(hours=1)))
+        db.session.commit()
+        return user, {'X-Session-Token': token}
+    return make
+
+
+@pytest.fixture
+def user(make_user):
+    return make_user('alice')[0]
+
+
+def encrypt_transport(data: bytes) -> bytes:
+    """模拟客户端的传输层加密"""
+    return AESEncryption.encrypt_raw(data, TRANSPORT_KEY)
+
+
+def decrypt_transport(data: bytes) -> bytes:
+    return AESEncryption.decrypt_raw(data, TRANSPORT_KEY)
+
+
+@pytest.fixture
+def upload(client):
+    """通过上传接口上传一段文件层密文，返回响应"""
+    def do_upload(headers, data: bytes, filename: str = 'a.bin', **form):
+        fields = {'file': (io.BytesIO(encrypt_transport(data)), filename), 'encrypted_file_key': 'efk'}
+        fields.update({key: str(value) for key, value in form.items()})
+        return client.post('/api/files/upload', data=fields, headers=headers, content_type='multipart/form-data')
+    return do_upload
+
+
+@pytest.fixture
+def create_group(client):
+    """由 owner_headers 对应的用户创建用户组（members 为初始成员的用户ID），返回组ID"""
+    def create(owner_headers, name='team', members=()):
+        response = client.post('/api/groups/create', headers=owner_headers, json={
+            'name': name,
+            'encrypted_group_key': 'owner-group-key',
+            'members': [{'user_id': member_id, 'encrypted_key': f'key-{member_id}'} for member_id in members]
+        })
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['group']['id']
+    return create
+
+
+@pytest.fixture
+def download(client):
+    """下载文件并解开传输层，返回 (响应, 文件层密文)"""
+    def do_download(headers, file_id):
+        response = client.get(f'/api/files/download/{file_id}', headers=headers)
+        return response, decrypt_transport(response.data) if response.status_code == 200 else None
+    return do_download
@@ -0,0 +1,82 @@
+"""
+文件访问授权与成员关系缓存
+"""
+from datetime import datetime, timedelta
+from models import GroupMember, Session, db
+from utils.access import get_file_for_user, membership_cache
+
+
+def test_owner_and_group_members_can_download(make_user, upload, create_group, download):
+    alice, alice_headers = make_user('alice')
+    bob, bob_headers = make_user('bob')
+    _, eve_headers = make_user('eve')
+    group_id = create_group(alice_headers, members=[bob.id])
+
+    personal = upload(alice_headers, b'personal').get_json()['file']['id']
+    shared = upload(alice_headers, b'shared', group_id=group_id).get_json()['file']['id']
+
+    assert download(alice_headers, personal)[1] == b'personal'
+    assert download(bob_headers, personal)[0].status_code == 403
+    assert download(bob_headers, shared)[1] == b'shared'
+    assert download(eve_headers, shared)[0].status_code == 403
+
+
+def test_get_file_for_user_returns_role(make_user, upload, create_group):
+    alice, alice_headers = make_user('alice')
+    bob, _ = make_user('bob')
+    group_id = create_group(alice_headers, members=[bob.id])
+    file_id = upload(alice_headers, b'x', group_id=group_id).get_json()['file']['id']
+
+    assert get_file_for_user(bob.id, file_id)[1:] == (True, 'member')
+    assert get_file_for_user(alice.id, file_id)[1:] == (True, 'owner')
+    assert get_file_for_user(alice.id, file_id + 1) == (None, False, None)
+
+
+def test_removed_member_loses_write_access_despite_cached_membership(client, make_user, upload, create_group):
+    alice, alice_headers = make_user('alice')
+    bob, bob_headers = make_user('bob')
+    group_id = create_group(alice_headers, members=[bob.id])
+    assert membership_cache.is_member(bob.id, group_id)
+
+    # 模拟其他进程移除成员：本进程的缓存没有失效
+    GroupMember.query.filter_by(user_id=bob.id, group_id=group_id).delete()
+    db.session.commit()
+    assert membership_cache.is_member(bob.id, group_id)
+
+    assert upload(bob_headers, b'late', group_id=group_id).status_code == 403
+    response = client.post('/api/folders', headers=bob_headers, json={'name': 'x', 'group_id': group_id})
+    assert response.status_code == 403
+
+
+def test_non_member_cannot_list_group(client, make_user, create_group):
+    _, alice_headers = make_user('alice')
+    _, eve_headers = make_user('eve')
+    group_id = create_group(alice_headers)
+    assert client.get(f'/api/files/list?group_id={group_id}', headers=eve_headers).status_code == 403
+    assert client.get(f'/api/files/list?group_id={group_id}', headers=alice_headers).status_code == 200
+
+
+def test_missing_or_expired_session_is_rejected(client, make_user):
+    user, headers = make_user('alice')
+    assert client.get('/api/files/list').status_code == 401
+
+    Session.query.filter_by(user_id=user.id).update({Session.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert client.get('/api/files/list', headers=headers).status_code == 401
+
+
+def test_last_activity_writes_are_throttled(client, make_user):
+    user, headers = make_user('alice')
+    session = Session.query.filter_by(user_id=user.id).one()
+    stale = datetime.utcnow() - timedelta(hours=1)
+    session.last_activity = stale
+    db.session.commit()
+
+    client.get('/api/files/list', headers=headers)
+    db.session.refresh(session)
+    first = session.last_activity
+    assert first > stale
+
+    client.get('/api/files/list', headers=headers)
+    db.session.refresh(session)
+    assert session.last_activity == first
@@ -0,0 +1,84 @@
+"""
+多文件归档下载
+"""
+import json
+import struct
+from crypto.aes import AESEncryption
+from storage.archive import ArchiveStream
+from tests.conftest import TRANSPORT_KEY
+
+
+def _read_frames(data: bytes, key: bytes = TRANSPORT_KEY):
+    """按帧解密归档流，返回 [(类型, 内容)]"""
+    frames = []
+    offset = 0
+    while offset < len(data):
+        (length,) = struct.unpack('>I', data[offset:offset + 4])
+        sealed = data[offset + 4:offset + 4 + length]
+        plain = AESEncryption.decrypt_raw(sealed, key, struct.pack('>Q', len(frames)))
+        frames.append((plain[:1], plain[1:]))
+        offset += 4 + length
+    return frames
+
+
+def _entries(frames):
+    """还原为 {路径: 密文}，以及结束帧内容"""
+    files, current = {}, None
+    for frame_type, payload in frames:
+        if frame_type == b'H':
+            current = json.loads(payload)['path']
+            files[current] = b''
+        elif frame_type == b'D':
+            files[current] += payload
+    return files, json.loads(frames[-1][1])
+
+
+def test_stream_frames_are_bound_to_sequence():
+    stream = ArchiveStream(TRANSPORT_KEY, chunk_size=4)
+    chunks = {1: [b'abcd', b'ef'], 2: []}
+    data = b''.join(stream.generate(
+        [{'id': 1, 'path': 'a'}, {'id': 2, 'path': 'b'}, {'id': 3, 'path': 'c'}],
+        lambda entry: iter(chunks[entry['id']]),
+        missing=[9]
+    ))
+    frames = _read_frames(data)
+    assert [frame_type for frame_type, _ in frames] == [b'H', b'D', b'D', b'E', b'H', b'E', b'X', b'Z']
+    assert json.loads(frames[-1][1]) == {'count': 2, 'failed': [3], 'missing': [9]}
+
+
+def test_archive_by_file_ids(client, make_user, upload):
+    _, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    first = upload(headers, b'first', filename='1.txt').get_json()['file']['id']
+    second = upload(headers, b'second', filename='2.txt').get_json()['file']['id']
+    foreign = upload(other_headers, b'foreign').get_json()['file']['id']
+
+    response = client.post('/api/files/archive', headers=headers, json={'file_ids': [first, second, foreign]})
+    assert response.status_code == 200
+    files, finish = _entries(_read_frames(response.data))
+    assert files == {'1.txt': b'first', '2.txt': b'second'}
+    assert finish['missing'] == [foreign]
+
+
+def test_archive_folder_subtree_keeps_relative_paths(client, make_user, upload):
+    _, headers = make_user('alice')
+    root = client.post('/api/folders', headers=headers, json={'name': 'root'}).get_json()['folder']
+    sub = client.post('/api/folders', headers=headers, json={'name': 'sub', 'parent_id': root['id']}).get_json()['folder']
+    sibling = client.post('/api/folders', headers=headers, json={'name': 'other'}).get_json()['folder']
+    upload(headers, b'top', filename='top.txt', folder_id=root['id'])
+    upload(headers, b'deep', filename='deep.txt', folder_id=sub['id'])
+    upload(headers, b'outside', filename='out.txt', folder_id=sibling['id'])
+
+    response = client.post('/api/files/archive', headers=headers, json={'folder_id': root['id']})
+    files, finish = _entries(_read_frames(response.data))
+    assert files == {'top.txt': b'top', 'sub/deep.txt': b'deep'}
+    assert finish['count'] == 2
+
+
+def test_archive_rejects_foreign_or_malformed_folder(client, make_user):
+    _, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    folder = client.post('/api/folders', headers=headers, json={'name': 'root'}).get_json()['folder']
+    assert client.post('/api/files/archive', headers=other_headers, json={'folder_id': folder['id']}).status_code == 403
+    assert client.post('/api/files/archive', headers=headers, json={'folder_id': 'x'}).status_code == 400
+    assert client.post('/api/files/archive', headers=headers, json={}).status_code == 400
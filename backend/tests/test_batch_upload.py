@@ -0,0 +1,62 @@
+"""
+批量上传
+"""
+import io
+import json
+from models import Blob, File, User, db
+from tests.conftest import encrypt_transport
+
+
+def _batch(client, headers, items, **form):
+    """items 为 [(文件名, 文件层密文, manifest项)]"""
+    fields = {
+        'files': [(io.BytesIO(encrypt_transport(data)), name) for name, data, _ in items],
+        'manifest': json.dumps([entry for _, _, entry in items]),
+    }
+    fields.update({key: str(value) for key, value in form.items()})
+    return client.post('/api/files/upload-batch', data=fields, headers=headers, content_type='multipart/form-data')
+
+
+def test_partial_success_reports_per_item(client, make_user):
+    user, headers = make_user('alice')
+    response = _batch(client, headers, [
+        ('a.bin', b'aaa', {'encrypted_file_key': 'k1'}),
+        ('b.bin', b'bb', {}),
+        ('c.bin', b'c', {'encrypted_file_key': 'k3', 'folder_id': 'x'}),
+    ])
+    assert response.status_code == 201
+    statuses = [result['status'] for result in response.get_json()['results']]
+    assert statuses == ['created', 'error', 'error']
+    assert File.query.count() == 1
+    assert db.session.get(User, user.id).used_bytes == 3
+
+
+def test_all_items_failing_writes_nothing(client, make_user):
+    user, headers = make_user('alice')
+    response = _batch(client, headers, [('a.bin', b'aaa', {}), ('b.bin', b'bb', {})])
+    assert response.status_code == 400
+    assert File.query.count() == 0 and Blob.query.count() == 0
+    assert not db.session.get(User, user.id).used_bytes
+
+
+def test_quota_is_checked_before_writing_blobs(client, make_user, local_storage):
+    user, headers = make_user('alice')
+    user.quota_bytes = 5
+    db.session.commit()
+
+    response = _batch(client, headers, [
+        ('a.bin', b'aaa', {'encrypted_file_key': 'k1'}),
+        ('b.bin', b'bbb', {'encrypted_file_key': 'k2'}),
+    ])
+    assert response.status_code == 413
+    assert File.query.count() == 0 and Blob.query.count() == 0
+    assert not any(path.is_file() for path in local_storage.rglob('*'))
+    assert not db.session.get(User, user.id).used_bytes
+
+
+def test_manifest_must_match_files(client, make_user):
+    _, headers = make_user('alice')
+    fields = {'files': [(io.BytesIO(encrypt_transport(b'a')), 'a.bin')], 'manifest': '[]'}
+    response = client.post('/api/files/upload-batch', data=fields, headers=headers,
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
@@ -0,0 +1,73 @@
+"""
+密文引用计数
+"""
+from models import Blob, File, db
+from storage.blobs import BlobStore
+
+
+def _write_blob(data: bytes = b'ciphertext') -> Blob:
+    location = BlobStore.write_data(data)
+    blob = BlobStore.create(location, len(data))
+    db.session.flush()
+    return blob
+
+
+def _add_file(owner, blob, name='a.bin') -> File:
+    file_record = File(filename=name, original_filename=name, file_path=blob.storage_path,
+                       file_size=blob.size, encrypted_file_key='efk', owner_id=owner.id, blob_id=blob.id)
+    db.session.add(file_record)
+    db.session.flush()
+    return file_record
+
+
+def test_release_marks_orphan_only_after_last_reference(user):
+    blob = _write_blob()
+    first = _add_file(user, blob)
+    second = _add_file(user, blob, 'copy.bin')
+    BlobStore.acquire(second)
+    db.session.commit()
+    assert db.session.get(Blob, blob.id).ref_count == 2
+
+    assert BlobStore.release(first) is False
+    db.session.commit()
+    db.session.refresh(blob)
+    assert blob.ref_count == 1 and blob.orphaned_at is None
+
+    assert BlobStore.release(second) is True
+    db.session.commit()
+    db.session.refresh(blob)
+    assert blob.ref_count == 0 and blob.orphaned_at is not None
+
+
+def test_ensure_registers_legacy_file(user):
+    location = BlobStore.write_data(b'legacy')
+    legacy = File(filename='l.bin', original_filename='l.bin', file_path=location, file_size=6,
+                  encrypted_file_key='efk', owner_id=user.id)
+    db.session.add(legacy)
+    db.session.flush()
+
+    blob = BlobStore.ensure(legacy)
+    db.session.commit()
+    assert legacy.blob_id == blob.id
+    assert blob.storage_path == location and blob.ref_count == 1
+    assert BlobStore.ensure(legacy).id == blob.id
+
+
+def test_release_files_counts_shared_references(user):
+    shared = _write_blob(b'shared')
+    single = _write_blob(b'single')
+    files = [_add_file(user, shared, f'{i}.bin') for i in range(3)]
+    for file_record in files[1:]:
+        BlobStore.acquire(file_record)
+    files.append(_add_file(user, single, 'single.bin'))
+    db.session.commit()
+
+    released = [files[0].id, files[1].id, files[3].id]
+    orphaned = BlobStore.release_files(db.session.query(File.id).filter(File.id.in_(released)))
+    db.session.commit()
+
+    assert orphaned == 1
+    db.session.refresh(shared)
+    db.session.refresh(single)
+    assert shared.ref_count == 1 and shared.orphaned_at is None
+    assert single.ref_count == 0 and single.orphaned_at is not None
@@ -0,0 +1,79 @@
+"""
+服务端复制与移动接口
+"""
+from models import Blob, File, db
+
+
+def test_copy_shares_ciphertext(client, make_user, upload, download):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'payload').get_json()['file']['id']
+
+    response = client.post(f'/api/files/{file_id}/copy', headers=headers,
+                           json={'encrypted_file_key': 'efk2', 'filename': 'copy.bin'})
+    assert response.status_code == 201
+    copied = response.get_json()['file']
+    assert copied['original_filename'] == 'copy.bin'
+
+    source, target = db.session.get(File, file_id), db.session.get(File, copied['id'])
+    assert source.blob_id == target.blob_id
+    assert db.session.get(Blob, source.blob_id).ref_count == 2
+    assert download(headers, copied['id'])[1] == b'payload'
+
+
+def test_copy_requires_wrapped_key(client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'payload').get_json()['file']['id']
+    assert client.post(f'/api/files/{file_id}/copy', headers=headers, json={}).status_code == 400
+
+
+def test_copy_of_foreign_file_is_forbidden(client, make_user, upload):
+    _, alice = make_user('alice')
+    _, bob = make_user('bob')
+    file_id = upload(alice, b'private').get_json()['file']['id']
+    response = client.post(f'/api/files/{file_id}/copy', headers=bob, json={'encrypted_file_key': 'k'})
+    assert response.status_code == 403
+
+
+def test_copy_into_group_requires_membership(client, make_user, upload, create_group):
+    _, alice = make_user('alice')
+    _, bob = make_user('bob')
+    group_id = create_group(bob)
+    file_id = upload(alice, b'payload').get_json()['file']['id']
+
+    response = client.post(f'/api/files/{file_id}/copy', headers=alice,
+                           json={'encrypted_file_key': 'k', 'group_id': group_id})
+    assert response.status_code == 403
+
+
+def test_move_into_group_and_back(client, make_user, upload, create_group, download):
+    alice, alice_headers = make_user('alice')
+    bob, bob_headers = make_user('bob')
+    group_id = create_group(alice_headers, members=[bob.id])
+    file_id = upload(alice_headers, b'shared').get_json()['file']['id']
+
+    response = client.post(f'/api/files/{file_id}/move', headers=alice_headers,
+                           json={'encrypted_file_key': 'group-wrapped', 'group_id': group_id})
+    assert response.status_code == 200
+    moved = response.get_json()['file']
+    assert moved['group_id'] == group_id
+    assert download(bob_headers, file_id)[1] == b'shared'
+
+    # 普通成员不能移动他人的文件
+    response = client.post(f'/api/files/{file_id}/move', headers=bob_headers,
+                           json={'encrypted_file_key': 'bob-wrapped'})
+    assert response.status_code == 403
+
+    response = client.post(f'/api/files/{file_id}/move', headers=alice_headers,
+                           json={'encrypted_file_key': 'personal-wrapped'})
+    assert response.status_code == 200
+    assert response.get_json()['file']['group_id'] is None
+    assert download(bob_headers, file_id)[0].status_code == 403
+
+
+def test_cross_space_move_requires_wrapped_key(client, make_user, upload, create_group):
+    _, headers = make_user('alice')
+    group_id = create_group(headers)
+    file_id = upload(headers, b'payload').get_json()['file']['id']
+    response = client.post(f'/api/files/{file_id}/move', headers=headers, json={'group_id': group_id})
+    assert response.status_code == 400
+    assert db.session.get(File, file_id).group_id is None
@@ -0,0 +1,108 @@
+"""
+增量上传会话
+"""
+import hashlib
+from datetime import datetime, timedelta
+from models import Blob, DeltaUpload, db
+from storage import DeltaUploadPurger
+from tests.conftest import encrypt_transport
+
+SEGMENT = 4
+
+
+def _manifest(*segments):
+    return [{'digest': hashlib.sha256(s).hexdigest(), 'size': len(s)} for s in segments]
+
+
+def _start(client, headers, file_id, *segments):
+    response = client.post(f'/api/files/{file_id}/delta', headers=headers,
+                           json={'segments': _manifest(*segments), 'encrypted_file_key': 'efk2'})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
+
+
+def _put(client, headers, upload_id, segment, digest=None):
+    digest = digest or hashlib.sha256(segment).hexdigest()
+    return client.put(f'/api/files/delta/{upload_id}/segments/{digest}', headers=headers,
+                      data=encrypt_transport(segment))
+
+
+def _versioned_file(app, client, headers, upload):
+    """上传文件并通过一次增量上传使其按分段存储"""
+    app.config['VERSION_SEGMENT_SIZE'] = SEGMENT
+    file_id = upload(headers, b'aaaabbbb').get_json()['file']['id']
+    session = _start(client, headers, file_id, b'aaaa', b'bbbb')
+    for segment in (b'aaaa', b'bbbb'):
+        _put(client, headers, session['upload']['id'], segment)
+    assert client.post(f"/api/files/delta/{session['upload']['id']}/commit", headers=headers).status_code == 201
+    return file_id
+
+
+def test_only_missing_segments_are_uploaded(app, client, make_user, upload, download):
+    _, headers = make_user('alice')
+    file_id = _versioned_file(app, client, headers, upload)
+
+    session = _start(client, headers, file_id, b'aaaa', b'cccc')
+    assert session['missing'] == [hashlib.sha256(b'cccc').hexdigest()] and session['reused'] == 1
+    upload_id = session['upload']['id']
+
+    response = client.post(f'/api/files/delta/{upload_id}/commit', headers=headers)
+    assert response.status_code == 409 and response.get_json()['missing'] == session['missing']
+
+    assert _put(client, headers, upload_id, b'cccc').status_code == 201
+    assert _put(client, headers, upload_id, b'cccc').get_json()['status'] == 'exists'
+    response = client.post(f'/api/files/delta/{upload_id}/commit', headers=headers)
+    assert response.status_code == 201 and response.get_json()['uploaded_segments'] == 1
+    assert download(headers, file_id)[1] == b'aaaacccc'
+
+
+def test_segments_are_verified_against_manifest(app, client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = _versioned_file(app, client, headers, upload)
+    upload_id = _start(client, headers, file_id, b'dddd')['upload']['id']
+
+    assert _put(client, headers, upload_id, b'eeee').status_code == 400
+    assert _put(client, headers, upload_id, b'eeee', hashlib.sha256(b'dddd').hexdigest()).status_code == 400
+    assert client.post(f'/api/files/{file_id}/delta', headers=headers,
+                       json={'segments': [{'digest': 'x', 'size': 1}], 'encrypted_file_key': 'k'}).status_code == 400
+
+
+def test_commit_conflicts_when_base_version_changed(app, client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = _versioned_file(app, client, headers, upload)
+    first = _start(client, headers, file_id, b'aaaa')['upload']['id']
+    second = _start(client, headers, file_id, b'bbbb')['upload']['id']
+
+    assert client.post(f'/api/files/delta/{first}/commit', headers=headers).status_code == 201
+    response = client.post(f'/api/files/delta/{second}/commit', headers=headers)
+    assert response.status_code == 409
+    assert client.post(f'/api/files/delta/{second}/commit', headers=headers).status_code == 410
+
+
+def test_sessions_belong_to_their_user(app, client, make_user, upload):
+    _, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    file_id = _versioned_file(app, client, headers, upload)
+    upload_id = _start(client, headers, file_id, b'ffff')['upload']['id']
+
+    assert _put(client, other_headers, upload_id, b'ffff').status_code == 404
+    assert client.post(f'/api/files/{file_id}/delta', headers=other_headers,
+                       json={'segments': _manifest(b'ffff'), 'encrypted_file_key': 'k'}).status_code == 403
+
+
+def test_abort_and_expiry_release_uploaded_segments(app, client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = _versioned_file(app, client, headers, upload)
+
+    aborted = _start(client, headers, file_id, b'gggg')['upload']['id']
+    _put(client, headers, aborted, b'gggg')
+    assert client.delete(f'/api/files/delta/{aborted}', headers=headers).status_code == 200
+    assert Blob.query.filter(Blob.orphaned_at.isnot(None)).count() == 1
+
+    expired = _start(client, headers, file_id, b'hhhh')['upload']['id']
+    _put(client, headers, expired, b'hhhh')
+    DeltaUpload.query.filter_by(id=expired).update({DeltaUpload.expires_at: datetime.now() - timedelta(seconds=1)})
+    db.session.commit()
+    assert DeltaUploadPurger.expire_batch() == 1
+    assert db.session.get(DeltaUpload, expired).status == 'expired'
+    assert Blob.query.filter(Blob.orphaned_at.isnot(None)).count() == 2
@@ -0,0 +1,53 @@
+"""
+关闭传输层加密时的直接下载
+"""
+import os
+from models import File, db
+
+
+def _direct(app):
+    app.config['DOWNLOAD_TRANSPORT_ENCRYPTION'] = False
+
+
+def test_local_blob_is_sent_as_file(app, local_storage, client, make_user, upload):
+    _direct(app)
+    app.config['PACK_SMALL_BLOBS'] = False
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'ciphertext').get_json()['file']['id']
+
+    response = client.get(f'/api/files/download/{file_id}', headers=headers)
+    assert response.status_code == 200
+    assert response.data == b'ciphertext'
+    assert response.headers['X-Transport-Encryption'] == 'none'
+    assert response.headers['X-Encrypted-File-Key'] == 'efk'
+
+
+def test_accel_redirect_hands_off_to_proxy(app, local_storage, client, make_user, upload):
+    _direct(app)
+    app.config.update(PACK_SMALL_BLOBS=False, DOWNLOAD_ACCEL_REDIRECT='/_protected/')
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'ciphertext').get_json()['file']['id']
+    location = db.session.get(File, file_id).blob.storage_path
+
+    response = client.get(f'/api/files/download/{file_id}', headers=headers)
+    assert response.status_code == 200 and response.data == b''
+    relative = os.path.relpath(location, local_storage).replace(os.sep, '/')
+    assert response.headers['X-Accel-Redirect'] == f'/_protected/default/{relative}'
+
+
+def test_non_local_blob_is_streamed(app, client, make_user, upload):
+    _direct(app)
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'streamed').get_json()['file']['id']
+    response = client.get(f'/api/files/download/{file_id}', headers=headers)
+    assert response.status_code == 200 and response.data == b'streamed'
+    assert 'X-Accel-Redirect' not in response.headers
+
+
+def test_missing_local_data_is_an_error(app, local_storage, client, make_user, upload):
+    _direct(app)
+    app.config['PACK_SMALL_BLOBS'] = False
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'gone').get_json()['file']['id']
+    os.remove(db.session.get(File, file_id).blob.storage_path)
+    assert client.get(f'/api/files/download/{file_id}', headers=headers).status_code == 404
@@ -0,0 +1,67 @@
+"""
+存储驱动
+"""
+import os
+import pytest
+from storage.blobs import BlobStore
+from storage.drivers import LocalDriver, MemoryDriver, driver_for, get_driver
+from storage.volumes import parse_volumes
+
+
+def test_write_data_uses_memory_driver(app):
+    location = BlobStore.write_data(b'hello')
+    assert location.startswith('memory://')
+    assert b''.join(BlobStore.iter_data(location)) == b'hello'
+    assert BlobStore.stat_data(location) == 5
+
+
+def test_memory_driver_roundtrip():
+    driver = MemoryDriver()
+    location = driver.new_location()
+    driver.write(location, [b'ab', b'cde'])
+    assert list(driver.open(location, 2)) == [b'ab', b'cd', b'e']
+    driver.copy(location, 'memory://copy')
+    driver.delete(location)
+    assert driver.stat(location) is None and driver.stat('memory://copy') == 5
+    with pytest.raises(FileNotFoundError):
+        driver.open(location, 2)
+
+
+def test_local_driver_writes_atomically_and_links_copies(tmp_path):
+    driver = LocalDriver(parse_volumes(None, str(tmp_path)), fsync=False)
+    location = driver.new_location()
+    assert BlobStore.is_sharded(location) and location.startswith(str(tmp_path))
+    driver.write(location, [b'0123', b'456'], size=7)
+    assert b''.join(driver.open(location, 3)) == b'0123456'
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith('.tmp')]
+
+    copy = driver.new_location()
+    driver.copy(location, copy)
+    assert os.path.samefile(location, copy)
+    driver.delete(location)
+    driver.delete(location)
+    assert driver.stat(location) is None and driver.stat(copy) == 7
+
+
+def test_failed_write_leaves_no_partial_object(tmp_path):
+    driver = LocalDriver(parse_volumes(None, str(tmp_path)), fsync=False)
+    location = driver.new_location()
+
+    def chunks():
+        yield b'partial'
+        raise RuntimeError('中断')
+
+    with pytest.raises(RuntimeError):
+        driver.write(location, chunks())
+    assert driver.stat(location) is None
+    assert not os.path.exists(location + '.tmp')
+
+
+def test_driver_for_selects_by_scheme(app, local_storage):
+    assert isinstance(driver_for('memory://ab/cd/x.blob'), MemoryDriver)
+    assert driver_for('/some/legacy/path.enc') is get_driver('local')
+    # 未知的 scheme 按本地路径处理
+    assert driver_for('file://x') is get_driver('local')
+    assert get_driver() is get_driver('local')
+    with pytest.raises(ValueError):
+        get_driver('nope')
@@ -0,0 +1,62 @@
+"""
+下载响应的ETag与条件请求（304）
+"""
+import hashlib
+from tests.test_versions import _new_version
+
+
+def _upload(make_user, upload, data=b'ciphertext'):
+    _, headers = make_user('alice')
+    return headers, upload(headers, data).get_json()['file']['id']
+
+
+def test_session_download_gets_weak_etag_and_no_store(client, make_user, upload, download):
+    headers, file_id = _upload(make_user, upload)
+    response, layer1 = download(headers, file_id)
+    assert layer1 == b'ciphertext'
+    assert response.headers['ETag'].startswith('W/"')
+    assert response.headers['Cache-Control'] == 'private, no-store'
+    assert response.headers['Vary'] == 'X-Session-Token'
+
+
+def test_direct_download_gets_strong_content_etag(app, client, make_user, upload):
+    app.config['DOWNLOAD_TRANSPORT_ENCRYPTION'] = False
+    headers, file_id = _upload(make_user, upload)
+    response = client.get(f'/api/files/download/{file_id}', headers=headers)
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+    assert hashlib.sha256(b'ciphertext').hexdigest() in etag
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+
+def test_matching_etag_returns_304_with_file_headers(app, client, make_user, upload):
+    app.config['DOWNLOAD_TRANSPORT_ENCRYPTION'] = False
+    headers, file_id = _upload(make_user, upload)
+    etag = client.get(f'/api/files/download/{file_id}', headers=headers).headers['ETag']
+
+    response = client.get(f'/api/files/download/{file_id}', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == etag
+    assert response.headers['X-Encrypted-File-Key'] == 'efk'
+    assert response.headers['X-File-Version'] == '1'
+
+
+def test_weak_etag_revalidates_session_download(client, make_user, upload, download):
+    headers, file_id = _upload(make_user, upload)
+    etag = download(headers, file_id)[0].headers['ETag']
+    response = client.get(f'/api/files/download/{file_id}', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['Cache-Control'] == 'private, no-store'
+
+
+def test_new_version_changes_etag(app, client, make_user, upload):
+    app.config['DOWNLOAD_TRANSPORT_ENCRYPTION'] = False
+    headers, file_id = _upload(make_user, upload)
+    etag = client.get(f'/api/files/download/{file_id}', headers=headers).headers['ETag']
+    _new_version(client, headers, file_id, b'changed')
+
+    response = client.get(f'/api/files/download/{file_id}', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200 and response.data == b'changed'
+    assert response.headers['ETag'] != etag
+    old = client.get(f'/api/files/{file_id}/versions/1/download', headers={**headers, 'If-None-Match': etag})
+    assert old.status_code == 304
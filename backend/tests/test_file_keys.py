@@ -0,0 +1,38 @@
+"""
+批量获取加密文件密钥
+"""
+
+
+def test_returns_keys_for_accessible_files(client, make_user, create_group, upload):
+    _, alice_headers = make_user('alice')
+    bob, bob_headers = make_user('bob')
+    group_id = create_group(alice_headers, members=[bob.id])
+    own = upload(alice_headers, b'own').get_json()['file']['id']
+    shared = upload(alice_headers, b'shared', group_id=group_id).get_json()['file']['id']
+    private = upload(bob_headers, b'private').get_json()['file']['id']
+
+    response = client.post('/api/files/keys', headers=alice_headers,
+                           json={'file_ids': [own, shared, shared, private, 9999]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert sorted(item['id'] for item in body['files']) == sorted([own, shared])
+    assert {item['group_id'] for item in body['files']} == {None, group_id}
+    assert all(item['encrypted_file_key'] == 'efk' and item['key_epoch'] == 1 for item in body['files'])
+    # 他人的私有文件和不存在的文件同样列为 missing
+    assert body['missing'] == [private, 9999]
+
+
+def test_rejects_malformed_or_oversized_requests(client, make_user):
+    _, headers = make_user('alice')
+    assert client.post('/api/files/keys', headers=headers, json={}).status_code == 400
+    assert client.post('/api/files/keys', headers=headers, json={'file_ids': 'abc'}).status_code == 400
+    assert client.post('/api/files/keys', headers=headers, json={'file_ids': ['x']}).status_code == 400
+    response = client.post('/api/files/keys', headers=headers, json={'file_ids': list(range(1, 502))})
+    assert response.status_code == 400
+    assert client.post('/api/files/keys', json={'file_ids': [1]}).status_code == 401
+
+
+def test_empty_list_returns_nothing(client, make_user):
+    _, headers = make_user('alice')
+    response = client.post('/api/files/keys', headers=headers, json={'file_ids': []})
+    assert response.get_json() == {'files': [], 'missing': []}
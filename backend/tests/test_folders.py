@@ -0,0 +1,99 @@
+"""
+文件夹（物化路径）及目标空间参数校验
+"""
+from models import File, Folder, db
+
+
+def _mkdir(client, headers, name, parent_id=None, **fields):
+    response = client.post('/api/folders', headers=headers, json=dict(name=name, parent_id=parent_id, **fields))
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['folder']
+
+
+def test_paths_and_subtree_stats(client, make_user, upload):
+    _, headers = make_user('alice')
+    root = _mkdir(client, headers, 'docs')
+    child = _mkdir(client, headers, 'a', root['id'])
+    grandchild = _mkdir(client, headers, 'b', child['id'])
+    assert grandchild['path'] == f"/{root['id']}/{child['id']}/{grandchild['id']}/"
+
+    upload(headers, b'12345', folder_id=child['id'])
+    upload(headers, b'123', folder_id=grandchild['id'])
+    upload(headers, b'outside')
+
+    stats = client.get(f"/api/folders/{root['id']}/stats", headers=headers).get_json()
+    assert (stats['folder_count'], stats['file_count']) == (2, 2)
+
+
+def test_move_subtree_rewrites_paths(client, make_user):
+    _, headers = make_user('alice')
+    first = _mkdir(client, headers, 'first')
+    second = _mkdir(client, headers, 'second')
+    child = _mkdir(client, headers, 'child', first['id'])
+    leaf = _mkdir(client, headers, 'leaf', child['id'])
+
+    response = client.put(f"/api/folders/{child['id']}", headers=headers, json={'parent_id': second['id']})
+    assert response.status_code == 200
+    assert db.session.get(Folder, leaf['id']).path == f"/{second['id']}/{child['id']}/{leaf['id']}/"
+
+    # 不能移动到自身的子树中
+    response = client.put(f"/api/folders/{second['id']}", headers=headers, json={'parent_id': leaf['id']})
+    assert response.status_code == 400
+    assert client.put(f"/api/folders/{second['id']}", headers=headers, json={'parent_id': 'x'}).status_code == 400
+
+
+def test_delete_subtree_moves_files_to_trash(client, make_user, upload):
+    _, headers = make_user('alice')
+    root = _mkdir(client, headers, 'root')
+    child = _mkdir(client, headers, 'child', root['id'])
+    file_id = upload(headers, b'data', folder_id=child['id']).get_json()['file']['id']
+
+    response = client.delete(f"/api/folders/{root['id']}", headers=headers)
+    assert response.get_json()['deleted_files'] == 1
+    assert Folder.query.count() == 0
+    record = db.session.get(File, file_id)
+    assert record.deleted_at is not None and record.folder_id is None
+
+
+def test_folders_are_scoped_to_their_space(client, make_user, create_group, upload):
+    _, alice_headers = make_user('alice')
+    _, bob_headers = make_user('bob')
+    group_id = create_group(alice_headers)
+    personal = _mkdir(client, alice_headers, 'mine')
+
+    # 个人文件夹不能作为组内上传的目标，也不对他人开放
+    assert upload(alice_headers, b'x', group_id=group_id, folder_id=personal['id']).status_code == 400
+    assert upload(bob_headers, b'x', folder_id=personal['id']).status_code == 403
+    assert client.post('/api/folders', headers=bob_headers,
+                       json={'name': 'sub', 'parent_id': personal['id']}).status_code == 403
+
+
+def test_malformed_ids_are_rejected(client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'data').get_json()['file']['id']
+
+    assert upload(headers, b'x', group_id='abc').status_code == 400
+    assert upload(headers, b'x', folder_id='-1').status_code == 400
+    assert client.post('/api/folders', headers=headers, json={'name': 'n', 'group_id': 'abc'}).status_code == 400
+    assert client.post(f'/api/files/{file_id}/copy', headers=headers,
+                       json={'encrypted_file_key': 'k', 'group_id': 'abc'}).status_code == 400
+
+
+def test_failed_move_leaves_file_untouched(client, make_user, create_group, upload):
+    _, headers = make_user('alice')
+    group_id = create_group(headers)
+    folder = _mkdir(client, headers, 'g', group_id=group_id)
+    file_id = upload(headers, b'data').get_json()['file']['id']
+
+    # 跨空间移动缺少重新封装的密钥：不得修改文件夹
+    response = client.post(f'/api/files/{file_id}/move', headers=headers,
+                           json={'group_id': group_id, 'folder_id': folder['id']})
+    assert response.status_code == 400
+    response = client.post(f'/api/files/{file_id}/move', headers=headers, json={
+        'group_id': group_id, 'folder_id': folder['id'], 'encrypted_file_key': 'k',
+        'version_keys': [{'version': 'x', 'encrypted_file_key': 'k'}]
+    })
+    assert response.status_code == 400
+    db.session.expire_all()
+    record = db.session.get(File, file_id)
+    assert (record.group_id, record.folder_id) == (None, None)
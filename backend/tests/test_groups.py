@@ -0,0 +1,87 @@
+"""
+用户组创建与批量审批加入申请
+"""
+from models import GroupJoinRequest, GroupMember, GroupSharedKey, UserGroup, db
+
+
+def test_create_group_with_initial_members(client, make_user):
+    _, alice_headers = make_user('alice')
+    bob, _ = make_user('bob')
+    response = client.post('/api/groups/create', headers=alice_headers, json={
+        'name': 'team', 'encrypted_group_key': 'k0',
+        'members': [{'user_id': bob.id, 'encrypted_key': 'k-bob'}]
+    })
+    assert response.status_code == 201
+    group_id = response.get_json()['group']['id']
+    assert GroupMember.query.filter_by(group_id=group_id).count() == 2
+    assert GroupSharedKey.query.filter_by(group_id=group_id, user_id=bob.id).one().encrypted_key == 'k-bob'
+
+
+def test_create_group_rejects_unknown_members(client, make_user):
+    _, headers = make_user('alice')
+    response = client.post('/api/groups/create', headers=headers, json={
+        'name': 'team', 'encrypted_group_key': 'k0',
+        'members': [{'user_id': 999, 'encrypted_key': 'k'}]
+    })
+    assert response.status_code == 400
+    assert response.get_json()['user_ids'] == [999]
+    assert UserGroup.query.count() == 0
+
+
+def test_create_group_rejects_malformed_member_ids(client, make_user):
+    _, headers = make_user('alice')
+    for members in ([{'user_id': 'abc', 'encrypted_key': 'k'}], ['x'], {'user_id': 1}):
+        response = client.post('/api/groups/create', headers=headers, json={
+            'name': 'team', 'encrypted_group_key': 'k0', 'members': members
+        })
+        assert response.status_code == 400
+    assert UserGroup.query.count() == 0
+
+
+def _request_join(client, headers, group_id):
+    response = client.post('/api/groups/join', headers=headers, json={'group_id': group_id})
+    assert response.status_code == 200
+    return response.get_json()['request_id']
+
+
+def test_bulk_approve_distributes_keys_in_one_call(client, make_user, create_group):
+    _, owner = make_user('owner')
+    applicants = [make_user(f'user{i}') for i in range(3)]
+    group_id = create_group(owner)
+    request_ids = [_request_join(client, headers, group_id) for _, headers in applicants]
+
+    response = client.post(f'/api/groups/{group_id}/requests/approve-batch', headers=owner, json={'items': [
+        {'request_id': request_ids[0], 'encrypted_key': 'k0'},
+        {'request_id': request_ids[1]},
+        {'request_id': 12345, 'encrypted_key': 'k'},
+    ]})
+    assert response.status_code == 200
+    statuses = [result['status'] for result in response.get_json()['results']]
+    assert statuses == ['approved', 'approved', 'error']
+
+    members = {m.user_id for m in GroupMember.query.filter_by(group_id=group_id)}
+    assert applicants[0][0].id in members and applicants[1][0].id in members
+    assert applicants[2][0].id not in members
+    assert GroupSharedKey.query.filter_by(group_id=group_id, user_id=applicants[0][0].id).one().encrypted_key == 'k0'
+    assert db.session.get(GroupJoinRequest, request_ids[2]).status == 'pending'
+
+    # 重复批准不会重复添加成员
+    response = client.post(f'/api/groups/{group_id}/requests/approve-batch', headers=owner,
+                           json={'items': [{'request_id': request_ids[0]}]})
+    assert response.get_json()['results'][0]['status'] == 'error'
+
+
+def test_bulk_approve_requires_admin(client, make_user, create_group):
+    _, owner = make_user('owner')
+    member, member_headers = make_user('member')
+    _, applicant = make_user('applicant')
+    group_id = create_group(owner, members=[member.id])
+    request_id = _request_join(client, applicant, group_id)
+
+    response = client.post(f'/api/groups/{group_id}/requests/approve-batch', headers=member_headers,
+                           json={'items': [{'request_id': request_id}]})
+    assert response.status_code == 403
+
+    response = client.post(f'/api/groups/{group_id}/requests/approve-batch', headers=owner,
+                           json={'items': [{'request_id': 'abc'}]})
+    assert response.status_code == 400
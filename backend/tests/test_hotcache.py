@@ -0,0 +1,108 @@
+"""
+热点密文缓存：字节容量LRU、单飞加载和失效
+"""
+import threading
+from models import File, db
+from storage.hotcache import content_key, hot_blob_cache
+from storage.purger import BlobPurger
+from utils.cache import ByteLRUCache
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ByteLRUCache(capacity=10)
+    cache.get_or_load('a', lambda: b'aaaa')
+    cache.get_or_load('b', lambda: b'bbbb')
+    cache.get_or_load('a', lambda: b'unused')
+    cache.get_or_load('c', lambda: b'cccc')
+    assert len(cache) == 2
+    assert cache.get_or_load('a', lambda: b'reloaded') == b'aaaa'
+    assert cache.get_or_load('b', lambda: b'reloaded') == b'reloaded'
+    assert cache.stats()['evictions'] >= 1
+
+
+def test_oversized_items_bypass_cache():
+    cache = ByteLRUCache(capacity=100, max_item_size=4)
+    assert cache.get_or_load('big', lambda: b'0123456789', size_hint=10) == b'0123456789'
+    assert cache.get_or_load('big2', lambda: b'0123456789') == b'0123456789'
+    assert len(cache) == 0
+    assert cache.stats()['bypassed'] == 1
+
+
+def test_concurrent_misses_load_once():
+    cache = ByteLRUCache(capacity=100)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b'data'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_load('k', loader)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', loader))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == [b'data'] * 4
+    assert len(calls) == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_loader_error_is_shared_and_not_cached():
+    cache = ByteLRUCache(capacity=100)
+
+    def failing():
+        raise OSError('disk')
+
+    for _ in range(2):
+        try:
+            cache.get_or_load('k', failing)
+        except OSError:
+            pass
+    assert len(cache) == 0
+    assert cache.get_or_load('k', lambda: b'ok') == b'ok'
+
+
+def test_invalidate_during_load_discards_result():
+    cache = ByteLRUCache(capacity=100)
+
+    def loader():
+        cache.invalidate('k')
+        return b'old'
+
+    assert cache.get_or_load('k', loader) == b'old'
+    assert cache.get_or_load('k', lambda: b'new') == b'new'
+
+
+def test_repeated_downloads_read_once(client, make_user, upload, download):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'shared content').get_json()['file']['id']
+    before = hot_blob_cache.stats()
+
+    for _ in range(3):
+        response, layer1 = download(headers, file_id)
+        assert response.status_code == 200 and layer1 == b'shared content'
+
+    stats = hot_blob_cache.stats()
+    assert stats['misses'] - before['misses'] == 1
+    assert stats['hits'] - before['hits'] == 2
+
+
+def test_purged_content_leaves_cache(client, make_user, upload, download):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'short lived').get_json()['file']['id']
+    download(headers, file_id)
+    location = db.session.get(File, file_id).blob.storage_path
+    assert len(hot_blob_cache) == 1
+
+    assert client.delete(f'/api/files/{file_id}', headers=headers).status_code == 200
+    assert client.delete(f'/api/files/trash/{file_id}', headers=headers).status_code == 200
+    BlobPurger.purge_pending()
+    assert hot_blob_cache.get_or_load(content_key(location), lambda: b'miss') == b'miss'
@@ -0,0 +1,66 @@
+"""
+幂等请求与上传去重
+"""
+from models import Blob, File, db
+from storage.blobs import BlobStore
+from tests.test_blobs import _add_file, _write_blob
+from utils.idempotency import idempotency_cache, idempotent
+
+
+def test_retry_replays_first_response(client, make_user, upload):
+    _, headers = make_user('alice')
+    retry_headers = dict(headers, **{'Idempotency-Key': 'req-1'})
+
+    first = upload(retry_headers, b'data')
+    second = upload(retry_headers, b'data')
+    assert first.status_code == second.status_code == 201
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json() == first.get_json()
+    assert File.query.count() == 1
+
+    assert upload(dict(headers, **{'Idempotency-Key': 'req-2'}), b'data').status_code == 201
+    assert File.query.count() == 2
+
+
+def test_failed_requests_are_not_cached(client, make_user, upload):
+    _, headers = make_user('alice')
+    retry_headers = dict(headers, **{'Idempotency-Key': 'req-1'})
+    assert upload(retry_headers, b'data', group_id=999).status_code == 403
+    assert upload(retry_headers, b'data').status_code == 201
+
+
+def test_in_flight_and_oversized_keys(app, client, make_user, upload):
+    user, headers = make_user('alice')
+    idempotency_cache.begin((user.id, 'files.upload_file', 'busy'))
+    assert upload(dict(headers, **{'Idempotency-Key': 'busy'}), b'data').status_code == 409
+    assert upload(dict(headers, **{'Idempotency-Key': 'k' * 256}), b'data').status_code == 400
+
+
+def test_decorator_preserves_view_metadata():
+    def view(user):
+        """视图说明"""
+
+    wrapped = idempotent(view)
+    assert (wrapped.__name__, wrapped.__doc__, wrapped.__wrapped__) == ('view', '视图说明', view)
+
+
+def test_identical_uploads_share_ciphertext(client, make_user, upload):
+    _, headers = make_user('alice')
+    first = upload(headers, b'same').get_json()['file']['id']
+    second = upload(headers, b'same').get_json()['file']['id']
+    blob_ids = {db.session.get(File, file_id).blob_id for file_id in (first, second)}
+    assert len(blob_ids) == 1
+    assert db.session.get(Blob, blob_ids.pop()).ref_count == 2
+
+
+def test_orphaned_blob_is_not_reused_for_dedupe(user):
+    blob = _write_blob(b'dedupe')
+    blob.digest = 'a' * 64
+    file_record = _add_file(user, blob)
+    db.session.commit()
+    assert BlobStore.acquire_duplicate(user.id, 'a' * 64).id == blob.id
+    db.session.rollback()
+
+    BlobStore.release(file_record)
+    db.session.commit()
+    assert BlobStore.acquire_duplicate(user.id, 'a' * 64) is None
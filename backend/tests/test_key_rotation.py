@@ -0,0 +1,92 @@
+"""
+成员移除后的组密钥轮换
+"""
+from models import GroupSharedKey, UserGroup, db
+
+
+def _setup(make_user, create_group):
+    alice, alice_headers = make_user('alice')
+    bob, bob_headers = make_user('bob')
+    carol, _ = make_user('carol')
+    group_id = create_group(alice_headers, members=[bob.id, carol.id])
+    return group_id, (alice, alice_headers), (bob, bob_headers), carol
+
+
+def _remove(client, headers, group_id, member_id):
+    response = client.delete(f'/api/groups/{group_id}/members/{member_id}', headers=headers)
+    assert response.status_code == 200
+    return response.get_json()['rotation']
+
+
+def test_removing_member_starts_rotation_and_revokes_keys(client, make_user, create_group, upload):
+    group_id, (_, alice_headers), (bob, _), carol = _setup(make_user, create_group)
+    upload(alice_headers, b'old', group_id=group_id)
+
+    rotation = _remove(client, alice_headers, group_id, carol.id)
+    assert (rotation['from_epoch'], rotation['to_epoch'], rotation['status']) == (1, 2, 'running')
+    assert rotation['total_files'] == 1
+    assert db.session.get(UserGroup, group_id).key_epoch == 2
+    assert GroupSharedKey.query.filter_by(group_id=group_id, user_id=carol.id).count() == 0
+    assert GroupSharedKey.query.filter_by(group_id=group_id, user_id=bob.id).count() == 1
+
+
+def test_old_and_new_keys_coexist_during_rotation(client, make_user, create_group, upload, download):
+    group_id, (alice, alice_headers), (bob, bob_headers), carol = _setup(make_user, create_group)
+    old_file = upload(alice_headers, b'old', group_id=group_id).get_json()['file']['id']
+    rotation = _remove(client, alice_headers, group_id, carol.id)
+
+    response = client.post(f"/api/groups/key-rotations/{rotation['id']}/member-keys", headers=alice_headers, json={
+        'keys': [{'user_id': alice.id, 'encrypted_key': 'alice-v2'}, {'user_id': bob.id, 'encrypted_key': 'bob-v2'}]
+    })
+    assert response.status_code == 200
+
+    # 默认返回最新版本，指定 epoch 时返回旧版本（解密尚未重新封装的文件）
+    assert client.get(f'/api/groups/{group_id}/key', headers=bob_headers).get_json() == {
+        'encrypted_key': 'bob-v2', 'epoch': 2}
+    assert client.get(f'/api/groups/{group_id}/key?epoch=1', headers=bob_headers).get_json() == {
+        'encrypted_key': 'key-2', 'epoch': 1}
+    assert download(bob_headers, old_file)[0].headers['X-File-Key-Epoch'] == '1'
+
+    # 轮换进行中仍接受旧版本封装的上传，拒绝不存在的版本
+    assert upload(bob_headers, b'late', group_id=group_id, key_epoch=1).status_code == 201
+    assert upload(bob_headers, b'bad', group_id=group_id, key_epoch=3).status_code == 400
+    new_file = upload(bob_headers, b'new', group_id=group_id).get_json()['file']
+    assert new_file['key_epoch'] == 2
+
+
+def test_rotation_completes_after_all_keys_are_rewrapped(client, make_user, create_group, upload, download):
+    group_id, (alice, alice_headers), (bob, bob_headers), carol = _setup(make_user, create_group)
+    file_id = upload(alice_headers, b'old', group_id=group_id).get_json()['file']['id']
+    rotation = _remove(client, alice_headers, group_id, carol.id)
+    job = f"/api/groups/key-rotations/{rotation['id']}"
+
+    response = client.post(f'{job}/complete', headers=alice_headers)
+    assert response.status_code == 409 and response.get_json()['pending_files'] == 1
+
+    # 普通成员不能管理轮换任务
+    assert client.get(job, headers=bob_headers).status_code == 403
+
+    pending = client.get(f'{job}/files', headers=alice_headers).get_json()
+    assert [item['id'] for item in pending['files']] == [file_id]
+    response = client.post(f'{job}/files', headers=alice_headers,
+                           json={'files': [{'file_id': file_id, 'encrypted_file_key': 'efk-v2'}]})
+    assert response.get_json()['updated'] == 1
+    # 重复提交不会重复计数
+    response = client.post(f'{job}/files', headers=alice_headers,
+                           json={'files': [{'file_id': file_id, 'encrypted_file_key': 'efk-v2'}]})
+    assert response.get_json()['updated'] == 0
+
+    response = client.post(f'{job}/complete', headers=alice_headers)
+    assert response.status_code == 409 and response.get_json()['pending_members'] == 2
+    client.post(f'{job}/member-keys', headers=alice_headers, json={
+        'keys': [{'user_id': alice.id, 'encrypted_key': 'a2'}, {'user_id': bob.id, 'encrypted_key': 'b2'}]
+    })
+
+    response = client.post(f'{job}/complete', headers=alice_headers)
+    assert response.status_code == 200
+    assert GroupSharedKey.query.filter_by(group_id=group_id, epoch=1).count() == 0
+    assert download(bob_headers, file_id)[0].headers['X-File-Key-Epoch'] == '2'
+
+    # 轮换结束后旧版本不再被接受
+    response = upload(bob_headers, b'stale', group_id=group_id, key_epoch=1)
+    assert response.status_code == 409 and response.get_json()['key_epoch'] == 2
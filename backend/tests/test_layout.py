@@ -0,0 +1,72 @@
+"""
+存储布局的在线迁移
+"""
+import os
+from models import Blob, File, db
+from storage.blobs import BlobStore
+from storage.layout import LayoutMigrator
+from storage.purger import BlobPurger
+
+
+def _legacy_file(owner, uploads, data=b'legacy-ciphertext', name='1_1700000000_a.enc'):
+    """旧版本平铺存放、没有密文记录的文件"""
+    uploads.mkdir(parents=True, exist_ok=True)
+    path = str(uploads / name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    file_record = File(filename=name, original_filename='a.txt', file_path=path, file_size=len(data),
+                       encrypted_file_key='efk', owner_id=owner.id)
+    db.session.add(file_record)
+    db.session.commit()
+    return file_record, path
+
+
+def test_migration_moves_legacy_file_and_retires_old_path(local_storage, user, download, make_user):
+    file_record, old_path = _legacy_file(user, local_storage)
+    migrator = LayoutMigrator(grace=0)
+    assert migrator.register_legacy_files() == 1
+    assert migrator.migrate_batch()[1] == 1
+
+    db.session.refresh(file_record)
+    new_path = file_record.blob.storage_path
+    assert BlobStore.is_sharded(new_path) and file_record.file_path == new_path
+    # 旧位置已持久登记为待清理的记录，不依赖迁移进程存活
+    retired = Blob.query.filter_by(storage_path=old_path).one()
+    assert retired.ref_count == 0 and retired.orphaned_at is not None
+    assert os.path.exists(old_path)
+
+    assert BlobPurger.purge_batch() == 1
+    assert not os.path.exists(old_path) and os.path.exists(new_path)
+
+
+def test_old_path_is_kept_during_grace(local_storage, user):
+    _, old_path = _legacy_file(user, local_storage)
+    migrator = LayoutMigrator(grace=3600)
+    migrator.register_legacy_files()
+    migrator.migrate_batch()
+
+    assert BlobPurger.purge_batch() == 0
+    assert os.path.exists(old_path)
+
+
+def test_downloads_follow_blob_record_not_stale_file_path(local_storage, make_user, download):
+    user, headers = make_user('alice')
+    file_record, old_path = _legacy_file(user, local_storage, b'content')
+    migrator = LayoutMigrator(grace=0)
+    migrator.register_legacy_files()
+    migrator.migrate_batch()
+    BlobPurger.purge_batch()
+
+    # 模拟迁移前读取了旧位置、迁移提交后才写入的文件记录
+    File.query.filter_by(id=file_record.id).update({File.file_path: old_path})
+    db.session.commit()
+    response, layer1 = download(headers, file_record.id)
+    assert response.status_code == 200 and layer1 == b'content'
+
+
+def test_run_migrates_everything_and_cleans_up(local_storage, user):
+    paths = [_legacy_file(user, local_storage, b'x%d' % i, f'1_{i}_f.enc')[1] for i in range(3)]
+    result = LayoutMigrator(batch_size=2, grace=0).run()
+    assert result == {'registered': 3, 'migrated': 3}
+    assert not any(os.path.exists(path) for path in paths)
+    assert Blob.query.filter(Blob.orphaned_at.isnot(None)).count() == 0
@@ -0,0 +1,132 @@
+"""
+Merkle 树与审计路径
+"""
+import hashlib
+import os
+import pytest
+from tests.test_versions import _new_version
+from storage.manifest import (Manifest, MerkleBuilder, audit_path, hash_ciphertext, leaf_hash,
+                              merkle_root, node_hash, verify_path)
+
+LEAF = 16
+
+
+def _rfc6962_root(hashes):
+    """RFC 6962 2.1 的递归定义：在小于 n 的最大2的幂处拆分"""
+    if len(hashes) == 1:
+        return hashes[0]
+    k = 1
+    while k * 2 < len(hashes):
+        k *= 2
+    return node_hash(_rfc6962_root(hashes[:k]), _rfc6962_root(hashes[k:]))
+
+
+def _leaves(count):
+    return [leaf_hash(bytes([i]) * 3) for i in range(count)]
+
+
+def test_empty_tree_root():
+    assert merkle_root([]) == hashlib.sha256(b'').digest()
+
+
+@pytest.mark.parametrize('count', range(1, 18))
+def test_root_matches_rfc6962(count):
+    hashes = _leaves(count)
+    assert merkle_root(hashes) == _rfc6962_root(hashes)
+
+
+@pytest.mark.parametrize('count', range(1, 18))
+def test_every_audit_path_verifies(count):
+    hashes = _leaves(count)
+    root = merkle_root(hashes)
+    for index in range(count):
+        assert verify_path(hashes[index], index, count, audit_path(hashes, index), root)
+
+
+def test_audit_path_rejects_wrong_leaf_index_or_root():
+    hashes = _leaves(7)
+    root = merkle_root(hashes)
+    path = audit_path(hashes, 3)
+    assert not verify_path(leaf_hash(b'forged'), 3, 7, path, root)
+    assert not verify_path(hashes[3], 2, 7, path, root)
+    assert not verify_path(hashes[3], 3, 7, path, leaf_hash(b'root'))
+    assert not verify_path(hashes[3], 7, 7, path, root)
+    assert not verify_path(hashes[3], 3, 7, path[:-1], root)
+
+
+@pytest.mark.parametrize('size', [0, 1, LEAF - 1, LEAF, LEAF + 1, 5 * LEAF + 3])
+def test_builder_streaming_matches_one_shot(size):
+    data = os.urandom(size)
+    streamed = MerkleBuilder(LEAF)
+    for i in range(0, len(data), 7):
+        streamed.update(data[i:i + 7])
+    whole = hash_ciphertext(data, LEAF)
+
+    assert streamed.hexdigest() == whole.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert streamed.leaves == whole.leaves
+    expected = [leaf_hash(data[i:i + LEAF]) for i in range(0, len(data), LEAF)] or [leaf_hash(b'')]
+    assert streamed.leaves == b''.join(expected)
+    assert streamed.root() == merkle_root(expected).hex()
+
+
+def test_manifest_proof_covers_leaf_range():
+    data = os.urandom(3 * LEAF + 5)
+    builder = hash_ciphertext(data, LEAF)
+    manifest = Manifest(len(data), LEAF, builder.leaves, builder.hexdigest())
+    assert manifest.leaf_count == 4
+    assert manifest.root.hex() == builder.root()
+
+    proof = manifest.proof(3)
+    assert (proof['offset'], proof['length']) == (3 * LEAF, 5)
+    chunk = data[proof['offset']:proof['offset'] + proof['length']]
+    assert verify_path(leaf_hash(chunk), proof['index'], proof['leaf_count'],
+                       [bytes.fromhex(node) for node in proof['path']], bytes.fromhex(proof['root']))
+
+
+def test_manifest_endpoint_matches_uploaded_ciphertext(app, client, make_user, upload):
+    app.config['MERKLE_LEAF_SIZE'] = LEAF
+    _, headers = make_user('alice')
+    data = os.urandom(3 * LEAF + 5)
+    file_id = upload(headers, data).get_json()['file']['id']
+
+    body = client.get(f'/api/files/{file_id}/manifest?leaves=1', headers=headers).get_json()
+    expected = hash_ciphertext(data, LEAF)
+    assert body['sha256'] == hashlib.sha256(data).hexdigest()
+    assert (body['size'], body['leaf_count'], body['root']) == (len(data), 4, expected.root())
+    assert body['version'] == 1 and 'leaves' in body
+
+
+def test_proof_endpoint_verifies_a_range(app, client, make_user, upload):
+    app.config['MERKLE_LEAF_SIZE'] = LEAF
+    _, headers = make_user('alice')
+    data = os.urandom(5 * LEAF)
+    file_id = upload(headers, data).get_json()['file']['id']
+
+    proof = client.get(f'/api/files/{file_id}/manifest/proof?index=2', headers=headers).get_json()
+    chunk = data[proof['offset']:proof['offset'] + proof['length']]
+    assert verify_path(leaf_hash(chunk), proof['index'], proof['leaf_count'],
+                       [bytes.fromhex(node) for node in proof['path']], bytes.fromhex(proof['root']))
+    assert client.get(f'/api/files/{file_id}/manifest/proof?index=5', headers=headers).status_code == 400
+    assert client.get(f'/api/files/{file_id}/manifest/proof', headers=headers).status_code == 400
+
+
+def test_versioned_manifest_follows_each_version(app, client, make_user, upload):
+    app.config.update(MERKLE_LEAF_SIZE=LEAF, VERSION_SEGMENT_SIZE=2 * LEAF)
+    _, headers = make_user('alice')
+    first, second = os.urandom(3 * LEAF), os.urandom(5 * LEAF + 1)
+    file_id = upload(headers, first).get_json()['file']['id']
+    _new_version(client, headers, file_id, second)
+
+    current = client.get(f'/api/files/{file_id}/manifest', headers=headers).get_json()
+    old = client.get(f'/api/files/{file_id}/manifest?version=1', headers=headers).get_json()
+    assert current['root'] == hash_ciphertext(second, LEAF).root() and current['version'] == 2
+    assert old['root'] == hash_ciphertext(first, LEAF).root() and old['version'] == 1
+    assert client.get(f'/api/files/{file_id}/manifest?version=9', headers=headers).status_code == 404
+
+
+def test_manifest_requires_access(client, make_user, upload):
+    _, alice = make_user('alice')
+    _, mallory = make_user('mallory')
+    file_id = upload(alice, b'ciphertext').get_json()['file']['id']
+    assert client.get(f'/api/files/{file_id}/manifest', headers=mallory).status_code == 403
+    assert client.get(f'/api/files/{file_id}/manifest/proof?index=0', headers=mallory).status_code == 403
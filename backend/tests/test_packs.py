@@ -0,0 +1,71 @@
+"""
+小密文打包存储与压缩
+"""
+import os
+import pytest
+from models import Blob, File, db
+from storage.drivers import get_driver
+from storage.packs import PackCompactor
+from storage.purger import BlobPurger
+
+
+@pytest.fixture
+def packed(app, local_storage, client, make_user, upload):
+    """打包存储中的4个小文件，其中3个已永久删除"""
+    app.config['PACK_SMALL_BLOBS'] = True
+    user, headers = make_user('alice')
+    ids = [upload(headers, b'small-%d' % i).get_json()['file']['id'] for i in range(4)]
+    for file_id in ids[1:]:
+        client.delete(f'/api/files/{file_id}', headers=headers)
+        client.delete(f'/api/files/trash/{file_id}', headers=headers)
+    BlobPurger.purge_batch()
+    driver = get_driver('pack')
+    old_pack = driver.active_pack
+    driver._roll()
+    return headers, ids[0], driver, old_pack
+
+
+def test_small_uploads_share_a_pack(packed, download):
+    headers, file_id, driver, old_pack = packed
+    location = db.session.get(File, file_id).blob.storage_path
+    assert location.startswith(f'pack://{old_pack}/')
+    assert download(headers, file_id)[1] == b'small-0'
+
+
+def test_compaction_rewrites_live_blobs_and_retires_old_pack(packed, download):
+    headers, file_id, driver, old_pack = packed
+    compactor = PackCompactor(threshold=0.5, min_age=0, grace=3600)
+    done, reclaimed = compactor.compact_pack(old_pack, os.path.getsize(driver.pack_path(old_pack)))
+    assert done and reclaimed == 3 * len(b'small-0')
+
+    record = db.session.get(File, file_id)
+    assert record.blob.storage_path.startswith(f'pack://{driver.active_pack}/')
+    # 旧打包文件已持久登记，宽限期内保留
+    retired = Blob.query.filter_by(storage_path=driver.pack_path(old_pack)).one()
+    assert retired.ref_count == 0
+    assert BlobPurger.purge_batch() == 0 and os.path.exists(driver.pack_path(old_pack))
+    # 已登记的打包文件不会被重复压缩
+    assert compactor.compact_pack(old_pack, 100) == (False, 0)
+    assert download(headers, file_id)[1] == b'small-0'
+
+
+def test_run_removes_old_pack_after_grace(packed, download):
+    headers, file_id, driver, old_pack = packed
+    # 模拟压缩前读取了旧位置、压缩后才写入的文件记录：读取仍以密文记录为准
+    stale_location = db.session.get(File, file_id).file_path
+    result = PackCompactor(threshold=0.5, min_age=0, grace=0).run()
+    assert result['compacted'] == 1
+    assert not os.path.exists(driver.pack_path(old_pack))
+    File.query.filter_by(id=file_id).update({File.file_path: stale_location})
+    db.session.commit()
+    assert download(headers, file_id)[1] == b'small-0'
+
+
+def test_dense_pack_is_skipped(app, local_storage, make_user, upload):
+    app.config['PACK_SMALL_BLOBS'] = True
+    _, headers = make_user('alice')
+    upload(headers, b'dense')
+    driver = get_driver('pack')
+    pack_id = driver.active_pack
+    driver._roll()
+    assert PackCompactor(threshold=0.5, min_age=0).compact_pack(pack_id, 5) == (False, 0)
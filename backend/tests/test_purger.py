@@ -0,0 +1,89 @@
+"""
+批量删除与后台清理
+"""
+import importlib.util
+import os
+from datetime import datetime
+import app as app_module
+from models import Blob, File, db
+from storage.blobs import BlobStore
+from storage.purger import BlobPurger, TrashPurger
+from tests.test_blobs import _add_file, _write_blob
+
+
+def test_purge_removes_data_then_record(user):
+    blob = _write_blob(b'gone')
+    blob_id, location = blob.id, blob.storage_path
+    file_record = _add_file(user, blob)
+    BlobStore.release(file_record)
+    db.session.commit()
+
+    assert BlobPurger.purge_batch() == 1
+    assert db.session.get(Blob, blob_id) is None
+    assert BlobStore.stat_data(location) is None
+    assert BlobPurger.purge_batch() == 0
+
+
+def test_purge_skips_referenced_blobs(user):
+    blob = _write_blob(b'kept')
+    _add_file(user, blob)
+    db.session.commit()
+
+    assert BlobPurger.purge_pending() == 0
+    assert BlobStore.stat_data(blob.storage_path) == 4
+
+
+def test_delete_permanently_releases_blob_and_purges(user):
+    blob = _write_blob(b'trash')
+    location = blob.storage_path
+    kept = _add_file(user, blob, 'kept.bin')
+    trashed = _add_file(user, blob, 'trashed.bin')
+    BlobStore.acquire(trashed)
+    trashed.deleted_at = datetime.now()
+    db.session.commit()
+
+    deleted = TrashPurger.delete_permanently(db.session.query(File.id).filter(File.id == trashed.id))
+    db.session.commit()
+    assert deleted == 1
+    assert BlobPurger.purge_batch() == 0
+    assert BlobStore.stat_data(location) == 5
+
+    TrashPurger.delete_permanently(db.session.query(File.id).filter(File.id == kept.id))
+    db.session.commit()
+    assert BlobPurger.purge_batch() == 1
+    assert BlobStore.stat_data(location) is None
+
+
+def test_batch_delete_moves_only_accessible_files_to_trash(client, make_user, upload):
+    alice, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    own = [upload(headers, b'x%d' % i).get_json()['file']['id'] for i in range(2)]
+    foreign = upload(other_headers, b'y').get_json()['file']['id']
+
+    response = client.post('/api/files/delete-batch', headers=headers, json={'file_ids': own + [foreign]})
+    assert response.status_code == 200
+    assert response.get_json()['deleted'] == own and response.get_json()['missing'] == [foreign]
+    assert {f.deleted_by for f in File.query.filter(File.id.in_(own))} == {alice.id}
+    assert db.session.get(File, foreign).deleted_at is None
+    assert client.post('/api/files/delete-batch', headers=headers, json={'file_ids': []}).status_code == 400
+
+
+def test_worker_is_not_started_on_import(app):
+    # 只能由 run-worker、gunicorn 钩子或开发服务器显式启动
+    assert app_module.background_worker is None
+
+
+def test_gunicorn_hook_respects_switch(app, monkeypatch):
+    path = os.path.join(os.path.dirname(app_module.__file__), 'gunicorn.conf.py')
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', path)
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+
+    started = []
+    monkeypatch.setattr(app_module, 'start_background_worker', lambda: started.append(True))
+    monkeypatch.setitem(app.config, 'BACKGROUND_WORKER_ENABLED', False)
+    gunicorn_conf.post_worker_init(None)
+    assert started == []
+    monkeypatch.setitem(app.config, 'BACKGROUND_WORKER_ENABLED', True)
+    gunicorn_conf.post_worker_init(None)
+    assert started == [True]
@@ -0,0 +1,76 @@
+"""
+存储配额与用量计数
+"""
+from sqlalchemy import inspect
+from models import User, UserGroup, db
+from utils.quota import QuotaManager
+from utils.schema import upgrade_schema
+
+
+def _usage(client, headers, **params):
+    response = client.get('/api/files/usage', headers=headers, query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_usage_follows_upload_and_purge(client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'12345').get_json()['file']['id']
+    assert _usage(client, headers)['used_bytes'] == 5
+
+    client.delete(f'/api/files/{file_id}', headers=headers)
+    # 回收站中的文件仍计入用量，永久删除后释放
+    assert _usage(client, headers)['used_bytes'] == 5
+    client.delete(f'/api/files/trash/{file_id}', headers=headers)
+    assert _usage(client, headers)['used_bytes'] == 0
+
+
+def test_upload_over_quota_is_rejected(app, client, make_user, upload):
+    user, headers = make_user('alice')
+    user.quota_bytes = 6
+    db.session.commit()
+
+    assert upload(headers, b'1234').status_code == 201
+    assert upload(headers, b'567').status_code == 413
+    assert _usage(client, headers) == {'used_bytes': 4, 'quota_bytes': 6, 'group_id': None}
+
+    # 未单独设置配额时使用全局配置
+    user.quota_bytes = None
+    app.config['USER_QUOTA_BYTES'] = 4
+    db.session.commit()
+    assert upload(headers, b'5').status_code == 413
+
+
+def test_group_usage_requires_membership(client, make_user, create_group, upload):
+    _, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    group_id = create_group(headers)
+    upload(headers, b'abc', group_id=group_id)
+
+    assert _usage(client, headers, group_id=group_id)['used_bytes'] == 3
+    assert _usage(client, headers)['used_bytes'] == 0
+    response = client.get('/api/files/usage', headers=other_headers, query_string={'group_id': group_id})
+    assert response.status_code == 403
+
+
+def test_reconcile_corrects_drift(client, make_user, create_group, upload):
+    user, headers = make_user('alice')
+    group_id = create_group(headers)
+    upload(headers, b'12345')
+    upload(headers, b'12', group_id=group_id)
+    User.query.filter_by(id=user.id).update({User.used_bytes: 999})
+    UserGroup.query.filter_by(id=group_id).update({UserGroup.used_bytes: 0})
+    db.session.commit()
+
+    QuotaManager.reconcile_all()
+    assert QuotaManager.usage(user.id)['used_bytes'] == 5
+    assert QuotaManager.usage(user.id, group_id)['used_bytes'] == 2
+
+
+def test_upgrade_schema_adds_missing_columns_once(app):
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql('ALTER TABLE users DROP COLUMN used_bytes')
+    changes = upgrade_schema()
+    assert 'users.used_bytes' in ' '.join(changes)
+    assert 'used_bytes' in {c['name'] for c in inspect(db.engine).get_columns('users')}
+    assert upgrade_schema() == []
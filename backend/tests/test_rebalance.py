@@ -0,0 +1,51 @@
+"""
+数据卷再平衡
+"""
+import pytest
+from models import Blob
+from storage.blobs import BlobStore
+from storage.layout import VolumeRebalancer
+
+
+def _add_volume(app, tmp_path):
+    """在已有数据的卷之外增加一个卷"""
+    app.config['STORAGE_VOLUMES'] = f"d1={tmp_path / 'uploads'}:1,d2={tmp_path / 'disk2'}:1"
+    app.extensions.pop('blob_storage_drivers', None)
+
+
+@pytest.fixture
+def uploaded(app, local_storage, make_user, upload):
+    app.config['PACK_SMALL_BLOBS'] = False
+    _, headers = make_user('alice')
+    ids = [upload(headers, b'data-%d' % i * 100).get_json()['file']['id'] for i in range(12)]
+    return headers, ids
+
+
+def test_rebalance_moves_blobs_to_ring_targets(app, tmp_path, uploaded, download):
+    headers, ids = uploaded
+    _add_volume(app, tmp_path)
+
+    rebalancer = VolumeRebalancer(grace=0)
+    result = rebalancer.run()
+    on_new_volume = Blob.query.filter_by(volume='d2').count()
+    assert result['migrated'] == rebalancer.scheduled == on_new_volume > 0
+    for i, file_id in enumerate(ids):
+        assert download(headers, file_id)[1] == b'data-%d' % i * 100
+
+
+def test_max_moves_counts_only_committed_moves(app, tmp_path, uploaded, monkeypatch):
+    _add_volume(app, tmp_path)
+
+    def broken_copy(source, target):
+        raise OSError('磁盘已满')
+
+    monkeypatch.setattr(BlobStore, 'copy_data', broken_copy)
+    failing = VolumeRebalancer(grace=0, max_moves=1)
+    with pytest.raises(OSError):
+        failing.run()
+    assert failing.scheduled == 0
+    monkeypatch.undo()
+
+    limited = VolumeRebalancer(batch_size=5, grace=0, max_moves=1)
+    assert limited.run()['migrated'] == limited.scheduled == 1
+    assert Blob.query.filter_by(volume='d2').count() == 1
@@ -0,0 +1,125 @@
+"""
+冗余存储：校验分片重建与副本
+"""
+import os
+import pytest
+from models import File, db
+from storage.redundancy import ParityDriver, ReplicatedDriver, ShardCorrupted
+from storage.volumes import Volume
+
+UNIT = 1024
+
+
+@pytest.fixture
+def volumes(tmp_path):
+    return [Volume(f'v{i}', str(tmp_path / f'vol{i}')) for i in range(5)]
+
+
+@pytest.fixture
+def parity(volumes):
+    return ParityDriver(volumes, data_shards=4, unit_size=UNIT, fsync=False)
+
+
+def _store(driver, data: bytes) -> str:
+    location = driver.new_location()
+    driver.write(location, [data[i:i + 3000] for i in range(0, len(data), 3000)], len(data))
+    return location
+
+
+def _read(driver, location: str) -> bytes:
+    return b''.join(driver.open(location, 4096))
+
+
+def _flip(path: str, offset: int):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+@pytest.mark.parametrize('size', [0, 1, UNIT, 4 * UNIT, 4 * UNIT + 1, 10 * UNIT + 123])
+def test_parity_roundtrip(parity, size):
+    data = os.urandom(size)
+    location = _store(parity, data)
+    assert parity.stat(location) == size
+    assert _read(parity, location) == data
+
+
+def test_shards_on_distinct_volumes(parity):
+    location = _store(parity, os.urandom(UNIT))
+    paths = parity.shard_paths(location)
+    assert len(paths) == 5
+    assert len({os.path.dirname(os.path.dirname(os.path.dirname(path))) for path in paths}) == 5
+
+
+@pytest.mark.parametrize('index', range(5))
+def test_parity_rebuilds_any_missing_shard(parity, index):
+    data = os.urandom(9 * UNIT + 7)
+    location = _store(parity, data)
+    os.remove(parity.shard_paths(location)[index])
+    assert _read(parity, location) == data
+
+
+def test_parity_rebuilds_corrupt_unit_and_reports_damage(parity):
+    data = os.urandom(8 * UNIT)
+    location = _store(parity, data)
+    # 第2个分片中第二个条带单元的数据（分片头之后的第二条记录）
+    path = parity.shard_paths(location)[2]
+    _flip(path, os.path.getsize(path) - UNIT // 2)
+
+    damaged = set()
+    assert b''.join(parity.open_checked(location, 4096, damaged)) == data
+    assert damaged == {2}
+
+
+def test_parity_fails_with_two_damaged_shards(parity):
+    location = _store(parity, os.urandom(4 * UNIT))
+    for path in parity.shard_paths(location)[:2]:
+        os.remove(path)
+    with pytest.raises(ShardCorrupted):
+        _read(parity, location)
+
+
+def test_parity_requires_enough_volumes(volumes):
+    with pytest.raises(ValueError):
+        ParityDriver(volumes[:4], data_shards=4, unit_size=UNIT)
+
+
+def test_replica_survives_all_but_one_copy(volumes):
+    driver = ReplicatedDriver(volumes[:3], replicas=3, unit_size=UNIT, fsync=False)
+    data = os.urandom(5 * UNIT + 3)
+    location = _store(driver, data)
+    paths = driver.shard_paths(location)
+    os.remove(paths[0])
+    _flip(paths[1], os.path.getsize(paths[1]) - 1)
+    assert _read(driver, location) == data
+
+
+def test_delete_removes_all_shards(parity):
+    location = _store(parity, os.urandom(UNIT))
+    parity.delete(location)
+    assert not any(os.path.exists(path) for path in parity.shard_paths(location))
+    assert parity.stat(location) is None
+
+
+def test_upload_and_download_through_parity_driver(app, tmp_path, make_user, upload, download):
+    app.config.update(
+        STORAGE_DRIVER='parity',
+        STORAGE_VOLUMES=','.join(f'v{i}={tmp_path / f"disk{i}"}:1' for i in range(3)),
+        BLOB_PARITY_SHARDS=2,
+        BLOB_STRIPE_UNIT=UNIT,
+        BLOB_FSYNC=False,
+    )
+    app.extensions.pop('blob_storage_drivers', None)
+    _, headers = make_user('alice')
+    data = os.urandom(5 * UNIT + 7)
+    file_id = upload(headers, data).get_json()['file']['id']
+
+    location = db.session.get(File, file_id).blob.storage_path
+    assert location.startswith('parity://')
+    # 丢失一个分片后下载仍能得到完整密文
+    driver = app.extensions['blob_storage_drivers']['parity']
+    os.remove(driver.shard_paths(location)[0])
+    response, layer1 = download(headers, file_id)
+    assert response.status_code == 200 and layer1 == data
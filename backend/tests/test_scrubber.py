@@ -0,0 +1,105 @@
+"""
+存储巡检与监控接口
+"""
+import os
+import pytest
+from models import Blob, File, db
+from storage.scrubber import QUARANTINE_DIR, StorageScrubber
+
+
+@pytest.fixture
+def stored(app, local_storage, make_user, upload):
+    """上传一个本地单文件存放的密文，返回 (密文记录ID, 密文路径)"""
+    app.config['PACK_SMALL_BLOBS'] = False
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'0123456789').get_json()['file']['id']
+    blob = db.session.get(File, file_id).blob
+    return blob.id, blob.storage_path
+
+
+def _overwrite(path):
+    with open(path, 'r+b') as f:
+        f.write(b'X')
+
+
+def _append(path):
+    with open(path, 'ab') as f:
+        f.write(b'extra')
+
+
+def _scrub(**options):
+    options.setdefault('orphan_min_age', 0)
+    report = StorageScrubber(workers=2, **options).run()
+    db.session.expire_all()
+    return report
+
+
+def test_intact_blob_is_verified(stored):
+    blob_id, _ = stored
+    report = _scrub()
+    assert report['completed'] and report['checked'] == 1 and report['bytes'] == 10
+    assert not (report['missing'] or report['size'] or report['corrupt'] or report['errors'])
+    assert report['orphans'] == 0
+    blob = db.session.get(Blob, blob_id)
+    assert blob.verified_at is not None and blob.scrub_error is None
+
+
+@pytest.mark.parametrize('damage, expected', [
+    (_overwrite, 'corrupt'),
+    (_append, 'size'),
+    (os.remove, 'missing'),
+])
+def test_damaged_blob_is_reported(stored, damage, expected):
+    blob_id, path = stored
+    damage(path)
+    report = _scrub()
+    assert report[expected] == [blob_id]
+    assert db.session.get(Blob, blob_id).scrub_error == expected
+
+
+def test_size_only_mode_skips_reading(stored):
+    blob_id, path = stored
+    _overwrite(path)
+    report = _scrub(verify_hashes=False)
+    assert report['checked'] == 1 and report['corrupt'] == [] and report['bytes'] == 0
+
+
+def test_orphans_are_only_reported_by_default(stored, local_storage):
+    stray = local_storage / 'default-stray.bin'
+    stray.write_bytes(b'leftover')
+    report = _scrub()
+    assert report['orphans'] == 1 and report['quarantined'] == 0
+    assert report['orphan_paths'] == [str(stray)]
+    assert stray.exists()
+
+
+def test_quarantine_moves_orphans_and_keeps_referenced_files(stored, local_storage):
+    _, path = stored
+    stray = local_storage / 'nested' / 'stray.bin'
+    stray.parent.mkdir(parents=True)
+    stray.write_bytes(b'leftover')
+    report = _scrub(quarantine=True)
+    assert report['quarantined'] == 1
+    assert not stray.exists() and os.path.exists(path)
+    moved = [os.path.join(root, name) for root, _, names in os.walk(local_storage / QUARANTINE_DIR) for name in names]
+    assert len(moved) == 1 and moved[0].endswith(os.path.join('nested', 'stray.bin'))
+
+
+def test_recent_files_are_not_orphans(stored, local_storage):
+    (local_storage / 'fresh.bin').write_bytes(b'in flight')
+    report = _scrub(quarantine=True, orphan_min_age=3600)
+    assert report['orphans'] == 0 and (local_storage / 'fresh.bin').exists()
+
+
+def test_metrics_require_token(app, client, stored):
+    assert client.get('/api/metrics').status_code == 404
+    app.config['METRICS_TOKEN'] = 'metrics-secret'
+    assert client.get('/api/metrics').status_code == 401
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    _scrub()
+    response = client.get('/api/metrics', headers={'Authorization': 'Bearer metrics-secret'})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert 'hit_ratio' in body['hot_blob_cache']
+    assert body['storage_scrub']['checked'] == 1
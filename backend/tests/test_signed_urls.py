@@ -0,0 +1,119 @@
+"""
+预签名下载链接
+"""
+import pytest
+from tests.test_versions import _new_version
+from utils.signed_urls import DownloadSigner
+
+
+def test_sign_and_verify_current(app):
+    args = DownloadSigner.sign(7, 'current', 60, issuer_id=3)
+    assert DownloadSigner.verify(7, args) == (True, None, None)
+
+
+def test_sign_and_verify_version(app):
+    args = DownloadSigner.sign(7, 'version:4', 60, issuer_id=3)
+    assert DownloadSigner.verify(7, args) == (True, 4, None)
+
+
+@pytest.mark.parametrize('field, value', [
+    ('scope', 'version:1'),
+    ('expires', None),
+    ('uid', 4),
+    ('signature', '0' * 64),
+])
+def test_tampered_link_is_rejected(app, field, value):
+    args = DownloadSigner.sign(7, 'current', 60, issuer_id=3)
+    args[field] = args['expires'] + 3600 if value is None else value
+    valid, _, error = DownloadSigner.verify(7, {key: str(item) for key, item in args.items()})
+    assert not valid and error == '链接签名无效'
+
+
+def test_link_is_bound_to_file(app):
+    args = DownloadSigner.sign(7, 'current', 60, issuer_id=3)
+    assert DownloadSigner.verify(8, args)[0] is False
+
+
+def test_expired_link_is_rejected(app):
+    args = DownloadSigner.sign(7, 'current', -1, issuer_id=3)
+    assert DownloadSigner.verify(7, args) == (False, None, '链接已过期')
+
+
+def test_secret_key_change_invalidates_links(app):
+    args = DownloadSigner.sign(7, 'current', 60, issuer_id=3)
+    app.config['SECRET_KEY'] = 'rotated-secret'
+    assert DownloadSigner.verify(7, args)[2] == '链接签名无效'
+
+
+@pytest.mark.parametrize('args', [
+    {},
+    {'scope': 'current', 'expires': 'soon', 'uid': '1', 'signature': 'x'},
+    {'scope': 'version:0', 'expires': '1', 'uid': '1', 'signature': 'x'},
+    {'scope': 'latest', 'expires': '1', 'uid': '1', 'signature': 'x'},
+])
+def test_malformed_link_is_rejected(app, args):
+    assert DownloadSigner.verify(7, args) == (False, None, '链接参数无效')
+
+
+@pytest.mark.parametrize('scope', ['', 'latest', 'version:', 'version:-1', 'version:x'])
+def test_sign_rejects_invalid_scope(app, scope):
+    with pytest.raises(ValueError):
+        DownloadSigner.sign(7, scope, 60, issuer_id=3)
+
+
+def _sign(client, headers, file_id, **body):
+    return client.post(f'/api/files/{file_id}/signed-url', headers=headers, json=body)
+
+
+def test_link_downloads_without_session(client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'ciphertext').get_json()['file']['id']
+    response = _sign(client, headers, file_id, expires_in=60)
+    assert response.status_code == 201 and response.get_json()['scope'] == 'current'
+
+    download = client.get(response.get_json()['path'])
+    assert download.status_code == 200 and download.data == b'ciphertext'
+    assert download.headers['X-Transport-Encryption'] == 'none'
+    assert download.headers['Cache-Control'] == 'no-cache'
+
+
+def test_version_link_keeps_serving_that_version(client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'first').get_json()['file']['id']
+    path = _sign(client, headers, file_id, version=1).get_json()['path']
+    _new_version(client, headers, file_id, b'second')
+
+    download = client.get(path)
+    assert download.status_code == 200 and download.data == b'first'
+    assert download.headers['Cache-Control'].startswith('public, max-age=')
+    assert _sign(client, headers, file_id, version=9).status_code == 404
+
+
+def test_tampered_path_is_rejected(client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'ciphertext').get_json()['file']['id']
+    path = _sign(client, headers, file_id).get_json()['path']
+    assert client.get(path.replace('scope=current', 'scope=version:1')).status_code == 403
+
+
+@pytest.mark.parametrize('expires_in', [-5, 'soon', 10 ** 9])
+def test_invalid_lifetime_is_rejected(client, make_user, upload, expires_in):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'ciphertext').get_json()['file']['id']
+    assert _sign(client, headers, file_id, expires_in=expires_in).status_code == 400
+
+
+def test_only_readers_can_sign(client, make_user, upload):
+    _, alice = make_user('alice')
+    _, mallory = make_user('mallory')
+    file_id = upload(alice, b'ciphertext').get_json()['file']['id']
+    assert _sign(client, mallory, file_id).status_code == 403
+    assert client.post(f'/api/files/{file_id}/signed-url', json={}).status_code == 401
+
+
+def test_link_stops_working_once_file_is_deleted(client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'ciphertext').get_json()['file']['id']
+    path = _sign(client, headers, file_id).get_json()['path']
+    client.delete(f'/api/files/{file_id}', headers=headers)
+    assert client.get(path).status_code == 404
@@ -0,0 +1,65 @@
+"""
+回收站的恢复与永久删除权限
+"""
+from models import File, GroupMember, db
+
+
+def _group_with_member(make_user, create_group):
+    owner, owner_headers = make_user('owner')
+    member, member_headers = make_user('member')
+    other, other_headers = make_user('other')
+    group_id = create_group(owner_headers, members=[member.id, other.id])
+    return group_id, owner_headers, (member, member_headers), other_headers
+
+
+def _trash(client, headers, file_id):
+    assert client.delete(f'/api/files/{file_id}', headers=headers).status_code == 200
+
+
+def test_personal_trash_restore_and_purge(client, make_user, upload):
+    _, headers = make_user('alice')
+    _, other_headers = make_user('bob')
+    file_id = upload(headers, b'data').get_json()['file']['id']
+    _trash(client, headers, file_id)
+
+    assert [f['id'] for f in client.get('/api/files/trash', headers=headers).get_json()['files']] == [file_id]
+    assert client.post(f'/api/files/trash/{file_id}/restore', headers=other_headers).status_code == 403
+    assert client.post(f'/api/files/trash/{file_id}/restore', headers=headers).status_code == 200
+
+    _trash(client, headers, file_id)
+    assert client.delete(f'/api/files/trash/{file_id}', headers=other_headers).status_code == 403
+    assert client.delete(f'/api/files/trash/{file_id}', headers=headers).status_code == 200
+    assert db.session.get(File, file_id) is None
+
+
+def test_member_purges_only_own_or_self_deleted_files(client, make_user, create_group, upload):
+    group_id, owner_headers, (member, member_headers), other_headers = _group_with_member(make_user, create_group)
+    owners_file = upload(owner_headers, b'a', group_id=group_id).get_json()['file']['id']
+    members_file = upload(member_headers, b'b', group_id=group_id).get_json()['file']['id']
+    deleted_by_member = upload(owner_headers, b'c', group_id=group_id).get_json()['file']['id']
+    _trash(client, owner_headers, owners_file)
+    _trash(client, other_headers, members_file)
+    _trash(client, member_headers, deleted_by_member)
+
+    assert client.delete(f'/api/files/trash/{owners_file}', headers=member_headers).status_code == 403
+    assert client.delete(f'/api/files/trash/{members_file}', headers=member_headers).status_code == 200
+    assert client.delete(f'/api/files/trash/{deleted_by_member}', headers=member_headers).status_code == 200
+    # 组管理员可以永久删除组内任意文件
+    assert client.delete(f'/api/files/trash/{owners_file}', headers=owner_headers).status_code == 200
+
+
+def test_only_group_admins_empty_group_trash(client, make_user, create_group, upload):
+    group_id, owner_headers, (member, member_headers), _ = _group_with_member(make_user, create_group)
+    for data in (b'a', b'b'):
+        _trash(client, member_headers, upload(member_headers, data, group_id=group_id).get_json()['file']['id'])
+
+    response = client.post('/api/files/trash/empty', headers=member_headers, json={'group_id': group_id})
+    assert response.status_code == 403
+    assert File.query.count() == 2
+
+    GroupMember.query.filter_by(group_id=group_id, user_id=member.id).update({'role': 'admin'})
+    db.session.commit()
+    response = client.post('/api/files/trash/empty', headers=member_headers, json={'group_id': group_id})
+    assert response.status_code == 200
+    assert File.query.count() == 0
+    assert client.post('/api/files/trash/empty', headers=member_headers, json={'group_id': 'x'}).status_code == 400
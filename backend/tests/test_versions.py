@@ -0,0 +1,95 @@
+"""
+文件版本与分段共享
+"""
+import io
+from collections import Counter
+from datetime import datetime
+from models import Blob, File, db
+from storage import VersionStore
+from tests.conftest import encrypt_transport
+from tests.test_blobs import _add_file, _write_blob
+
+
+def _new_version(client, headers, file_id, data: bytes):
+    response = client.post(f'/api/files/{file_id}/versions', headers=headers, data={
+        'file': (io.BytesIO(encrypt_transport(data)), 'a.bin'), 'encrypted_file_key': 'efk2'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
+
+
+def test_versions_share_unchanged_segments(app, client, make_user, upload, download):
+    app.config['VERSION_SEGMENT_SIZE'] = 4
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'aaaabbbbcccc').get_json()['file']['id']
+
+    # 第1版是整体上传的单个密文，第2版起按分段存储
+    assert _new_version(client, headers, file_id, b'aaaabbbbdddd')['new_segments'] == 3
+    body = _new_version(client, headers, file_id, b'aaaabbbbeeee')
+    assert body['version']['version'] == 3 and body['new_segments'] == 1
+    assert download(headers, file_id)[1] == b'aaaabbbbeeee'
+    assert client.get(f'/api/files/{file_id}/versions/1/download', headers=headers).status_code == 200
+    versions = client.get(f'/api/files/{file_id}/versions', headers=headers).get_json()['versions']
+    assert sorted(v['version'] for v in versions) == [1, 2, 3]
+
+
+def test_versioned_file_drops_stale_path(client, make_user, upload, download):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'first').get_json()['file']['id']
+    _new_version(client, headers, file_id, b'second')
+    assert db.session.get(File, file_id).file_path == ''
+
+    # 复制版本化文件不继承任何存储路径，内容来自分段
+    response = client.post(f'/api/files/{file_id}/copy', headers=headers, json={'encrypted_file_key': 'k'})
+    copy_id = response.get_json()['file']['id']
+    copied = db.session.get(File, copy_id)
+    assert copied.file_path == '' and copied.current_version_id is not None
+    assert download(headers, copy_id)[1] == b'second'
+
+
+def test_clear_stale_paths_fixes_existing_rows(client, make_user, upload):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'first').get_json()['file']['id']
+    _new_version(client, headers, file_id, b'second')
+    File.query.filter_by(id=file_id).update({File.file_path: 'memory://stale'})
+    db.session.commit()
+
+    assert VersionStore.clear_stale_paths() == 1
+    db.session.commit()
+    assert db.session.get(File, file_id).file_path == ''
+    assert VersionStore.clear_stale_paths() == 0
+
+
+def test_adjust_refs_revives_orphaned_segments(user):
+    blob = _write_blob(b'segment')
+    blob.ref_count = 0
+    blob.orphaned_at = datetime.now()
+    db.session.commit()
+
+    VersionStore.adjust_refs(Counter({blob.id: 1}), 1)
+    db.session.commit()
+    db.session.refresh(blob)
+    assert blob.ref_count == 1 and blob.orphaned_at is None
+
+    VersionStore.adjust_refs(Counter({blob.id: 1}), -1)
+    db.session.commit()
+    db.session.refresh(blob)
+    assert blob.ref_count == 0 and blob.orphaned_at is not None
+
+
+def test_retention_and_restore(client, make_user, upload, download):
+    _, headers = make_user('alice')
+    file_id = upload(headers, b'v1').get_json()['file']['id']
+    _new_version(client, headers, file_id, b'v2')
+    _new_version(client, headers, file_id, b'v3')
+
+    response = client.post(f'/api/files/{file_id}/versions/1/restore', headers=headers)
+    assert response.status_code == 200 and response.get_json()['version']['version'] == 4
+    assert download(headers, file_id)[1] == b'v1'
+
+    response = client.put(f'/api/files/{file_id}/versions/retention', headers=headers, json={'keep_last': 2})
+    assert response.get_json()['removed_versions'] == 2
+    versions = client.get(f'/api/files/{file_id}/versions', headers=headers).get_json()['versions']
+    assert sorted(v['version'] for v in versions) == [3, 4]
+    assert client.put(f'/api/files/{file_id}/versions/retention', headers=headers,
+                      json={'keep_last': 0}).status_code == 400
@@ -0,0 +1,162 @@
+"""
+访问控制工具
+缓存用户的组成员关系（仅用于列表和界面展示），并提供以数据库为准的授权检查
+"""
+from flask import current_app, has_app_context
+from sqlalchemy import and_, or_
+from models import File, Folder, GroupMember, db
+from utils.cache import TTLCache
+
+ADMIN_ROLES = ('owner', 'admin')
+
+
+class MembershipCache:
+    """
+    用户组成员关系缓存
+
+    按用户缓存 {group_id: role}，过期时间由 MEMBERSHIP_CACHE_TTL 配置。
+    成员关系发生变化（创建组、批准申请、移除成员）时必须显式失效。
+    多进程部署下其他进程的缓存最多滞后一个TTL，因此只用于列表和界面展示；
+    写操作、上传和管理操作的授权使用 get_member_role / is_group_member / is_group_admin。
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 10000):
+        self._cache = TTLCache(ttl=ttl, max_entries=max_entries)
+
+    def _ttl(self):
+        if has_app_context():
+            return current_app.config.get('MEMBERSHIP_CACHE_TTL', self._cache.ttl)
+        return self._cache.ttl
+
+    def get_roles(self, user_id: int) -> dict:
+        """获取用户所在的全部组及角色 {group_id: role}"""
+        roles = self._cache.get(user_id)
+        if roles is None:
+            rows = db.session.query(GroupMember.group_id, GroupMember.role).filter(
+                GroupMember.user_id == user_id
+            ).all()
+            roles = {group_id: role for group_id, role in rows}
+            self._cache.set(user_id, roles, ttl=self._ttl())
+        return roles
+
+    def get_group_ids(self, user_id: int) -> set:
+        """获取用户所在的全部组ID"""
+        return set(self.get_roles(user_id))
+
+    def get_role(self, user_id: int, group_id: int):
+        """获取用户在组内的角色，不是成员时返回None"""
+        if group_id is None:
+            return None
+        return self.get_roles(user_id).get(int(group_id))
+
+    def is_member(self, user_id: int, group_id: int) -> bool:
+        return self.get_role(user_id, group_id) is not None
+
+    def is_admin(self, user_id: int, group_id: int) -> bool:
+        return self.get_role(user_id, group_id) in ADMIN_ROLES
+
+    def invalidate(self, *user_ids):
+        """使指定用户的缓存失效"""
+        for user_id in user_ids:
+            self._cache.pop(user_id)
+
+    def invalidate_group(self, group_id: int):
+        """使所有缓存了该组的用户失效"""
+        self._cache.discard_where(lambda _, roles: group_id in roles)
+
+    def clear(self):
+        self._cache.clear()
+
+
+membership_cache = MembershipCache()
+
+
+def get_member_role(user_id: int, group_id: int):
+    """从数据库读取用户在组内的角色（授权以此为准），不是成员时返回None"""
+    if group_id is None:
+        return None
+    return db.session.query(GroupMember.role).filter(
+        GroupMember.user_id == user_id,
+        GroupMember.group_id == int(group_id)
+    ).scalar()
+
+
+def is_group_member(user_id: int, group_id: int) -> bool:
+    return get_member_role(user_id, group_id) is not None
+
+
+def is_group_admin(user_id: int, group_id: int) -> bool:
+    return get_member_role(user_id, group_id) in ADMIN_ROLES
+
+
+def get_file_for_user(user_id: int, file_id: int, in_trash: bool = False):
+    """
+    单次查询加载文件并判断访问权限
+
+    通过左连接 GroupMember 同时取回文件和用户在文件所属组内的角色，
+    授权结果以数据库为准，不依赖成员关系缓存。
+    默认只查找正常文件，in_trash=True 时只查找回收站中的文件。
+
+    Returns:
+        tuple: (file, allowed, role) - 文件不存在时file为None
+    """
+    row = db.session.query(File, GroupMember.role).outerjoin(
+        GroupMember,
+        and_(
+            GroupMember.group_id == File.group_id,
+            GroupMember.user_id == user_id
+        )
+    ).filter(
+        File.id == file_id,
+        File.deleted_at.isnot(None) if in_trash else File.deleted_at.is_(None)
+    ).first()
+
+    if row is None:
+        return None, False, None
+
+    file_record, role = row
+    allowed = file_record.owner_id == user_id or role is not None
+    return file_record, allowed, role
+
+
+def accessible_files_query(user_id: int):
+    """
+    构造当前用户可访问的正常文件（不含回收站）的查询
+
+    所有权和组成员关系在同一条SQL中判断（成员关系以子查询表达），
+    适合对一批文件ID做集合式授权。
+    """
+    member_groups = db.session.query(GroupMember.group_id).filter(GroupMember.user_id == user_id)
+    return File.query.filter(
+        File.deleted_at.is_(None),
+        or_(
+            File.owner_id == user_id,
+            File.group_id.in_(member_groups)
+        )
+    )
+
+
+def get_folder_for_user(user_id: int, folder_id: int):
+    """
+    单次查询加载文件夹并判断访问权限
+
+    个人文件夹仅所有者可访问，组文件夹对组成员开放。
+
+    Returns:
+        tuple: (folder, allowed) - 文件夹不存在时folder为None
+    """
+    row = db.session.query(Folder, GroupMember.role).outerjoin(
+        GroupMember,
+        and_(
+            GroupMember.group_id == Folder.group_id,
+            GroupMember.user_id == user_id
+        )
+    ).filter(Folder.id == folder_id).first()
+
+    if row is None:
+        return None, False
+
+    folder, role = row
+    if folder.group_id:
+        return folder, role is not None
+    return folder, folder.owner_id == user_id
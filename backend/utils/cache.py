@@ -0,0 +1,197 @@
+"""
+内存缓存工具
+带过期时间（TTL）和容量上限的线程安全缓存，以及按字节数限制容量的单飞加载缓存
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """带TTL和容量上限的LRU缓存"""
+
+    def __init__(self, ttl: float = 60, max_entries: int = 10000):
+        """
+        Args:
+            ttl: 默认过期时间（秒）
+            max_entries: 最大条目数，超出后淘汰最久未使用的条目
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """获取缓存值，不存在或已过期时返回default"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """写入缓存值"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """删除并返回缓存值"""
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def discard_where(self, predicate):
+        """删除所有满足 predicate(key, value) 的条目"""
+        with self._lock:
+            stale = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for k in stale:
+                del self._data[k]
+        return len(stale)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class _Flight:
+    """一次进行中的加载（同一个键的并发未命中等待同一次加载）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class ByteLRUCache:
+    """
+    按字节数限制容量的LRU缓存，带单飞加载
+
+    同一个键的并发未命中只调用一次 loader，其余请求等待其结果。
+    """
+
+    def __init__(self, capacity: int = 0, max_item_size: int = None):
+        """
+        Args:
+            capacity: 缓存的总字节数上限，0表示不缓存（仍合并并发加载）
+            max_item_size: 单个条目的字节数上限，超过时不缓存
+        """
+        self.capacity = capacity
+        self.max_item_size = max_item_size
+        self._data = OrderedDict()  # key -> bytes
+        self._flights = {}  # key -> _Flight
+        self._size = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'bypassed': 0}
+
+    def resize(self, capacity: int, max_item_size: int = None):
+        """调整容量，缩小时立即淘汰"""
+        with self._lock:
+            self.capacity = capacity
+            self.max_item_size = max_item_size
+            self._evict()
+
+    def _cacheable(self, size: int) -> bool:
+        return size <= self.capacity and (self.max_item_size is None or size <= self.max_item_size)
+
+    def _evict(self):
+        """淘汰最久未使用的条目直到不超过容量（调用方持有锁）"""
+        while self._size > self.capacity and self._data:
+            _, value = self._data.popitem(last=False)
+            self._size -= len(value)
+            self._counters['evictions'] += 1
+
+    def get_or_load(self, key, loader, size_hint: int = None) -> bytes:
+        """
+        获取缓存值，未命中时调用 loader() 加载
+
+        Args:
+            size_hint: 预计大小，超过单个条目上限时直接加载且不参与缓存
+        """
+        if size_hint is not None and not self._cacheable(size_hint):
+            with self._lock:
+                self._counters['bypassed'] += 1
+            return loader()
+
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+                self._counters['hits'] += 1
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._counters['misses'] += 1
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                value = flight.value
+                if flight.error is None and not flight.stale and self._cacheable(len(value)):
+                    previous = self._data.pop(key, None)
+                    if previous is not None:
+                        self._size -= len(previous)
+                    self._data[key] = value
+                    self._size += len(value)
+                    self._evict()
+            flight.event.set()
+        return flight.value
+
+    def invalidate(self, key):
+        """删除条目；正在加载的结果不再写入缓存"""
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._size -= len(value)
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.stale = True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+            for flight in self._flights.values():
+                flight.stale = True
+
+    def stats(self) -> dict:
+        """命中率等统计（合并到进行中加载的请求计为命中）"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(entries=len(self._data), bytes=self._size, capacity=self.capacity)
+        lookups = stats['hits'] + stats['coalesced'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['coalesced']) / lookups, 4) if lookups else None
+        return stats
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,96 @@
+"""
+幂等请求
+客户端通过 Idempotency-Key 请求头标识一次逻辑请求，超时重试时直接返回第一次的结果
+"""
+from flask import current_app, has_app_context, make_response, request, jsonify
+from utils.cache import TTLCache
+from functools import wraps
+import threading
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+_IN_FLIGHT = object()
+
+
+class IdempotencyCache:
+    """
+    幂等请求结果缓存
+
+    以 (用户ID, 接口, Idempotency-Key) 为键缓存成功响应，过期时间由 IDEMPOTENCY_TTL 配置。
+    同一个键的请求仍在处理时，重复请求返回409，避免并发重试生成两份数据。
+    缓存在进程内，多进程部署时需要让同一客户端的重试落到同一进程（或换成共享存储）。
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 10000):
+        self._cache = TTLCache(ttl=ttl, max_entries=max_entries)
+        self._lock = threading.Lock()
+
+    def _ttl(self):
+        if has_app_context():
+            return current_app.config.get('IDEMPOTENCY_TTL', self._cache.ttl)
+        return self._cache.ttl
+
+    def begin(self, key):
+        """
+        登记一个请求
+
+        Returns:
+            tuple: (started, cached) - started为False时cached为缓存的响应，None表示仍在处理
+        """
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return False, None if cached is _IN_FLIGHT else cached
+            self._cache.set(key, _IN_FLIGHT, ttl=self._ttl())
+            return True, None
+
+    def finish(self, key, response):
+        """保存成功响应；失败的请求不缓存，允许客户端重试"""
+        if 200 <= response.status_code < 300:
+            self._cache.set(key, (response.get_data(), response.status_code, response.mimetype), ttl=self._ttl())
+        else:
+            self._cache.pop(key)
+
+    def abort(self, key):
+        self._cache.pop(key)
+
+    def clear(self):
+        self._cache.clear()
+
+
+idempotency_cache = IdempotencyCache()
+
+
+def idempotent(f):
+    """
+    幂等装饰器（放在 require_auth 之后，视图第一个参数为当前用户）
+
+    请求未携带 Idempotency-Key 时不做任何处理。
+    """
+    @wraps(f)
+    def wrapper(user, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return f(user, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': 'Idempotency-Key 过长'}), 400
+
+        cache_key = (user.id, request.endpoint, key)
+        started, cached = idempotency_cache.begin(cache_key)
+        if not started:
+            if cached is None:
+                return jsonify({'error': '相同 Idempotency-Key 的请求正在处理中'}), 409
+            data, status, mimetype = cached
+            response = current_app.response_class(data, status=status, mimetype=mimetype)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(f(user, *args, **kwargs))
+        except Exception:
+            idempotency_cache.abort(cache_key)
+            raise
+        idempotency_cache.finish(cache_key, response)
+        return response
+    return wrapper
@@ -0,0 +1,121 @@
+"""
+存储配额
+个人空间和组空间的已用字节数物化为计数列，上传、永久删除、跨空间移动时在同一事务中更新；
+配额检查与计数合并为一条带条件的UPDATE，不需要汇总文件表。
+计数以文件当前大小计（含回收站中的文件，历史版本不计），后台任务定期重新统计修正偏差。
+"""
+from flask import current_app
+from sqlalchemy import func
+from models import File, User, UserGroup, db
+import time
+
+
+class QuotaExceeded(Exception):
+    """空间配额不足"""
+
+    def __init__(self, group_id=None):
+        self.group_id = group_id
+        super().__init__('组空间配额不足' if group_id else '个人空间配额不足')
+
+
+class QuotaManager:
+    """空间用量计数与配额检查"""
+
+    @staticmethod
+    def _space(owner_id: int, group_id: int):
+        """返回 (模型, 空间ID, 全局默认配额)"""
+        if group_id:
+            return UserGroup, group_id, current_app.config.get('GROUP_QUOTA_BYTES')
+        return User, owner_id, current_app.config.get('USER_QUOTA_BYTES')
+
+    @staticmethod
+    def charge(owner_id: int, group_id: int, delta: int):
+        """
+        调整空间已用字节（不提交事务）
+
+        增加用量时检查配额与更新计数在同一条语句中完成，并发上传不会超出配额。
+
+        Raises:
+            QuotaExceeded: 增加后超出配额
+        """
+        if not delta:
+            return
+        model, space_id, default_quota = QuotaManager._space(owner_id, group_id)
+        query = model.query.filter(model.id == space_id)
+        if delta > 0:
+            limit = model.quota_bytes if default_quota is None else func.coalesce(model.quota_bytes, default_quota)
+            query = query.filter(db.or_(limit.is_(None), model.used_bytes + delta <= limit))
+        updated = query.update({model.used_bytes: model.used_bytes + delta}, synchronize_session=False)
+        if delta > 0 and not updated:
+            raise QuotaExceeded(group_id)
+
+    @staticmethod
+    def release(owner_id: int, group_id: int, size: int):
+        """减少空间已用字节（不提交事务）"""
+        QuotaManager.charge(owner_id, group_id, -size)
+
+    @staticmethod
+    def release_files(file_ids):
+        """
+        按空间汇总并释放一组即将永久删除的文件的用量（不提交事务）
+
+        Args:
+            file_ids: File.id 的子查询（select）
+        """
+        rows = db.session.query(File.owner_id, File.group_id, func.sum(File.file_size)).filter(
+            File.id.in_(file_ids)
+        ).group_by(File.owner_id, File.group_id).all()
+        for owner_id, group_id, size in rows:
+            QuotaManager.release(owner_id, group_id, size or 0)
+
+    @staticmethod
+    def usage(owner_id: int, group_id: int = None) -> dict:
+        """读取空间用量和配额（按主键读取一行）"""
+        model, space_id, default_quota = QuotaManager._space(owner_id, group_id)
+        row = db.session.query(model.used_bytes, model.quota_bytes).filter(model.id == space_id).first()
+        if row is None:
+            return None
+        used_bytes, quota_bytes = row
+        return {
+            'used_bytes': used_bytes or 0,
+            'quota_bytes': quota_bytes if quota_bytes is not None else default_quota
+        }
+
+    @staticmethod
+    def reconcile_batch(model, after_id: int = 0, batch_size: int = 200):
+        """
+        按实际文件重新统计一批空间的用量
+
+        Returns:
+            int: 本批最后一个空间ID，没有更多空间时返回None
+        """
+        space_ids = [space_id for (space_id,) in db.session.query(model.id).filter(
+            model.id > after_id
+        ).order_by(model.id).limit(batch_size)]
+        if not space_ids:
+            return None
+
+        if model is User:
+            in_space = db.and_(File.owner_id == User.id, File.group_id.is_(None))
+        else:
+            in_space = File.group_id == UserGroup.id
+        actual = db.session.query(func.coalesce(func.sum(File.file_size), 0)).filter(in_space).scalar_subquery()
+
+        model.query.filter(model.id.in_(space_ids)).update(
+            {model.used_bytes: actual}, synchronize_session=False
+        )
+        db.session.commit()
+        return space_ids[-1]
+
+    @staticmethod
+    def reconcile_all(batch_size: int = 200, pause: float = 0) -> int:
+        """分批重新统计全部个人空间和组空间的用量，批与批之间间隔 pause 秒"""
+        batches = 0
+        for model in (User, UserGroup):
+            last_id = 0
+            while last_id is not None:
+                if batches and pause:
+                    time.sleep(pause)
+                last_id = QuotaManager.reconcile_batch(model, last_id, batch_size)
+                batches += 1
+        return batches
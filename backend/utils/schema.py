@@ -0,0 +1,62 @@
+"""
+数据库结构升级
+db.create_all() 只创建缺少的表，不会给已有的表增加列；
+这里按模型定义补建缺少的表、列和索引，可重复执行（已存在的部分直接跳过）。
+"""
+from sqlalchemy import inspect, literal
+from sqlalchemy.schema import CreateColumn
+from models import db
+
+
+def _column_ddl(column, dialect) -> str:
+    """ALTER TABLE ADD COLUMN 使用的列定义，带标量默认值时同时作为数据库默认值回填已有行"""
+    ddl = str(CreateColumn(column).compile(dialect=dialect))
+    default = column.default
+    if column.server_default is None and default is not None and default.is_scalar:
+        value = literal(default.arg, type_=column.type).compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}
+        )
+        ddl += f' DEFAULT {value}'
+    return ddl
+
+
+def upgrade_schema() -> list:
+    """
+    补建缺少的表、列和索引
+
+    新增列的外键约束不会补建（SQLite 不支持给已有表增加约束），
+    非空且没有标量默认值的列无法给已有行赋值，以可空方式增加。
+
+    Returns:
+        list: 执行的变更说明
+    """
+    engine = db.engine
+    changes = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                table.create(conn)
+                changes.append(f'创建表 {table.name}')
+                continue
+
+            columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                if not column.nullable and (column.default is None or not column.default.is_scalar) \
+                        and column.server_default is None:
+                    column = column._copy()
+                    column.nullable = True
+                ddl = _column_ddl(column, engine.dialect)
+                table_name = engine.dialect.identifier_preparer.format_table(table)
+                conn.exec_driver_sql(f'ALTER TABLE {table_name} ADD COLUMN {ddl}')
+                changes.append(f'增加列 {table.name}.{column.name}')
+
+            indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    changes.append(f'创建索引 {index.name}')
+    return changes
@@ -0,0 +1,89 @@
+"""
+预签名下载链接
+链接中带有文件ID、过期时间和范围，由服务器密钥做HMAC签名；
+下载时只校验签名和过期时间，不查询会话和组成员关系，适合脚本和CDN高并发拉取。
+
+链接在过期前一直有效（签发后移除组成员或撤销会话不会使其失效），
+因此有效期受 SIGNED_URL_MAX_TTL 限制；文件进入回收站后链接立即失效。
+多进程部署时各进程必须配置相同的 SECRET_KEY。
+"""
+from flask import current_app
+from crypto.hmac import HMACVerifier
+import hashlib
+import time
+
+# 范围: 文件的当前内容，或 version:<版本号> 指定的版本
+SCOPE_CURRENT = 'current'
+SCOPE_VERSION_PREFIX = 'version:'
+
+
+class DownloadSigner:
+    """下载链接的签名与校验"""
+
+    @staticmethod
+    def _key() -> bytes:
+        # 由 SECRET_KEY 派生独立的签名密钥，不与其他用途共用
+        secret = current_app.config['SECRET_KEY']
+        return hashlib.sha256(b'securedisk-download-url\x00' + secret.encode('utf-8')).digest()
+
+    @staticmethod
+    def _message(file_id: int, scope: str, expires: int, issuer_id: int) -> bytes:
+        return f'{file_id}\n{scope}\n{expires}\n{issuer_id}'.encode('utf-8')
+
+    @staticmethod
+    def parse_scope(scope: str):
+        """解析范围，返回版本号（当前内容为None）；格式错误时抛出 ValueError"""
+        if scope == SCOPE_CURRENT:
+            return None
+        if scope and scope.startswith(SCOPE_VERSION_PREFIX):
+            version = int(scope[len(SCOPE_VERSION_PREFIX):])
+            if version > 0:
+                return version
+        raise ValueError(f'无效的链接范围: {scope}')
+
+    @staticmethod
+    def sign(file_id: int, scope: str, expires_in: int, issuer_id: int) -> dict:
+        """
+        签发下载链接的查询参数
+
+        Args:
+            scope: current 或 version:<版本号>
+            expires_in: 有效期（秒）
+            issuer_id: 签发链接的用户ID（记录在链接中便于审计）
+
+        Returns:
+            dict: {'scope', 'expires', 'uid', 'signature'}
+        """
+        DownloadSigner.parse_scope(scope)
+        expires = int(time.time()) + expires_in
+        signature = HMACVerifier.generate_hmac(
+            DownloadSigner._message(file_id, scope, expires, issuer_id), DownloadSigner._key()
+        )
+        return {'scope': scope, 'expires': expires, 'uid': issuer_id, 'signature': signature}
+
+    @staticmethod
+    def verify(file_id: int, args) -> tuple:
+        """
+        校验下载链接（一次HMAC计算，不访问数据库）
+
+        Args:
+            args: 链接的查询参数
+
+        Returns:
+            tuple: (is_valid, version_number, error) - version_number为None表示当前内容
+        """
+        scope = args.get('scope', '')
+        signature = args.get('signature', '')
+        try:
+            expires = int(args.get('expires', ''))
+            issuer_id = int(args.get('uid', ''))
+            version_number = DownloadSigner.parse_scope(scope)
+        except ValueError:
+            return False, None, '链接参数无效'
+
+        message = DownloadSigner._message(file_id, scope, expires, issuer_id)
+        if not signature or not HMACVerifier.verify_hmac(message, signature, DownloadSigner._key()):
+            return False, None, '链接签名无效'
+        if expires < time.time():
+            return False, None, '链接已过期'
+        return True, version_number, None
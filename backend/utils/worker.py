@@ -0,0 +1,43 @@
+"""
+后台任务线程
+按固定间隔在应用上下文中执行维护任务（密文清理等）
+"""
+import threading
+import time
+import traceback
+
+
+class PeriodicWorker(threading.Thread):
+    """周期性执行已注册任务的后台线程"""
+
+    def __init__(self, app, tick: float = 1.0, name: str = 'securedisk-worker'):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.tick = tick
+        self._tasks = []  # [name, interval, func, next_run]
+        self._stop_event = threading.Event()
+
+    def add_task(self, name: str, interval: float, func):
+        """注册任务，func 在应用上下文中无参调用"""
+        self._tasks.append([name, interval, func, time.monotonic() + interval])
+
+    def run(self):
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            for task in self._tasks:
+                name, interval, func, next_run = task
+                if now < next_run:
+                    continue
+                with self.app.app_context():
+                    try:
+                        func()
+                    except Exception as e:
+                        print(f"后台任务 {name} 执行失败: {e}")
+                        print(traceback.format_exc())
+                        from models import db
+                        db.session.rollback()
+                task[3] = time.monotonic() + interval
+            self._stop_event.wait(self.tick)
+
+    def stop(self):
+        self._stop_event.set()
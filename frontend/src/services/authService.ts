@@ -9,7 +9,7 @@ const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000/api
 export const keyStorage: {
     masterKey: CryptoKey | null;
     sessionKey: CryptoKey | null;
-    groupKeys: Record<number, CryptoKey>;
+    groupKeys: Record<string, CryptoKey>; // 键为 "组ID:密钥版本"，轮换期间新旧版本同时缓存
 } = {
     masterKey: null,
     sessionKey: null,
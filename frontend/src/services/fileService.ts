@@ -87,9 +87,12 @@ export const fileService = {
     const fileKeyRaw = await AESEncryption.exportKey(fileKey);
     
     let encryptionKey: CryptoKey;
+    let keyEpoch: number | null = null;
     if (groupId) {
-        // 如果是上传到组，使用组密钥加密文件密钥
-        encryptionKey = await groupService.getGroupKey(groupId);
+        // 如果是上传到组，使用组密钥的当前版本加密文件密钥，并告知服务器所用的版本
+        const current = await groupService.getCurrentGroupKey(groupId);
+        encryptionKey = current.key;
+        keyEpoch = current.epoch;
     } else {
         // 否则使用用户主密钥
         encryptionKey = keyStorage.masterKey!;
@@ -110,6 +113,7 @@ export const fileService = {
     
     if (groupId) {
       formData.append('group_id', groupId.toString());
+      formData.append('key_epoch', String(keyEpoch));
     }
 
     const response = await api.post('/files/upload', formData, {
@@ -153,8 +157,11 @@ export const fileService = {
     let decryptionKey: CryptoKey;
     
     if (fileGroupIdHeader) {
-        // 如果文件属于组，使用组密钥解密
-        decryptionKey = await groupService.getGroupKey(parseInt(fileGroupIdHeader));
+        // 如果文件属于组，使用封装该文件密钥的组密钥版本解密（轮换期间可能仍是旧版本）
+        decryptionKey = await groupService.getGroupKey(
+            parseInt(fileGroupIdHeader),
+            parseInt(response.headers['x-file-key-epoch'] || '1')
+        );
     } else {
         // 否则使用用户主密钥
         decryptionKey = keyStorage.masterKey!;
@@ -163,15 +170,18 @@ export const fileService = {
     const fileKeyRaw = await AESEncryption.decrypt(encryptedFileKey, decryptionKey);
     const fileKey = await AESEncryption.importKey(fileKeyRaw);
 
-    // 3. 解密传输层 (Layer 2) -> Layer 1
-    const layer2Data = new Uint8Array(response.data);
-    const layer2Iv = layer2Data.slice(0, 12);
-    const layer2Ciphertext = layer2Data.slice(12);
-    
-    const layer1DataRaw = await AESEncryption.decrypt(
-        { ciphertext: layer2Ciphertext, iv: layer2Iv },
-        keyStorage.sessionKey!
-    );
+    // 3. 解密传输层 (Layer 2) -> Layer 1（服务器关闭传输层加密时响应即为 Layer 1）
+    let layer1DataRaw: ArrayBuffer = response.data;
+    if (response.headers['x-transport-encryption'] !== 'none') {
+        const layer2Data = new Uint8Array(response.data);
+        const layer2Iv = layer2Data.slice(0, 12);
+        const layer2Ciphertext = layer2Data.slice(12);
+        
+        layer1DataRaw = await AESEncryption.decrypt(
+            { ciphertext: layer2Ciphertext, iv: layer2Iv },
+            keyStorage.sessionKey!
+        );
+    }
     
     // 4. 解密端到端层 (Layer 1) -> Plaintext
     const layer1Data = new Uint8Array(layer1DataRaw);
@@ -234,8 +244,11 @@ export const fileService = {
     let decryptionKey: CryptoKey;
     
     if (fileGroupIdHeader) {
-        // 如果文件属于组，使用组密钥解密
-        decryptionKey = await groupService.getGroupKey(parseInt(fileGroupIdHeader));
+        // 如果文件属于组，使用封装该文件密钥的组密钥版本解密（轮换期间可能仍是旧版本）
+        decryptionKey = await groupService.getGroupKey(
+            parseInt(fileGroupIdHeader),
+            parseInt(response.headers['x-file-key-epoch'] || '1')
+        );
     } else {
         // 否则使用用户主密钥
         decryptionKey = keyStorage.masterKey!;
@@ -244,15 +257,18 @@ export const fileService = {
     const fileKeyRaw = await AESEncryption.decrypt(encryptedFileKey, decryptionKey);
     const fileKey = await AESEncryption.importKey(fileKeyRaw);
 
-    // 3. 解密传输层 (Layer 2) -> Layer 1
-    const layer2Data = new Uint8Array(response.data);
-    const layer2Iv = layer2Data.slice(0, 12);
-    const layer2Ciphertext = layer2Data.slice(12);
-    
-    const layer1DataRaw = await AESEncryption.decrypt(
-        { ciphertext: layer2Ciphertext, iv: layer2Iv },
-        keyStorage.sessionKey!
-    );
+    // 3. 解密传输层 (Layer 2) -> Layer 1（服务器关闭传输层加密时响应即为 Layer 1）
+    let layer1DataRaw: ArrayBuffer = response.data;
+    if (response.headers['x-transport-encryption'] !== 'none') {
+        const layer2Data = new Uint8Array(response.data);
+        const layer2Iv = layer2Data.slice(0, 12);
+        const layer2Ciphertext = layer2Data.slice(12);
+        
+        layer1DataRaw = await AESEncryption.decrypt(
+            { ciphertext: layer2Ciphertext, iv: layer2Iv },
+            keyStorage.sessionKey!
+        );
+    }
     
     // 4. 解密端到端层 (Layer 1) -> Plaintext
     const layer1Data = new Uint8Array(layer1DataRaw);
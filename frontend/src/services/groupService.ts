@@ -31,6 +31,9 @@ api.interceptors.response.use(
   }
 );
 
+// 组密钥缓存的键：轮换期间同一组的新旧版本密钥同时存在
+const groupKeyCacheKey = (groupId: number, epoch: number) => `${groupId}:${epoch}`;
+
 export const groupService = {
   // 获取用户组列表
   async getGroupList() {
@@ -68,27 +71,41 @@ export const groupService = {
       encrypted_group_key: encryptedGroupKeyData
     });
 
-    // 缓存组密钥
+    // 缓存组密钥（新建的组为第1版）
     if (!keyStorage.groupKeys) keyStorage.groupKeys = {};
-    keyStorage.groupKeys[response.data.group.id] = groupKey;
+    keyStorage.groupKeys[groupKeyCacheKey(response.data.group.id, response.data.group.key_epoch || 1)] = groupKey;
 
     return response.data.group;
   },
 
-  // 获取并解密组密钥
-  async getGroupKey(groupId: number): Promise<CryptoKey> {
+  // 获取并解密指定版本的组密钥（解密文件密钥时使用文件记录的 key_epoch / X-File-Key-Epoch）
+  async getGroupKey(groupId: number, epoch: number): Promise<CryptoKey> {
     // 检查缓存
-    if (keyStorage.groupKeys && keyStorage.groupKeys[groupId]) {
-        return keyStorage.groupKeys[groupId];
+    const cached = keyStorage.groupKeys && keyStorage.groupKeys[groupKeyCacheKey(groupId, epoch)];
+    if (cached) {
+        return cached;
     }
 
+    const response = await api.get(`/groups/${groupId}/key`, { params: { epoch } });
+    return this.decryptGroupKey(groupId, response.data.epoch, response.data.encrypted_key);
+  },
+
+  // 获取组密钥的当前版本（上传和封装新文件密钥时使用），返回密钥及其版本号
+  async getCurrentGroupKey(groupId: number): Promise<{ key: CryptoKey; epoch: number }> {
+    // 不使用缓存判断当前版本：轮换后必须改用新版本封装
+    const response = await api.get(`/groups/${groupId}/key`);
+    const epoch: number = response.data.epoch;
+    const cached = keyStorage.groupKeys && keyStorage.groupKeys[groupKeyCacheKey(groupId, epoch)];
+    const key = cached || await this.decryptGroupKey(groupId, epoch, response.data.encrypted_key);
+    return { key, epoch };
+  },
+
+  // 解密服务器返回的组密钥并按 (组ID, 版本) 缓存
+  async decryptGroupKey(groupId: number, epoch: number, encryptedData: any): Promise<CryptoKey> {
     if (!keyStorage.masterKey) {
         throw new Error("NEED_UNLOCK:您的主密钥未解锁，无法执行组密钥加解密操作。如果您是通过邮箱登录的，请先解锁主密钥。");
     }
 
-    const response = await api.get(`/groups/${groupId}/key`);
-    const encryptedData = response.data.encrypted_key;
-
     let groupKey: CryptoKey;
 
     // 尝试解密。组密钥可能以两种方式存储：
@@ -116,13 +133,13 @@ export const groupService = {
      }
 
     if (!keyStorage.groupKeys) keyStorage.groupKeys = {};
-    keyStorage.groupKeys[groupId] = groupKey;
+    keyStorage.groupKeys[groupKeyCacheKey(groupId, epoch)] = groupKey;
     return groupKey;
   },
 
   // 共享组密钥给新成员 (由管理员调用)
    async shareGroupKey(groupId: number, targetUserId: number, targetPublicKey: string) {
-     const groupKey = await this.getGroupKey(groupId);
+     const { key: groupKey, epoch } = await this.getCurrentGroupKey(groupId);
      const groupKeyRaw = await AESEncryption.exportKey(groupKey);
  
      // 使用接收者的 RSA 公钥加密
@@ -131,7 +148,8 @@ export const groupService = {
      await api.post('/groups/share-key', {
          group_id: groupId,
          user_id: targetUserId,
-         encrypted_key: encryptedKeyBase64
+         encrypted_key: encryptedKeyBase64,
+         epoch
      });
    },
 